@@ -0,0 +1,195 @@
+"""
+CTC Forced Alignment - Viterbi (max-product) trellis
+Same transitions as forward_algorithm, with max instead of sum. Only the
+current score column is kept in floating point; the choice made at every
+(s, t) is stored as an int8 back-pointer (0: stay, 1: from s-1, 2: from s-2),
+and backtracking recovers the frames that produced each target token.
+Like ctc_engine, only the feasible band of the trellis is visited, and the
+score column is kept in the dtype asked for (float64 by default).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from ctc_engine import batch_band, batch_extended_labels, batch_min_frames, log_mask
+
+Alignment = namedtuple("Alignment", ["tokens", "starts", "ends", "scores", "states", "log_prob"])
+Alignment.__doc__ = """
+Best path of a target through the CTC trellis.
+
+tokens: (U,) target labels
+starts, ends: (U,) first and last frame (inclusive) emitting each token
+scores: (U,) sum of log P(token | t) over those frames
+states: (T,) extended-sequence state occupied at every frame
+log_prob: log-probability of the whole best path
+"""
+
+
+# ===== VITERBI RECURRENCE =====
+def viterbi_backpointers(
+    log_probs, rows, input_lengths, target_lengths, labels, skip, dtype=np.float64
+):
+    """
+    Max-product recurrence over a padded batch.
+
+    Args:
+        log_probs: (B_all, vocab_size, T_max) log-probabilities
+        rows: (B,) which utterances of log_probs to align (read in place)
+        input_lengths: (B,) number of valid frames per aligned utterance
+        target_lengths: (B,) number of valid labels per target
+        labels: (B, S) padded extended labels (see batch_extended_labels)
+        skip: (B, S) skip masks
+        dtype: Floating-point type of the score column
+
+    Returns:
+        backpointers: (B, S, T) int8 predecessor offsets, stored frame-major
+            so every column is written contiguously (T = max input length)
+        final: (B, S) best path scores at each utterance's last frame
+    """
+    B, S = labels.shape
+    T = int(input_lengths.max())
+    rows = np.asarray(rows)[:, None]
+    skip_penalty = log_mask(skip, dtype)
+    lo, hi = batch_band(input_lengths, target_lengths, T)
+
+    backpointers = np.zeros((B, S, T), dtype=np.int8, order="F")
+    final = np.full((B, S), -np.inf, dtype=dtype)
+
+    # Two -inf guard states in front of each row, as in forward_log
+    score = np.full((B, S + 2), -np.inf, dtype=dtype)
+    score[:, 2 + lo[0] : 2 + min(S, 2)] = log_probs[rows, labels[:, lo[0] : 2], 0]
+
+    for t in range(T):
+        if t > 0:
+            l, h = lo[t], hi[t]
+            stay = score[:, 2 + l : 2 + h]
+            step = score[:, 1 + l : 1 + h]
+            jump = score[:, l:h] + skip_penalty[:, l:h]
+            pointer = (step > stay).astype(np.int8)
+            best = np.maximum(stay, step)
+            from_jump = jump > best
+            pointer[from_jump] = 2
+            np.maximum(best, jump, out=best)
+            backpointers[:, l:h, t] = pointer
+            score[:, 2 + l : 2 + h] = best + log_probs[rows, labels[:, l:h], t]
+
+        ending = input_lengths == t + 1
+        final[ending] = score[ending, 2:]
+
+    return backpointers, final
+
+
+# ===== FORCED ALIGNMENT =====
+def viterbi_align_batch(
+    log_probs, input_lengths, targets, target_lengths, blank, dtype=np.float64
+):
+    """
+    Forced alignment of a padded batch of targets.
+
+    Targets that need more frames than their utterance has are rejected
+    before the recurrence runs.
+
+    Args:
+        log_probs: (B, vocab_size, T_max) log-probabilities
+        input_lengths: (B,) number of valid frames per utterance
+        targets: (B, U_max) padded integer targets
+        target_lengths: (B,) number of valid labels per target
+        blank: Vocabulary index of the blank
+        dtype: Floating-point type of the scores
+
+    Returns:
+        alignments: List of B Alignment tuples (None where the target
+            cannot be aligned within the utterance's frames)
+    """
+    input_lengths = np.asarray(input_lengths)
+    target_lengths = np.asarray(target_lengths)
+    labels, skip = batch_extended_labels(targets, target_lengths, blank)
+    alignments = [None] * len(labels)
+    feasible = (input_lengths > 0) & (
+        input_lengths >= batch_min_frames(labels, skip, target_lengths)
+    )
+    rows = np.flatnonzero(feasible)
+    if not len(rows):
+        return alignments
+
+    labels, skip = labels[rows], skip[rows]
+    input_lengths = input_lengths[rows]
+    target_lengths = target_lengths[rows]
+    backpointers, final = viterbi_backpointers(
+        log_probs, rows, input_lengths, target_lengths, labels, skip, dtype
+    )
+    B, _, T = backpointers.shape
+
+    # Paths end in the last token (S_b - 2) or the trailing blank (S_b - 1)
+    last_state = 2 * target_lengths
+    batch = np.arange(B)
+    end_token = final[batch, np.maximum(last_state - 1, 0)]
+    end_token[last_state == 0] = -np.inf
+    end_blank = final[batch, last_state]
+    log_prob = np.maximum(end_token, end_blank)
+    state = np.where(end_token > end_blank, last_state - 1, last_state)
+
+    # Backtrack every utterance at once, each starting at its own last frame
+    states = np.zeros((B, T), dtype=np.intp)
+    for t in range(T - 1, -1, -1):
+        active = t < input_lengths
+        states[active, t] = state[active]
+        if t > 0:
+            state[active] -= backpointers[batch[active], state[active], t]
+
+    for b, row in enumerate(rows):
+        if not np.isfinite(log_prob[b]):
+            continue
+        length = input_lengths[b]
+        S_b = 2 * target_lengths[b] + 1
+        alignments[row] = _segments(
+            log_probs[row, :, :length], labels[b, :S_b], states[b, :length], log_prob[b], dtype
+        )
+    return alignments
+
+
+def viterbi_align(log_probs, labels, dtype=np.float64):
+    """
+    Forced alignment of one extended label sequence.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        labels: (S,) integer label array of the extended sequence
+        dtype: Floating-point type of the scores
+
+    Returns:
+        alignment: Alignment tuple
+
+    Raises:
+        ValueError: If the target cannot be aligned to T frames
+    """
+    labels = np.asarray(labels)
+    alignment = viterbi_align_batch(
+        log_probs[None],
+        [log_probs.shape[1]],
+        labels[1::2][None],
+        [len(labels) // 2],
+        blank=labels[0],
+        dtype=dtype,
+    )[0]
+    if alignment is None:
+        raise ValueError(
+            f"target of {len(labels) // 2} labels cannot be aligned to {log_probs.shape[1]} frames"
+        )
+    return alignment
+
+
+def _segments(log_probs, labels, states, log_prob, dtype=np.float64):
+    """Turn a state path into per-token start/end frames and scores."""
+    T = len(states)
+    cumulative = np.zeros(T + 1, dtype=dtype)
+    np.cumsum(log_probs[labels[states], np.arange(T)], out=cumulative[1:])
+
+    # States are non-decreasing along the path, so each token's frames are
+    # one contiguous run found by binary search
+    token_states = np.arange(1, len(labels), 2)
+    starts = np.searchsorted(states, token_states, side="left")
+    ends = np.searchsorted(states, token_states, side="right") - 1
+    scores = cumulative[ends + 1] - cumulative[starts]
+    return Alignment(labels[token_states], starts, ends, scores, states, float(log_prob))
@@ -0,0 +1,463 @@
+"""
+CTC Benchmarks - Speed, memory and correctness of every engine
+Times forward, forward-backward, greedy, beam search and Viterbi for each
+implementation (reference loop, vectorized, log-space, batched, checkpointed)
+over a grid of utterance length T, target length U, vocabulary size V and
+batch size B, with equal or mixed utterance and target lengths in a batch.
+Every result records frames/s and peak traced memory, and its error against
+a plain reference loop that shares no code with the engines (rescaled per
+frame, so it does not underflow). The loop runs on the first few utterances
+of a case whose trellis is small enough; larger cases are timed unchecked.
+
+Results are saved as JSON; --compare flags entries that got slower.
+
+Usage:
+    python ctc_bench.py -o bench.json                     # quick grid
+    python ctc_bench.py --grid full -o new.json --compare bench.json
+"""
+
+import argparse
+import itertools
+import json
+import math
+import platform
+import sys
+import time
+
+import numpy as np
+
+from ctc_align import viterbi_align, viterbi_align_batch
+from ctc_calculations import forward_algorithm
+from ctc_checkpoint import (
+    ctc_loss_and_grad_checkpointed,
+    measure,
+    viterbi_align_checkpointed,
+)
+from ctc_decode import greedy_decode, greedy_decode_batch, prefix_beam_search
+from ctc_engine import (
+    ctc_loss_and_grad,
+    ctc_loss_batch,
+    ctc_loss_log,
+    ctc_probability,
+    forward_log,
+    forward_vectorized,
+    min_frames,
+)
+from ctc_synth import sample_alignment, synthesize_frames
+
+GRIDS = {
+    # (T, U, V, B, lengths) values; their product is run, minus cases over the limits
+    "quick": dict(T=[200, 1000], U=[20], V=[9, 500], B=[1, 16], lengths=["equal", "mixed"]),
+    "full": dict(
+        T=[100, 1000, 10000],
+        U=[10, 50, 200],
+        V=[9, 30, 500, 5000],
+        B=[1, 16, 64],
+        lengths=["equal", "mixed"],
+    ),
+}
+BEAM_WIDTH = 8
+BEAM_TOP_K = 16
+TOLERANCE = 1e-6
+REFERENCE_CELLS = 200_000  # largest trellis (S * T) scored by the reference loop
+REFERENCE_UTTERANCES = 4  # utterances per case scored by it
+
+
+# ===== REFERENCE =====
+def reference_loss(probs, labels):
+    """
+    -log P(labels|X) from a plain loop over the trellis, rescaled at every frame.
+
+    The recurrence of ctc_calculations.forward_algorithm cell by cell, except
+    that each column of alpha is divided by its sum and the logs of the sums
+    are accumulated, so it does not underflow on long inputs. It shares no
+    code with the engines it checks.
+    """
+    labels = [int(label) for label in labels]
+    S, T = len(labels), probs.shape[1]
+    rows = probs[labels].tolist()
+    alpha = [0.0] * S
+    alpha[0] = rows[0][0]
+    if S > 1:
+        alpha[1] = rows[1][0]
+    log_scale = 0.0
+    for t in range(T):
+        if t > 0:
+            previous = alpha
+            alpha = [0.0] * S
+            for s in range(S):
+                total = previous[s]
+                if s >= 1:
+                    total += previous[s - 1]
+                if s >= 2 and labels[s] != labels[s - 2]:
+                    total += previous[s - 2]
+                alpha[s] = total * rows[s][t]
+        column = sum(alpha)
+        if column == 0.0:
+            return np.inf
+        alpha = [a / column for a in alpha]
+        log_scale += math.log(column)
+    end = alpha[-1] + (alpha[-2] if S > 1 else 0.0)
+    return -(log_scale + math.log(end)) if end > 0.0 else np.inf
+
+
+def extended(target, blank):
+    labels = np.full(2 * len(target) + 1, blank)
+    labels[1::2] = target
+    return labels
+
+
+# ===== BENCHMARK CASES =====
+class Case:
+    """
+    One synthetic batch: B utterances of up to T frames, targets of up to U labels.
+
+    With lengths="mixed" every input length is drawn from [T/2, T] and every
+    target length from [U/2, U]; the batch arrays are padded to T and U.
+    """
+
+    def __init__(self, T, U, V, B, lengths="equal", seed=0):
+        rng = np.random.default_rng(seed)
+        self.T, self.U, self.V, self.B, self.lengths = T, U, V, B, lengths
+        self.blank = V - 1
+        self.targets = rng.integers(0, V - 1, size=(B, U))
+        self.target_lengths = np.full(B, U)
+        self.input_lengths = np.full(B, T)
+        if lengths == "mixed":
+            self.target_lengths = rng.integers((U + 1) // 2, U + 1, size=B)
+            for b in range(B):
+                shortest = min_frames(extended(self.targets[b, : self.target_lengths[b]], self.blank))
+                self.input_lengths[b] = rng.integers(min(max(T // 2, shortest), T), T + 1)
+        # Padding frames are uniform, so their logs stay finite
+        self.probs = np.full((B, V, T), 1.0 / V)
+        for b in range(B):
+            T_b = self.input_lengths[b]
+            path = sample_alignment(self.targets[b, : self.target_lengths[b]], T_b, self.blank, rng)
+            self.probs[b, :, :T_b] = synthesize_frames(path, rng.uniform(0.5, 0.8, size=T_b), V, rng)
+        self.log_probs = np.log(self.probs)
+        self.labels = np.full((B, 2 * U + 1), self.blank)
+        self.labels[:, 1::2] = self.targets
+        self._losses = None
+
+    @property
+    def frames(self):
+        return int(self.input_lengths.sum())
+
+    def utterance(self, b):
+        """(V, T_b) probabilities and log-probabilities, and the extended labels of utterance b."""
+        T_b, S_b = self.input_lengths[b], 2 * self.target_lengths[b] + 1
+        return self.probs[b, :, :T_b], self.log_probs[b, :, :T_b], self.labels[b, :S_b]
+
+    def utterances(self):
+        return [self.utterance(b) for b in range(self.B)]
+
+    def losses(self):
+        """Reference loop -log P(Y|X) per utterance; NaN where it is not run."""
+        if self._losses is None:
+            self._losses = np.full(self.B, np.nan)
+            for b in range(min(self.B, REFERENCE_UTTERANCES)):
+                probs, _, labels = self.utterance(b)
+                if probs.shape[1] * len(labels) <= REFERENCE_CELLS:
+                    self._losses[b] = reference_loss(probs, labels)
+        return self._losses
+
+    def describe(self):
+        return dict(T=self.T, U=self.U, V=self.V, B=self.B, lengths=self.lengths)
+
+
+def _loss_error(case, losses):
+    """
+    Largest deviation from the reference loop, None if no utterance was small enough.
+
+    A loss that is not finite where the reference is (or the other way round)
+    counts as an infinite error; both infinite counts as a match.
+    """
+    reference = case.losses()
+    checked = ~np.isnan(reference)
+    if not checked.any():
+        return None
+    losses = np.asarray(losses, dtype=np.float64)[checked]
+    reference = reference[checked]
+    with np.errstate(invalid="ignore"):
+        error = np.where(losses == reference, 0.0, np.abs(losses - reference))
+    return float(np.where(np.isnan(error), np.inf, error).max())
+
+
+# ===== IMPLEMENTATIONS =====
+# Each entry: (task, implementation, run(case), check(case, result) -> error or
+# None when nothing could be checked, maximum number of trellis cells B * S * T
+# it is run on)
+def _run_reference(case):
+    out = []
+    for probs, _, labels in case.utterances():
+        alpha = forward_algorithm(probs, labels.tolist(), {i: i for i in range(case.V)})
+        p = ctc_probability(alpha)
+        out.append(-np.log(p) if p > 0 else np.inf)  # inf: linear probabilities underflowed
+    return out
+
+
+def _run_vectorized(case):
+    out = []
+    for probs, _, labels in case.utterances():
+        p = ctc_probability(forward_vectorized(probs, labels))
+        out.append(-np.log(p) if p > 0 else np.inf)
+    return out
+
+
+def _run_log(case):
+    return [ctc_loss_log(forward_log(lp, labels)) for _, lp, labels in case.utterances()]
+
+
+def _run_batched(case):
+    return ctc_loss_batch(
+        case.log_probs, case.input_lengths, case.targets, case.target_lengths, case.blank
+    )
+
+
+def _run_grad(case):
+    return [ctc_loss_and_grad(lp, labels)[0] for _, lp, labels in case.utterances()]
+
+
+def _run_grad_checkpointed(case):
+    return [ctc_loss_and_grad_checkpointed(lp, labels)[0] for _, lp, labels in case.utterances()]
+
+
+def _run_greedy_loop(case):
+    out = []
+    for _, lp, _ in case.utterances():
+        best = lp.argmax(axis=0).tolist()
+        tokens, prev = [], None
+        for c in best:
+            if c != prev and c != case.blank:
+                tokens.append(c)
+            prev = c
+        out.append(tokens)
+    return out
+
+
+def _run_greedy(case):
+    return [greedy_decode(lp, case.blank).tolist() for _, lp, _ in case.utterances()]
+
+
+def _run_greedy_batch(case):
+    tokens, offsets = greedy_decode_batch(case.log_probs, case.input_lengths, case.blank)
+    return [tokens[offsets[b] : offsets[b + 1]].tolist() for b in range(case.B)]
+
+
+def _check_greedy(case, hypotheses):
+    return float(hypotheses != _run_greedy_loop(case))
+
+
+def _run_beam(case):
+    return [
+        prefix_beam_search(lp, case.blank, beam_width=BEAM_WIDTH, top_k=BEAM_TOP_K)[0]
+        for _, lp, _ in case.utterances()
+    ]
+
+
+def _check_beam(case, best):
+    # Pruning only drops alignments: a beam score never exceeds the exact
+    # log P of its own hypothesis, taken from the reference loop
+    error = None
+    for b, (labels, score) in enumerate(best[:REFERENCE_UTTERANCES]):
+        probs, _, _ = case.utterance(b)
+        hypothesis = extended(labels, case.blank)
+        if probs.shape[1] * len(hypothesis) <= REFERENCE_CELLS:
+            error = max(error or 0.0, score + reference_loss(probs, hypothesis))
+    return error
+
+
+def _run_viterbi(case):
+    return [viterbi_align(lp, labels) for _, lp, labels in case.utterances()]
+
+
+def _run_viterbi_batch(case):
+    return viterbi_align_batch(
+        case.log_probs, case.input_lengths, case.targets, case.target_lengths, case.blank
+    )
+
+
+def _run_viterbi_checkpointed(case):
+    return [viterbi_align_checkpointed(lp, labels) for _, lp, labels in case.utterances()]
+
+
+def _check_viterbi(case, alignments):
+    # The best path lies on the trellis: its score is the sum along its
+    # states, and no single path beats the total probability
+    error = 0.0
+    for (_, lp, labels), alignment, loss in zip(case.utterances(), alignments, case.losses()):
+        path_score = lp[labels[alignment.states], np.arange(lp.shape[1])].sum()
+        error = max(error, abs(alignment.log_prob - path_score))
+        if not np.isnan(loss):
+            error = max(error, alignment.log_prob + loss)
+    return error
+
+
+BENCHMARKS = [
+    ("forward", "reference", _run_reference, _loss_error, 2e5),
+    ("forward", "vectorized", _run_vectorized, _loss_error, np.inf),
+    ("forward", "log", _run_log, _loss_error, np.inf),
+    ("forward", "batched", _run_batched, _loss_error, np.inf),
+    ("forward_backward", "log", _run_grad, _loss_error, np.inf),
+    ("forward_backward", "checkpointed", _run_grad_checkpointed, _loss_error, np.inf),
+    ("greedy", "reference", _run_greedy_loop, lambda case, result: 0.0, np.inf),
+    ("greedy", "vectorized", _run_greedy, _check_greedy, np.inf),
+    ("greedy", "batched", _run_greedy_batch, _check_greedy, np.inf),
+    ("beam", "prefix", _run_beam, _check_beam, 2e6),
+    ("viterbi", "vectorized", _run_viterbi, _check_viterbi, np.inf),
+    ("viterbi", "batched", _run_viterbi_batch, _check_viterbi, np.inf),
+    ("viterbi", "checkpointed", _run_viterbi_checkpointed, _check_viterbi, np.inf),
+]
+
+
+# ===== RUNNER =====
+def run_benchmark(case, run, check, repeats):
+    """Best-of-repeats wall time (untraced), then one traced run for memory and checking."""
+    seconds = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run(case)
+        seconds = min(seconds, time.perf_counter() - start)
+    result, peak, _ = measure(run, case)
+    error = check(case, result)
+    return {
+        "seconds": seconds,
+        "frames_per_second": case.frames / seconds,
+        "peak_bytes": peak,
+        "error": error,
+        "ok": None if error is None else bool(error < TOLERANCE),  # None: not verified
+    }
+
+
+def run_grid(grid, repeats=3, max_bytes=1 << 30, tasks=None):
+    """Run every benchmark on every grid point; yields result records."""
+    for T, U, V, B, lengths in itertools.product(
+        grid["T"], grid["U"], grid["V"], grid["B"], grid.get("lengths", ["equal"])
+    ):
+        if 2 * U + 1 > 2 * T or 2 * B * V * T * 8 > max_bytes:
+            continue  # target too long for T, or inputs too large
+        if lengths == "mixed" and B == 1:
+            continue  # nothing to mix
+        case = Case(T, U, V, B, lengths)
+        cells = B * (2 * U + 1) * T
+        for task, implementation, run, check, max_cells in BENCHMARKS:
+            if tasks and task not in tasks:
+                continue
+            record = {"task": task, "implementation": implementation, **case.describe()}
+            if cells > max_cells:
+                record["skipped"] = f"more than {max_cells:.0e} trellis cells"
+            else:
+                record.update(run_benchmark(case, run, check, repeats))
+            yield record
+
+
+def _key(record):
+    keys = ("task", "implementation", "T", "U", "V", "B")
+    return tuple(record[k] for k in keys) + (record.get("lengths", "equal"),)
+
+
+def compare(results, baseline, threshold=0.2):
+    """Records whose frames/s dropped by more than threshold versus the baseline."""
+    before = {_key(r): r for r in baseline if "frames_per_second" in r}
+    regressions = []
+    for record in results:
+        old = before.get(_key(record))
+        if old and "frames_per_second" in record:
+            ratio = record["frames_per_second"] / old["frames_per_second"]
+            if ratio < 1 - threshold:
+                regressions.append((record, ratio))
+    return regressions
+
+
+def slowdowns(results, task="forward", implementation="log", baseline="vectorized"):
+    """Per grid point, how many times longer one implementation takes than another."""
+    times = {_key(r): r["seconds"] for r in results if "seconds" in r}
+    ratios = []
+    for record in results:
+        if (record["task"], record["implementation"]) != (task, implementation):
+            continue
+        other = (task, baseline) + _key(record)[2:]
+        if _key(record) in times and other in times:
+            ratios.append((record, times[_key(record)] / times[other]))
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CTC engines.")
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    parser.add_argument("--tasks", nargs="*", help="Only these tasks (forward, beam, ...)")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--max-bytes", type=float, default=1 << 30, help="Input size limit per case")
+    parser.add_argument("-o", "--output", help="Save results as JSON")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    print(
+        f"{'task':<17}{'implementation':<14}{'T':>6}{'U':>5}{'V':>6}{'B':>4}{'lengths':>8}"
+        f"{'frames/s':>12}{'peak MB':>9}{'error':>10}  ok"
+    )
+    results = []
+    for record in run_grid(GRIDS[args.grid], args.repeats, args.max_bytes, args.tasks):
+        results.append(record)
+        head = (
+            f"{record['task']:<17}{record['implementation']:<14}"
+            f"{record['T']:>6}{record['U']:>5}{record['V']:>6}{record['B']:>4}"
+            f"{record['lengths']:>8}"
+        )
+        if "skipped" in record:
+            print(f"{head}  skipped: {record['skipped']}")
+            continue
+        error = "-" if record["error"] is None else f"{record['error']:.1e}"
+        ok = "unverified" if record["ok"] is None else record["ok"]
+        print(
+            f"{head}{record['frames_per_second']:>12.0f}{record['peak_bytes'] / 1e6:>9.1f}"
+            f"{error:>10}  {ok}"
+        )
+
+    # The price of exactness: forward_log against the linear-space recursion
+    for record, ratio in slowdowns(results):
+        print(
+            f"forward log/vectorized T={record['T']} U={record['U']} V={record['V']}"
+            f" B={record['B']} {record['lengths']}: {ratio:.2f}x the time"
+        )
+
+    failed = [r for r in results if r.get("ok") is False]
+    verified = sum(r.get("ok") is not None for r in results)
+    print(
+        f"Correctness: {verified - len(failed)}/{verified} ok, "
+        f"{len(results) - verified} not verified (skipped or too large for the reference)"
+    )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": sys.version.split()[0],
+                    "numpy": np.__version__,
+                    "machine": platform.platform(),
+                    "processor": platform.processor(),
+                    "grid": args.grid,
+                    "results": results,
+                },
+                f,
+                indent=1,
+            )
+        print(f"Saved: {args.output}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for record, ratio in regressions:
+            print(f"REGRESSION {' '.join(map(str, _key(record)))}: {ratio:.2f}x baseline frames/s")
+        print(f"Regressions: {len(regressions)}")
+
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
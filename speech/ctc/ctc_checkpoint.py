@@ -0,0 +1,381 @@
+"""
+CTC Checkpointing - Forward-backward and alignment in O(S * sqrt(T)) memory
+A dense alpha trellis needs S * T floats: an hour at 100 frames/s with a
+2,000-state target is about 2.9 GB. Here the forward pass keeps only every
+k-th log alpha column. The backward (or backtracking) pass walks the
+segments in reverse, recomputes each segment's k columns from its
+checkpoint, and discards them again. With k = sqrt(T) this costs one extra
+forward pass and about 2 * S * sqrt(T) floats of trellis memory.
+Every pass takes a dtype (np.float64 by default), as the dense engines do.
+
+Run as a script to compare peak memory and runtime against the dense engine:
+    python ctc_checkpoint.py --frames 20000 --tokens 200
+"""
+
+import argparse
+import math
+import time
+import tracemalloc
+
+import numpy as np
+
+from ctc_align import _segments, viterbi_align
+from ctc_engine import (
+    _backward_skip_penalty,
+    _log_sum3,
+    _prepare,
+    ctc_loss_and_grad,
+    log_mask,
+    log_softmax,
+)
+
+
+# ===== CHECKPOINT LAYOUT =====
+def default_interval(T):
+    """Checkpoint spacing that minimizes trellis memory: ceil(sqrt(T))."""
+    return max(1, math.isqrt(max(T - 1, 0)) + 1)
+
+
+def checkpoint_memory(S, T, interval=None, dtype=np.float64):
+    """
+    Bytes of trellis storage used by the checkpointed passes.
+
+    Args:
+        dtype: Floating-point type of the trellis
+
+    Returns:
+        checkpointed: Checkpoint columns plus one recomputed segment
+        dense: A full (S, T) trellis, for comparison
+    """
+    if interval is None:
+        interval = default_interval(T)
+    n_checkpoints = -(-T // interval)
+    size = np.dtype(dtype).itemsize
+    return size * (S + 2) * (n_checkpoints + interval), size * S * T
+
+
+def _segment_band(S, T, t0, t1):
+    """feasible_band restricted to frames t0 .. t1 - 1, as Python lists."""
+    t = np.arange(t0, t1)
+    lo = np.maximum(0, S - 2 * (T - t))
+    hi = np.minimum(S, 2 * t + 2)
+    return lo.tolist(), hi.tolist()
+
+
+def _first_column(log_probs, labels, T):
+    """Log alpha at t = 0 with two -inf guard states in front (in log_probs' dtype)."""
+    S = len(labels)
+    column = np.full(S + 2, -np.inf, dtype=log_probs.dtype)
+    l = max(0, S - 2 * T)
+    column[2 + l : 2 + min(S, 2)] = log_probs[labels[l:2], 0]
+    return column
+
+
+# ===== CHECKPOINTED FORWARD =====
+@np.errstate(divide="ignore")
+def _forward_segment(log_probs, labels, skip_penalty, column, t0, t1, out=None):
+    """
+    Advance a padded log alpha column from frame t0 to frame t1 - 1.
+
+    Args:
+        column: (S + 2,) padded log alpha at t0
+        out: Optional (>= t1 - t0, S + 2) buffer receiving every column t0 .. t1 - 1
+
+    Returns:
+        column: (S + 2,) padded log alpha at t1 - 1 (a new array)
+    """
+    S = len(labels)
+    T = log_probs.shape[1]
+    lo, hi = _segment_band(S, T, t0, t1)
+    emit = np.ascontiguousarray(log_probs[labels, t0:t1].T)
+
+    prev = column.copy()
+    cur = np.empty_like(prev)
+    if out is not None:
+        out[0] = prev
+    for i in range(1, t1 - t0):
+        l, h = lo[i], hi[i]
+        cur.fill(-np.inf)
+        total = cur[2 + l : 2 + h]
+        _log_sum3(prev[2 + l : 2 + h], prev[1 + l : 1 + h], prev[l:h] + skip_penalty[l:h], total)
+        total += emit[i, l:h]
+        prev, cur = cur, prev
+        if out is not None:
+            out[i] = prev
+    return prev
+
+
+def forward_checkpoints(log_probs, labels, skip, interval, dtype=np.float64):
+    """
+    Log-space forward pass that keeps every interval-th column.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        labels: (S,) integer label array of the extended sequence
+        skip: skip_mask(labels)
+        interval: Frames between checkpoints
+        dtype: Floating-point type of the checkpoints
+
+    Returns:
+        checkpoints: (ceil(T / interval), S + 2) padded log alpha at
+            t = 0, interval, 2 * interval, ...
+        last: (S,) log alpha at t = T - 1
+    """
+    log_probs = np.asarray(log_probs, dtype=dtype)
+    T = log_probs.shape[1]
+    skip_penalty = log_mask(skip, dtype)
+    starts = range(0, T, interval)
+    checkpoints = np.empty((len(starts), len(labels) + 2), dtype=dtype)
+
+    column = _first_column(log_probs, labels, T)
+    for i, t0 in enumerate(starts):
+        checkpoints[i] = column
+        # Advance up to the next checkpoint (or the last frame)
+        t1 = min(t0 + interval + 1, T)
+        column = _forward_segment(log_probs, labels, skip_penalty, column, t0, t1)
+    return checkpoints, column[2:]
+
+
+# ===== CHECKPOINTED GRADIENT =====
+@np.errstate(divide="ignore")
+def ctc_loss_and_grad_checkpointed(logits, labels, skip=None, interval=None, dtype=np.float64):
+    """
+    ctc_loss_and_grad with checkpointed alpha instead of a full trellis.
+
+    The beta pass runs segment by segment from the end; before each segment
+    its alpha columns are recomputed from the nearest checkpoint.
+
+    Args:
+        logits: (vocab_size, T) unnormalized scores
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        interval: Frames between checkpoints (default ceil(sqrt(T)))
+        dtype: Floating-point type of the trellis and the gradient
+
+    Returns:
+        loss: -log P(Y|X)
+        grad: (vocab_size, T) dL/dlogits (zeros if P(Y|X) is 0)
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    log_probs = log_softmax(np.asarray(logits, dtype=dtype), axis=0)
+    V, T = log_probs.shape
+    labels, skip = _prepare(labels, skip, T)
+    S = len(labels)
+    if interval is None:
+        interval = default_interval(T)
+
+    checkpoints, last = forward_checkpoints(log_probs, labels, skip, interval, dtype)
+    loss = -np.logaddexp.reduce(last[-2:])
+    grad = np.exp(log_probs)
+    if not np.isfinite(loss):
+        return loss, np.zeros((V, T), dtype=dtype)
+
+    skip_penalty = log_mask(skip, dtype)
+    backward_penalty = _backward_skip_penalty(skip, dtype)
+    segment = np.empty((interval, S + 2), dtype=dtype)
+
+    nxt = np.full(S + 2, -np.inf, dtype=dtype)
+    cur = np.full(S + 2, -np.inf, dtype=dtype)
+    end = max(S - 2, 0)
+    nxt[end:S] = log_probs[labels[end:], T - 1]
+
+    for k in range(len(checkpoints) - 1, -1, -1):
+        t0 = k * interval
+        t1 = min(t0 + interval, T)
+        _forward_segment(log_probs, labels, skip_penalty, checkpoints[k], t0, t1, out=segment)
+        lo, hi = _segment_band(S, T, t0, t1)
+        emit = np.ascontiguousarray(log_probs[labels, t0:t1].T)
+
+        for t in range(t1 - 1, t0 - 1, -1):
+            i = t - t0
+            l, h = lo[i], hi[i]
+            if t < T - 1:
+                cur.fill(-np.inf)
+                total = cur[l:h]
+                _log_sum3(
+                    nxt[l:h],
+                    nxt[l + 1 : h + 1],
+                    nxt[l + 2 : h + 2] + backward_penalty[l:h],
+                    total,
+                )
+                total += emit[i, l:h]
+                nxt, cur = cur, nxt
+
+            # Normalized per frame, as in ctc_loss_and_grad
+            occupancy = segment[i, 2 + l : 2 + h] + nxt[l:h] - emit[i, l:h]
+            np.exp(occupancy - occupancy.max(), out=occupancy)
+            occupancy /= occupancy.sum()
+            grad[:, t] -= np.bincount(labels[l:h], weights=occupancy, minlength=V)
+
+    return loss, grad
+
+
+# ===== CHECKPOINTED ALIGNMENT =====
+def _viterbi_segment(log_probs, labels, skip_penalty, column, t0, t1, pointers=None):
+    """
+    Max-product counterpart of _forward_segment.
+
+    Args:
+        pointers: Optional (S, >= t1 - t0) int8 buffer receiving back-pointers
+            (0: stay, 1: from s-1, 2: from s-2) for frames t0 + 1 .. t1 - 1
+    """
+    S = len(labels)
+    T = log_probs.shape[1]
+    lo, hi = _segment_band(S, T, t0, t1)
+    emit = np.ascontiguousarray(log_probs[labels, t0:t1].T)
+
+    prev = column.copy()
+    cur = np.empty_like(prev)
+    for i in range(1, t1 - t0):
+        l, h = lo[i], hi[i]
+        stay = prev[2 + l : 2 + h]
+        step = prev[1 + l : 1 + h]
+        jump = prev[l:h] + skip_penalty[l:h]
+        cur.fill(-np.inf)
+        best = cur[2 + l : 2 + h]
+        np.maximum(stay, step, out=best)
+        if pointers is not None:
+            pointer = (step > stay).astype(np.int8)
+            pointer[jump > best] = 2
+            pointers[l:h, i] = pointer
+        np.maximum(best, jump, out=best)
+        best += emit[i, l:h]
+        prev, cur = cur, prev
+    return prev
+
+
+def viterbi_align_checkpointed(log_probs, labels, interval=None, dtype=np.float64):
+    """
+    viterbi_align without a full (S, T) back-pointer array.
+
+    The forward max pass keeps score checkpoints; backtracking then
+    recomputes the back-pointers of one segment at a time, last segment first.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        labels: (S,) integer label array of the extended sequence
+        interval: Frames between checkpoints (default ceil(sqrt(T)))
+        dtype: Floating-point type of the scores
+
+    Returns:
+        alignment: ctc_align.Alignment tuple
+
+    Raises:
+        ValueError: If T is 0 or the target cannot be aligned to T frames
+    """
+    log_probs = np.asarray(log_probs, dtype=dtype)
+    T = log_probs.shape[1]
+    labels, skip = _prepare(labels, None, T)
+    S = len(labels)
+    if interval is None:
+        interval = default_interval(T)
+    skip_penalty = log_mask(skip, dtype)
+
+    starts = range(0, T, interval)
+    checkpoints = np.empty((len(starts), S + 2), dtype=dtype)
+    column = _first_column(log_probs, labels, T)
+    for k, t0 in enumerate(starts):
+        checkpoints[k] = column
+        t1 = min(t0 + interval + 1, T)
+        column = _viterbi_segment(log_probs, labels, skip_penalty, column, t0, t1)
+
+    # Paths end in the last token (S - 2) or the trailing blank (S - 1)
+    final = column[2:]
+    state = S - 1
+    if S > 1 and final[S - 2] > final[S - 1]:
+        state = S - 2
+    log_prob = final[state]
+    if not np.isfinite(log_prob):
+        raise ValueError("every alignment of the target has zero probability")
+
+    states = np.empty(T, dtype=np.intp)
+    states[T - 1] = state
+    pointers = np.zeros((S, interval + 1), dtype=np.int8)
+    for k in range(len(checkpoints) - 1, -1, -1):
+        # Recompute the segment's pointers, including the step into the next one
+        t0 = k * interval
+        t1 = min(t0 + interval + 1, T)
+        _viterbi_segment(log_probs, labels, skip_penalty, checkpoints[k], t0, t1, pointers)
+        for t in range(t1 - 1, t0, -1):
+            state -= int(pointers[state, t - t0])
+            states[t - 1] = state
+
+    return _segments(log_probs, labels, states, log_prob, dtype)
+
+
+# ===== MEASUREMENT =====
+def measure(fn, *args, **kwargs):
+    """
+    Run fn once and record its peak traced memory and wall time.
+
+    NumPy reports its buffers to tracemalloc, so the peak covers the arrays
+    fn allocates (not memory that already existed before the call).
+
+    Returns:
+        result: fn's return value
+        peak_bytes: Peak memory allocated during the call
+        seconds: Elapsed wall time
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    if not tracing:
+        tracemalloc.stop()
+    return result, peak - base, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20000)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--vocab", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--intervals", type=int, nargs="*", help="Checkpoint spacings to try (default sqrt(T))"
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    logits = rng.normal(size=(args.vocab, args.frames))
+    labels = np.zeros(2 * args.tokens + 1, dtype=np.intp)
+    labels[1::2] = rng.integers(1, args.vocab, size=args.tokens)
+    S, T = len(labels), args.frames
+    intervals = args.intervals or [default_interval(T)]
+
+    print(f"S = {S} states, T = {T} frames, V = {args.vocab}")
+    print(f"{'mode':<22}{'trellis MB':>12}{'peak MB':>10}{'seconds':>10}")
+    (loss, grad), peak, seconds = measure(ctc_loss_and_grad, logits, labels)
+    print(f"{'dense':<22}{8 * S * T / 1e6:>12.1f}{peak / 1e6:>10.1f}{seconds:>10.2f}")
+    for interval in intervals:
+        (loss_c, grad_c), peak, seconds = measure(
+            ctc_loss_and_grad_checkpointed, logits, labels, interval=interval
+        )
+        trellis, _ = checkpoint_memory(S, T, interval)
+        mode = f"checkpoint k={interval}"
+        print(f"{mode:<22}{trellis / 1e6:>12.1f}{peak / 1e6:>10.1f}{seconds:>10.2f}")
+        print(f"  |loss diff| = {abs(loss - loss_c):.2e}, max |grad diff| = {np.abs(grad - grad_c).max():.2e}")
+
+    log_probs = log_softmax(logits, axis=0)
+    alignment, peak, seconds = measure(viterbi_align, log_probs, labels)
+    print(f"{'dense alignment':<22}{S * T / 1e6:>12.1f}{peak / 1e6:>10.1f}{seconds:>10.2f}")
+    for interval in intervals:
+        alignment_c, peak, seconds = measure(
+            viterbi_align_checkpointed, log_probs, labels, interval=interval
+        )
+        trellis, _ = checkpoint_memory(S, T, interval)
+        mode = f"alignment k={interval}"
+        print(f"{mode:<22}{trellis / 1e6:>12.1f}{peak / 1e6:>10.1f}{seconds:>10.2f}")
+        print(f"  same path: {np.array_equal(alignment.states, alignment_c.states)}")
+    print("(gradient peaks include the (V, T) softmax and gradient, which both modes need)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,533 @@
+"""
+CTC Decoding - Greedy and prefix beam search
+Greedy decoding (section 7.1 of ctc.md) is done for a whole batch with array
+masks. Prefix beam search implements section 7.3 of ctc.md: hypotheses are collapsed label prefixes,
+each scored separately for alignments ending in a blank and in a label, so
+every alignment that collapses to the same prefix is merged into one beam entry.
+An optional ShallowFusion (ctc_lm.py) adds an n-gram language model score.
+kbest generates the n-best list lazily by A* search over label prefixes.
+kbest and rescore keep their per-frame arrays in the dtype asked for
+(float64 by default); prefix beam search returns its scores in it.
+"""
+
+import heapq
+import itertools
+import math
+from collections import namedtuple
+
+import numpy as np
+
+NEG_INF = -math.inf
+
+
+def _log_add(a, b):
+    """log(exp(a) + exp(b)) for Python floats."""
+    if a < b:
+        a, b = b, a
+    if b == NEG_INF:
+        return a
+    return a + math.log1p(math.exp(b - a))
+
+
+# ===== GREEDY DECODING =====
+def greedy_decode_batch(log_probs, input_lengths, blank):
+    """
+    Greedy (best path) decoding of a padded batch.
+
+    Takes the argmax at every frame, then drops repeats and blanks with
+    boolean masks. All hypotheses are returned in one flat buffer: utterance b
+    decodes to tokens[offsets[b]:offsets[b + 1]].
+
+    Args:
+        log_probs: (B, vocab_size, T_max) log-probabilities (or probabilities)
+        input_lengths: (B,) number of valid frames per utterance
+        blank: Vocabulary index of the blank
+
+    Returns:
+        tokens: (N,) vocabulary indices of all hypotheses, concatenated
+        offsets: (B + 1,) start of each hypothesis in tokens
+    """
+    best = log_probs.argmax(axis=1)
+    B, T = best.shape
+    keep = best != blank
+    keep[:, 1:] &= best[:, 1:] != best[:, :-1]
+    keep &= np.arange(T) < np.asarray(input_lengths)[:, None]
+
+    offsets = np.zeros(B + 1, dtype=np.intp)
+    np.cumsum(keep.sum(axis=1), out=offsets[1:])
+    return best[keep], offsets
+
+
+def greedy_decode(log_probs, blank):
+    """
+    Greedy decoding of one (vocab_size, T) matrix.
+
+    Returns:
+        tokens: Vocabulary indices of the collapsed best path
+    """
+    tokens, _ = greedy_decode_batch(log_probs[None], [log_probs.shape[1]], blank)
+    return tokens
+
+
+# ===== PREFIX STORAGE =====
+class PrefixTrie:
+    """
+    Collapsed label prefixes stored as trie nodes.
+
+    A prefix is an integer node id (0 is the empty prefix). Extending a prefix
+    by one label is a single dict lookup, so hypotheses are never copied as
+    strings or tuples while decoding; labels(node) rebuilds one on demand.
+    Prefixes that are no longer needed can be released with prune, and their
+    ids are reused by later extensions.
+    """
+
+    ROOT = 0
+
+    def __init__(self):
+        self.parent = [-1]
+        self.label = [-1]
+        self.length = [0]
+        self._children = {}
+        self._fanout = [0]  # number of children per node
+        self._free = []
+
+    def __len__(self):
+        return len(self.parent)
+
+    def extend(self, node, label):
+        """Return the node for prefix(node) + [label], creating it if needed."""
+        key = (node, label)
+        child = self._children.get(key)
+        if child is None:
+            if self._free:
+                child = self._free.pop()
+                self.parent[child] = node
+                self.label[child] = label
+                self.length[child] = self.length[node] + 1
+            else:
+                child = len(self.parent)
+                self.parent.append(node)
+                self.label.append(label)
+                self.length.append(self.length[node] + 1)
+                self._fanout.append(0)
+            self._children[key] = child
+            self._fanout[node] += 1
+        return child
+
+    def prune(self, nodes, keep):
+        """
+        Release prefixes that are no longer needed.
+
+        Each of nodes that is not in keep and has no children is released,
+        then every ancestor left without children that is not in keep. The
+        root and the ancestors of kept nodes always stay.
+
+        Args:
+            nodes: Iterable of node ids that may have become unused
+            keep: Container of node ids still in use
+        """
+        for node in nodes:
+            while (
+                node != self.ROOT
+                and node not in keep
+                and self.parent[node] >= 0
+                and self._fanout[node] == 0
+            ):
+                parent = self.parent[node]
+                del self._children[(parent, self.label[node])]
+                self.parent[node] = -1
+                self._free.append(node)
+                self._fanout[parent] -= 1
+                node = parent
+
+    def labels(self, node):
+        """Label sequence of a prefix, as a tuple of ints."""
+        out = []
+        while node != self.ROOT:
+            out.append(self.label[node])
+            node = self.parent[node]
+        return tuple(reversed(out))
+
+
+# ===== PREFIX BEAM SEARCH =====
+def prefix_beam_search(
+    log_probs, blank, beam_width=8, top_k=None, fusion=None, dtype=np.float64
+):
+    """
+    CTC prefix beam search.
+
+    Each beam entry keeps two scores for its prefix: log P of all alignments
+    so far that end in a blank (p_b) and that end in the prefix's last label
+    (p_nb). A repeated label only extends the prefix when separated by a
+    blank, otherwise it collapses into the same prefix.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        blank: Vocabulary index of the blank
+        beam_width: Number of prefixes kept after every frame
+        top_k: Number of most probable labels tried per frame (all if None)
+        fusion: Optional ctc_lm.ShallowFusion; its score is added to every
+            prefix when pruning, and its final score to complete hypotheses
+        dtype: Floating-point type of the returned scores. The beam keeps a
+            few Python floats per prefix, so it is summed in float64 either way
+
+    Returns:
+        hypotheses: List of (labels, score) pairs, best first, where labels is
+            a tuple of vocabulary indices with blanks and repeats collapsed and
+            score is log P(labels|X), plus the fusion score if one is given
+    """
+    V, T = log_probs.shape
+    if top_k is None or top_k >= V:
+        top_k = V
+    trie = PrefixTrie()
+    beam = {PrefixTrie.ROOT: (0.0, NEG_INF)}
+    # LM information and fusion score per trie node, computed once per prefix
+    if fusion is not None:
+        lm_info = {PrefixTrie.ROOT: fusion.initial()}
+    fused = {PrefixTrie.ROOT: 0.0}
+
+    def extend(node, c):
+        child = trie.extend(node, c)
+        if child not in fused:
+            if fusion is None:
+                fused[child] = 0.0
+            else:
+                lm_info[child] = fusion.extend(lm_info[node], c)
+                fused[child] = fusion.score(lm_info[child])
+        return child
+
+    for t in range(T):
+        column = log_probs[:, t]
+        if top_k < V:
+            candidates = np.argpartition(column, V - top_k)[V - top_k :]
+        else:
+            candidates = np.arange(V)
+        candidates = list(zip(candidates.tolist(), column[candidates].tolist()))
+        in_candidates = {c for c, _ in candidates}
+
+        next_beam = {}
+
+        def add(node, p_b=NEG_INF, p_nb=NEG_INF):
+            old_b, old_nb = next_beam.get(node, (NEG_INF, NEG_INF))
+            next_beam[node] = (_log_add(old_b, p_b), _log_add(old_nb, p_nb))
+
+        for node, (p_b, p_nb) in beam.items():
+            total = _log_add(p_b, p_nb)
+            last = trie.label[node]
+            for c, p in candidates:
+                if c == blank:
+                    add(node, p_b=total + p)
+                elif c == last:
+                    # "aa" collapses to "a"; only "a ε a" extends the prefix
+                    add(node, p_nb=p_nb + p)
+                    add(extend(node, c), p_nb=p_b + p)
+                else:
+                    add(extend(node, c), p_nb=total + p)
+            # Repeating the last label keeps the prefix alive even when that
+            # label fell outside this frame's top-k
+            if last >= 0 and last not in in_candidates:
+                add(node, p_nb=p_nb + float(column[last]))
+
+        previous = beam
+        beam = dict(
+            heapq.nlargest(
+                beam_width,
+                next_beam.items(),
+                key=lambda item: _log_add(*item[1]) + fused[item[0]],
+            )
+        )
+        # Only the surviving prefixes (and their ancestors) are kept, so memory
+        # stays proportional to the beam rather than to T
+        trie.prune(itertools.chain(previous, next_beam), beam)
+        fused = {node: fused[node] for node in beam}
+        if fusion is not None:
+            lm_info = {node: lm_info[node] for node in beam}
+
+    hypotheses = []
+    for node, scores in beam.items():
+        score = _log_add(*scores)
+        if fusion is not None:
+            score += fusion.final_score(lm_info[node])
+        hypotheses.append((trie.labels(node), np.dtype(dtype).type(score)))
+    hypotheses.sort(key=lambda h: h[1], reverse=True)
+    return hypotheses
+
+
+# ===== LAZY K-BEST =====
+LOG_FLOOR = -700.0  # about 1e-304; keeps the cumulative sums in kbest finite
+
+Hypothesis = namedtuple("Hypothesis", ["labels", "score", "log_prob"])
+Hypothesis.__doc__ = """
+One entry of a k-best list.
+
+labels: Tuple of vocabulary indices (blanks and repeats collapsed)
+score: log P of the best alignment of labels (the order of kbest)
+log_prob: log P(labels|X), summed over all alignments
+"""
+
+
+def _extend_columns(cumulative, blank, enter, k, accumulate=np.logaddexp):
+    """
+    Per-frame log-probabilities of prefixes extended by label k.
+
+    Args:
+        cumulative: (V, T + 1) cumulative sums of the log-probabilities along frames
+        blank: Vocabulary index of the blank
+        enter: (..., T) log P(parent prefix complete at frame t - 1, so k may start at t)
+        k: Label (or (n,) labels, one per row of enter)
+        accumulate: np.logaddexp to sum all alignments, np.maximum for the best one
+
+    Returns:
+        label_end, blank_end: (..., T) frames :t+1 collapse to the extended prefix
+            and end in k / in a blank
+    """
+    # label_end[t]: over tau <= t of enter[tau] * prod(probs[k, tau..t])
+    label_end = cumulative[k, 1:] + accumulate.accumulate(enter - cumulative[k, :-1], axis=-1)
+    # blank_end[t]: over tau < t of label_end[tau] * prod(probs[blank, tau+1..t])
+    blank_end = np.full_like(label_end, -np.inf)
+    blank_end[..., 1:] = cumulative[blank, 2:] + accumulate.accumulate(
+        label_end[..., :-1] - cumulative[blank, 1:-1], axis=-1
+    )
+    return label_end, blank_end
+
+
+def _cumulative(log_probs, dtype=np.float64):
+    """(V, T + 1) array whose [k, t] is the sum of log_probs[k, :t], clipped at LOG_FLOOR."""
+    log_probs = np.maximum(np.asarray(log_probs, dtype=dtype), LOG_FLOOR)
+    cumulative = np.zeros((log_probs.shape[0], log_probs.shape[1] + 1), dtype=dtype)
+    np.cumsum(log_probs, axis=1, out=cumulative[:, 1:])
+    return log_probs, cumulative
+
+
+def best_completion(log_probs, blank):
+    """
+    Best score any continuation can reach from every frame and state.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        blank: Vocabulary index of the blank
+
+    Returns:
+        after_label: (T + 1, vocab_size) best log P of frames t.. given that label
+            k was emitted at frame t - 1 (-inf in the blank column)
+    """
+    V, T = log_probs.shape
+    after_label = np.zeros((T + 1, V), dtype=log_probs.dtype)
+    after_label[:, blank] = -np.inf
+    after_blank = 0.0
+    for t in range(T - 1, -1, -1):
+        column = log_probs[:, t]
+        enter = column + after_label[t + 1]
+        first, second = np.partition(enter, V - 2)[-1:-3:-1]
+        # Stay on k, emit a blank, or enter the best other label
+        enter_other = np.where(enter == first, second, first)
+        blank_next = column[blank] + after_blank
+        after_label[t] = np.maximum(np.maximum(enter, blank_next), enter_other)
+        after_label[t, blank] = -np.inf
+        after_blank = max(blank_next, first)
+    return after_label
+
+
+def kbest(log_probs, blank, dtype=np.float64):
+    """
+    Distinct collapsed label sequences, best first, generated on demand.
+
+    A* search over label prefixes, ordered by the score of a hypothesis's
+    best alignment. For a prefix extended by label k, the best score of any
+    hypothesis starting with it is known exactly: the best way to enter k at
+    each frame plus best_completion for the frames after it. The queue holds
+    complete hypotheses and open prefixes under these scores, so a complete
+    hypothesis at the front is the next best. The only prefixes ever expanded
+    are those of hypotheses at least as good as the last one returned.
+
+    Expanding a prefix handles all of its alignments in array operations over
+    the frames: a cumulative max gives the best alignment, and a cumulative
+    logaddexp merges all alignments into log P(labels|X). Children are queued
+    one at a time, best first, so a prefix never pushes all V extensions.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        blank: Vocabulary index of the blank
+        dtype: Floating-point type of the per-frame arrays
+
+    Yields:
+        Hypothesis tuples in decreasing score (frames with log-probability
+        below LOG_FLOOR are counted at the floor)
+
+    Usage:
+        n_best = list(itertools.islice(kbest(log_probs, blank), 50))
+    """
+    log_probs, cumulative = _cumulative(log_probs, dtype)
+    V, T = log_probs.shape
+    # Entering label k at frame t, then the best any continuation can do
+    entry_bound = log_probs + best_completion(log_probs, blank)[1:].T
+    entry_bound[blank] = -np.inf
+
+    trie = PrefixTrie()
+    # Per expanded prefix, for frames :t+1 collapsing to it and ending in its last
+    # label / in a blank: (best alignment, all alignments) log-probabilities
+    blanks = cumulative[blank, 1:]
+    nothing = np.full(T, -np.inf, dtype=dtype)
+    ending = {PrefixTrie.ROOT: ((nothing, blanks), (nothing, blanks))}
+    children = {}  # expanded prefix -> (labels by decreasing bound, bounds)
+    # Entries (-score, tie-breaker, prefix, child rank, log_prob): a complete
+    # hypothesis has rank None, an open child of the prefix has log_prob None
+    queue = []
+    counter = itertools.count()
+
+    def entering(node, k, accumulate):
+        """log P(prefix complete at frame t - 1) for entering k at t (shape (T,) or (V, T))."""
+        non_blank, blank_end = ending[node][1 if accumulate is np.logaddexp else 0]
+        last = trie.label[node]
+        enter = np.full(np.shape(k) + (T,), -np.inf, dtype=dtype)
+        if node == PrefixTrie.ROOT:
+            enter[..., 0] = 0.0
+        enter[..., 1:] = accumulate(non_blank[:-1], blank_end[:-1])
+        if np.ndim(k):
+            if last >= 0:
+                enter[last, 1:] = blank_end[:-1]  # a repeat needs a blank in between
+        elif k == last:
+            enter[1:] = blank_end[:-1]
+        return enter
+
+    def push_child(node, rank):
+        order, bounds = children[node]
+        if rank < len(order) and bounds[rank] > -np.inf:
+            heapq.heappush(queue, (-bounds[rank], next(counter), node, rank, None))
+
+    def expand(node):
+        (best_label, best_blank), (all_label, all_blank) = ending[node]
+        score = max(best_label[-1], best_blank[-1])
+        log_prob = np.logaddexp(all_label[-1], all_blank[-1])
+        heapq.heappush(queue, (-score, next(counter), node, None, log_prob))
+        enter = entering(node, np.arange(V), np.maximum)
+        # Nothing enters before the prefix can be complete
+        start = int(np.argmax(enter.max(axis=0) > -np.inf))
+        bounds = (enter[:, start:] + entry_bound[:, start:]).max(axis=1)
+        order = np.argsort(-bounds, kind="stable")
+        children[node] = (order.tolist(), bounds[order].tolist())
+        push_child(node, 0)
+
+    def open_child(node, k):
+        child = trie.extend(node, k)
+        ending[child] = tuple(
+            _extend_columns(cumulative, blank, entering(node, k, accumulate), k, accumulate)
+            for accumulate in (np.maximum, np.logaddexp)
+        )
+        return child
+
+    expand(PrefixTrie.ROOT)
+    while queue:
+        negative_score, _, node, rank, log_prob = heapq.heappop(queue)
+        if rank is None:
+            yield Hypothesis(trie.labels(node), -negative_score, log_prob)
+        else:
+            push_child(node, rank + 1)
+            expand(open_child(node, children[node][0][rank]))
+
+
+def nbest(log_probs, blank, n, dtype=np.float64):
+    """The n best hypotheses as a list of Hypothesis tuples; see kbest."""
+    return list(itertools.islice(kbest(log_probs, blank, dtype), n))
+
+
+# ===== PREFIX-SHARED RESCORING =====
+def _trie_scores(trie, cumulative, blank, accumulate=np.logaddexp):
+    """
+    Per trie node, the log-probability of frames :T collapsing to its prefix.
+
+    All nodes of one depth are extended together from their parents' rows.
+
+    Args:
+        trie: PrefixTrie of candidate prefixes
+        cumulative: (V, T + 1) cumulative sums of the log-probabilities along frames
+        blank: Vocabulary index of the blank
+        accumulate: np.logaddexp to sum all alignments, np.maximum for the best one
+
+    Returns:
+        final: (len(trie),) score of every node
+    """
+    T = cumulative.shape[1] - 1
+    depth = np.array(trie.length)
+    parent = np.array(trie.parent)
+    label = np.array(trie.label)
+    final = np.empty(len(trie), dtype=cumulative.dtype)
+    final[PrefixTrie.ROOT] = cumulative[blank, T]
+
+    # Rows of the previous depth: node id -> row of label_end / blank_end
+    nodes = np.array([PrefixTrie.ROOT])
+    label_end = np.full((1, T), -np.inf, dtype=cumulative.dtype)
+    blank_end = cumulative[None, blank, 1:]
+    for d in range(1, depth.max(initial=0) + 1):
+        row = np.empty(len(trie), dtype=np.intp)
+        row[nodes] = np.arange(len(nodes))
+        nodes = np.flatnonzero(depth == d)
+        k = label[nodes]
+        rows = row[parent[nodes]]
+
+        enter = np.full((len(nodes), T), -np.inf, dtype=cumulative.dtype)
+        if d == 1:
+            enter[:, 0] = 0.0
+        enter[:, 1:] = accumulate(label_end[rows, :-1], blank_end[rows, :-1])
+        # A repeated label needs a blank in between
+        repeat = k == label[parent[nodes]]
+        enter[repeat, 1:] = blank_end[rows[repeat], :-1]
+
+        label_end, blank_end = _extend_columns(cumulative, blank, enter, k, accumulate)
+        final[nodes] = accumulate(label_end[:, -1], blank_end[:, -1])
+    return final
+
+
+def rescore(log_probs, candidates, blank, dtype=np.float64):
+    """
+    log P(candidate | X) for many candidate transcripts of one utterance.
+
+    Candidates are inserted into a PrefixTrie, and the trie is processed one
+    depth at a time. Every node gets its per-frame log-probabilities of
+    ending in its last label or in a blank from its parent's, so a prefix
+    shared by many candidates ("na group", "na groups", "na grouping") is
+    computed once. All nodes of one depth are handled together in (n, T)
+    array operations. The cost is O(trie nodes * T), instead of
+    O(candidates * S * T) for one forward_log call per candidate.
+
+    The cumulative sums need finite log-probabilities, so -inf entries are
+    counted at LOG_FLOOR. A second pass over the same trie then finds, by
+    max-plus over a 0 / -1 penalty per frame, the candidates whose every
+    alignment crosses a -inf entry; those score -inf, as do candidates too
+    long for T frames.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities
+        candidates: Sequence of label sequences (vocabulary indices, no blanks)
+        blank: Vocabulary index of the blank
+        dtype: Floating-point type of the per-frame arrays and the scores
+
+    Returns:
+        scores: (len(candidates),) log P(candidate|X), -inf for candidates
+            that have no alignment of nonzero probability
+    """
+    impossible = np.isneginf(log_probs)
+    log_probs, cumulative = _cumulative(log_probs, dtype)
+    T = log_probs.shape[1]
+    trie = PrefixTrie()
+    ends = []
+    feasible = np.ones(len(candidates), dtype=bool)
+    for i, labels in enumerate(candidates):
+        node = PrefixTrie.ROOT
+        labels = [int(k) for k in labels]
+        for k in labels:
+            node = trie.extend(node, k)
+        ends.append(node)
+        # min_frames of the extended labels: one frame per label, plus a
+        # blank between repeats
+        repeats = sum(a == b for a, b in zip(labels, labels[1:]))
+        feasible[i] = len(labels) + repeats <= T
+
+    scores = _trie_scores(trie, cumulative, blank)[ends]
+    if impossible.any():
+        penalty = np.zeros((log_probs.shape[0], T + 1), dtype=dtype)
+        penalty[:, 1:] = -np.cumsum(impossible, axis=1)
+        crossings = _trie_scores(trie, penalty, blank, np.maximum)[ends]
+        feasible &= crossings == 0
+    scores[~feasible] = -np.inf
+    return scores
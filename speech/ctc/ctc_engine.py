@@ -0,0 +1,614 @@
+"""
+CTC Engine - Vectorized forward recurrence
+Same alpha trellis as forward_algorithm in ctc_calculations.py, but each
+timestep is a single array update over all S states. The log-space variant
+works on log-probabilities (or raw logits) so long utterances do not underflow,
+and the batched variant scores a whole padded batch in one recurrence. The
+backward (beta) pass mirrors the same skip rules and yields the loss gradient.
+
+Only the feasible diagonal band of the trellis is computed: at frame t a
+state must be reachable from the start (s <= 2t + 1) and still able to
+reach the end (s >= S - 2(T - t)). Targets too long for the input are
+rejected before any recurrence runs (section 8.3 of ctc.md).
+
+Engines only see integer arrays: text is encoded by ctc_vocab, and
+compile_labels builds the label array, skip mask and minimum length of a
+target once, with array operations.
+
+Every recurrence takes a dtype (np.float64 by default). With np.float32 the
+inputs are cast once and every trellis, mask and loss stays float32, which
+halves their memory; verify_precision.py measures what that costs in
+accuracy and what it gains in speed (little, at these array sizes).
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+CompiledTarget = namedtuple("CompiledTarget", ["labels", "skip", "min_frames"])
+CompiledTarget.__doc__ = """
+A transcript prepared for the recurrences (arrays are read-only, they may be shared).
+
+labels: (S,) extended label array, blank at the even positions
+skip: (S,) skip_mask(labels)
+min_frames: Fewest frames that can emit the transcript
+"""
+
+
+# ===== TARGET PREPARATION =====
+def extended_labels(Z, vocab_to_idx):
+    """
+    Map an extended sequence Z to its vocabulary indices.
+
+    Args:
+        Z: Extended sequence with blanks (e.g. ['ε', 'n', 'ε', ...])
+        vocab_to_idx: Mapping from character to index
+
+    Returns:
+        labels: (S,) integer array, labels[s] = vocab_to_idx[Z[s]]
+    """
+    return np.fromiter((vocab_to_idx[z] for z in Z), dtype=np.intp, count=len(Z))
+
+
+def skip_mask(labels):
+    """
+    States that may be entered directly from s-2 (Case 2 of the recurrence).
+
+    Blanks sit at the even positions of Z, so labels[s] == labels[s-2] holds
+    for every blank and for every repeated character. Both are Case 1; every
+    other state with s >= 2 is Case 2.
+
+    Args:
+        labels: (S,) integer label array of the extended sequence
+
+    Returns:
+        skip: (S,) boolean array, True where alpha[s-2] feeds alpha[s]
+    """
+    skip = np.zeros(len(labels), dtype=bool)
+    skip[2:] = labels[2:] != labels[:-2]
+    return skip
+
+
+def min_frames(labels, skip=None):
+    """
+    Fewest frames that can emit the target: one per label, plus one blank
+    between every pair of equal consecutive labels.
+
+    Args:
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+
+    Returns:
+        T_min: Minimum input length (|Y| + number of repeats)
+    """
+    if skip is None:
+        skip = skip_mask(labels)
+    return len(labels) // 2 + int(np.count_nonzero(~skip[3::2]))
+
+
+def check_feasible(labels, skip, T):
+    """Raise ValueError if the target cannot be emitted in T frames."""
+    needed = min_frames(labels, skip)
+    if T < needed:
+        raise ValueError(
+            f"target of {len(labels) // 2} labels needs at least {needed} frames, got {T}"
+        )
+
+
+def compile_labels(targets, blank):
+    """
+    CompiledTarget of a sequence of vocabulary indices (not cached).
+
+    Args:
+        targets: (U,) vocabulary indices without blanks
+        blank: Vocabulary index of the blank
+
+    Returns:
+        CompiledTarget with S = 2U + 1 states
+    """
+    targets = np.asarray(targets, dtype=np.intp)
+    labels = np.full(2 * len(targets) + 1, blank, dtype=np.intp)
+    labels[1::2] = targets
+    skip = skip_mask(labels)
+    labels.flags.writeable = False
+    skip.flags.writeable = False
+    return CompiledTarget(labels, skip, min_frames(labels, skip))
+
+
+def feasible_band(S, T):
+    """
+    Per-frame range of states on some complete path.
+
+    Args:
+        S: Number of extended states
+        T: Number of frames
+
+    Returns:
+        lo, hi: (T,) integer arrays; only states lo[t] <= s < hi[t] can lie on
+            a path from (0 or 1, 0) to (S-2 or S-1, T-1)
+    """
+    t = np.arange(T)
+    hi = np.minimum(S, 2 * t + 2)
+    lo = np.maximum(0, S - 2 * (T - t))
+    return lo, hi
+
+
+def _band(S, T, band):
+    """feasible_band as Python lists, or the whole trellis when band is False."""
+    if not band:
+        return [0] * T, [S] * T
+    lo, hi = feasible_band(S, T)
+    return lo.tolist(), hi.tolist()
+
+
+def _prepare(labels, skip, T):
+    if T == 0:
+        raise ValueError("input has no frames (T = 0); every trellis needs at least one")
+    labels = np.asarray(labels)
+    if skip is None:
+        skip = skip_mask(labels)
+    check_feasible(labels, skip, T)
+    return labels, skip
+
+
+# ===== FORWARD ALGORITHM =====
+def forward_vectorized(probs, labels, skip=None, band=True, dtype=np.float64):
+    """
+    Compute the forward (alpha) probabilities for CTC, one timestep at a time.
+
+    Args:
+        probs: (vocab_size, T) probability matrix
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        band: Compute only the feasible band; cells that cannot reach the
+            end are left at 0 (use band=False for the full trellis)
+        dtype: Floating-point type of the trellis
+
+    Returns:
+        alpha: (S, T) forward probabilities
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    T = probs.shape[1]
+    labels, skip = _prepare(labels, skip, T)
+    S = len(labels)
+    lo, hi = _band(S, T, band)
+
+    # Time-major with two zero guard states in front, so that the s-1 and s-2
+    # predecessors of every state are plain slices of the previous row
+    padded = np.zeros((T, S + 2), dtype=dtype)
+    emit = np.ascontiguousarray(probs[labels].T, dtype=dtype)
+    skip_weight = skip.astype(padded.dtype)
+
+    # Initialization: only the leading blank and the first character
+    padded[0, 2 + lo[0] : 2 + min(S, 2)] = emit[0, lo[0] : 2]
+
+    for t in range(1, T):
+        l, h = lo[t], hi[t]
+        prev = padded[t - 1]
+        total = padded[t, 2 + l : 2 + h]
+        np.add(prev[2 + l : 2 + h], prev[1 + l : 1 + h], out=total)
+        total += prev[l:h] * skip_weight[l:h]
+        total *= emit[t, l:h]
+
+    return padded[:, 2:].T
+
+
+def ctc_probability(alpha):
+    """P(Y|X) = alpha[S-2, T-1] + alpha[S-1, T-1] (just alpha[0, T-1] for an empty target)."""
+    return alpha[-2:, -1].sum()
+
+
+def backward_vectorized(probs, labels, skip=None, band=True, dtype=np.float64):
+    """
+    Compute the backward (beta) probabilities for CTC.
+
+    beta[s, t] is the probability of emitting z_s at t and then completing Z
+    from state s over the remaining frames, so that for every t
+    sum_s alpha[s, t] * beta[s, t] / P(z_s | t) = P(Y|X).
+
+    Args:
+        probs: (vocab_size, T) probability matrix
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        band: Compute only the feasible band; cells unreachable from the
+            start are left at 0 (use band=False for the full trellis)
+        dtype: Floating-point type of the trellis
+
+    Returns:
+        beta: (S, T) backward probabilities
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    T = probs.shape[1]
+    labels, skip = _prepare(labels, skip, T)
+    S = len(labels)
+    lo, hi = _band(S, T, band)
+
+    # Two zero guard states after the end, mirroring forward_vectorized
+    padded = np.zeros((T, S + 2), dtype=dtype)
+    emit = np.ascontiguousarray(probs[labels].T, dtype=dtype)
+    # State s may jump to s+2 exactly when s+2 may be entered from s
+    skip_weight = np.zeros(S, dtype=padded.dtype)
+    skip_weight[:-2] = skip[2:]
+
+    # Termination: only the final character and the trailing blank
+    end = max(S - 2, 0)
+    padded[T - 1, end:S] = emit[T - 1, end:]
+
+    for t in range(T - 2, -1, -1):
+        l, h = lo[t], hi[t]
+        nxt = padded[t + 1]
+        total = padded[t, l:h]
+        np.add(nxt[l:h], nxt[l + 1 : h + 1], out=total)
+        total += nxt[l + 2 : h + 2] * skip_weight[l:h]
+        total *= emit[t, l:h]
+
+    return padded[:, :-2].T
+
+
+# ===== LOG-SPACE FORWARD ALGORITHM =====
+def log_softmax(logits, axis=0):
+    """
+    Numerically stable log-softmax.
+
+    Args:
+        logits: Unnormalized scores, classes along `axis`
+        axis: Class axis (0 for a (vocab_size, T) matrix)
+
+    Returns:
+        log_probs: Same shape as logits, each slice along `axis` log-sums to 0
+    """
+    logits = np.asarray(logits)
+    shifted = logits - logits.max(axis=axis, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=axis, keepdims=True))
+
+
+def _log_sum3(x0, x1, x2, out):
+    """
+    Elementwise log(exp(x0) + exp(x1) + exp(x2)), -inf where all three are -inf.
+
+    Shifting by the running maximum keeps the exponentials in range; this is
+    several times faster than two chained np.logaddexp calls. Where all three
+    are -inf the shift is the most negative finite number instead, so the sum
+    is 0 and its log the -inf wanted: callers run under
+    np.errstate(divide="ignore"), once per call rather than once per frame.
+    """
+    m = np.maximum(x0, x1)
+    np.maximum(m, x2, out=m)
+    np.maximum(m, np.finfo(m.dtype).min, out=m)
+    np.subtract(x0, m, out=out)
+    np.exp(out, out=out)
+    term = np.subtract(x1, m)
+    np.exp(term, out=term)
+    out += term
+    np.subtract(x2, m, out=term)
+    np.exp(term, out=term)
+    out += term
+    np.log(out, out=out)
+    out += m
+    return out
+
+
+def log_mask(mask, dtype=np.float64):
+    """0 where mask is True, -inf elsewhere: a log-space transition weight."""
+    penalty = np.full(np.shape(mask), -np.inf, dtype=dtype)
+    penalty[mask] = 0.0
+    return penalty
+
+
+@np.errstate(divide="ignore")
+def _forward_log_padded(log_probs, labels, skip, band, dtype=np.float64):
+    """log alpha as a time-major (T, S + 2) array with two -inf guard states in front."""
+    S = len(labels)
+    T = log_probs.shape[1]
+    lo, hi = _band(S, T, band)
+
+    padded = np.full((T, S + 2), -np.inf, dtype=dtype)
+    emit = np.ascontiguousarray(log_probs[labels].T, dtype=dtype)
+    skip_penalty = log_mask(skip, dtype)
+
+    padded[0, 2 + lo[0] : 2 + min(S, 2)] = emit[0, lo[0] : 2]
+
+    for t in range(1, T):
+        l, h = lo[t], hi[t]
+        prev = padded[t - 1]
+        total = padded[t, 2 + l : 2 + h]
+        _log_sum3(
+            prev[2 + l : 2 + h],
+            prev[1 + l : 1 + h],
+            prev[l:h] + skip_penalty[l:h],
+            total,
+        )
+        total += emit[t, l:h]
+
+    return padded
+
+
+def forward_log(log_probs, labels, skip=None, from_logits=False, band=True, dtype=np.float64):
+    """
+    Compute log alpha for CTC with log-sum-exp instead of products.
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities, or logits if from_logits
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        from_logits: Apply log_softmax over the vocabulary axis first
+        band: Compute only the feasible band (see forward_vectorized)
+        dtype: Floating-point type of the trellis
+
+    Returns:
+        log_alpha: (S, T) log forward probabilities (-inf for cells not computed)
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    if from_logits:
+        log_probs = log_softmax(np.asarray(log_probs, dtype=dtype), axis=0)
+    labels, skip = _prepare(labels, skip, log_probs.shape[1])
+    return _forward_log_padded(log_probs, labels, skip, band, dtype)[:, 2:].T
+
+
+def ctc_loss_log(log_alpha):
+    """CTC loss -log P(Y|X) from a log alpha trellis."""
+    return -np.logaddexp.reduce(log_alpha[-2:, -1])
+
+
+def _backward_skip_penalty(skip, dtype=np.float64):
+    """0 where state s may jump to s+2, -inf elsewhere (log-space mask)."""
+    penalty = np.full(len(skip), -np.inf, dtype=dtype)
+    penalty[:-2] = log_mask(skip[2:], dtype)
+    return penalty
+
+
+@np.errstate(divide="ignore")
+def backward_log(log_probs, labels, skip=None, from_logits=False, band=True, dtype=np.float64):
+    """
+    Compute log beta for CTC (log-space counterpart of backward_vectorized).
+
+    Args:
+        log_probs: (vocab_size, T) log-probabilities, or logits if from_logits
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        from_logits: Apply log_softmax over the vocabulary axis first
+        band: Compute only the feasible band (see backward_vectorized)
+        dtype: Floating-point type of the trellis
+
+    Returns:
+        log_beta: (S, T) log backward probabilities (-inf for cells not computed)
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    if from_logits:
+        log_probs = log_softmax(np.asarray(log_probs, dtype=dtype), axis=0)
+    T = log_probs.shape[1]
+    labels, skip = _prepare(labels, skip, T)
+    S = len(labels)
+    lo, hi = _band(S, T, band)
+
+    # Two -inf guard states after the end, mirroring forward_log
+    padded = np.full((T, S + 2), -np.inf, dtype=dtype)
+    emit = np.ascontiguousarray(log_probs[labels].T, dtype=dtype)
+    skip_penalty = _backward_skip_penalty(skip, dtype)
+
+    end = max(S - 2, 0)
+    padded[T - 1, end:S] = emit[T - 1, end:]
+
+    for t in range(T - 2, -1, -1):
+        l, h = lo[t], hi[t]
+        nxt = padded[t + 1]
+        total = padded[t, l:h]
+        _log_sum3(
+            nxt[l:h], nxt[l + 1 : h + 1], nxt[l + 2 : h + 2] + skip_penalty[l:h], total
+        )
+        total += emit[t, l:h]
+
+    return padded[:, :-2].T
+
+
+# ===== GRADIENT =====
+@np.errstate(divide="ignore")
+def ctc_loss_and_grad(logits, labels, skip=None, dtype=np.float64):
+    """
+    CTC loss and its gradient with respect to the (pre-softmax) logits.
+
+    Uses dL/du[k, t] = y[k, t] - sum_{s: z_s = k} alpha[s, t] * beta[s, t] / (y[k, t] * P).
+    The beta pass is fused with the gradient: each beta column is combined
+    with the stored alpha column and scattered onto the vocabulary with
+    np.bincount, so neither a beta trellis nor any (S, T, V) array is built.
+
+    Args:
+        logits: (vocab_size, T) unnormalized scores
+        labels: (S,) integer label array of the extended sequence
+        skip: Optional precomputed skip_mask(labels)
+        dtype: Floating-point type of the trellis and the gradient
+
+    Returns:
+        loss: -log P(Y|X)
+        grad: (vocab_size, T) dL/dlogits (zeros if P(Y|X) is 0)
+
+    Raises:
+        ValueError: If T is 0 or the target needs more than T frames
+    """
+    log_probs = log_softmax(np.asarray(logits, dtype=dtype), axis=0)
+    V, T = log_probs.shape
+    labels, skip = _prepare(labels, skip, T)
+    S = len(labels)
+    lo, hi = _band(S, T, True)
+
+    log_alpha = _forward_log_padded(log_probs, labels, skip, True, dtype)[:, 2:]
+    loss = -np.logaddexp.reduce(log_alpha[T - 1, -2:])
+    grad = np.exp(log_probs)
+    if not np.isfinite(loss):
+        # Feasible length, but every path crosses a zero probability
+        return loss, np.zeros((V, T), dtype=dtype)
+
+    emit = np.ascontiguousarray(log_probs[labels].T)
+    skip_penalty = _backward_skip_penalty(skip, dtype)
+
+    nxt = np.full(S + 2, -np.inf, dtype=dtype)
+    cur = np.full(S + 2, -np.inf, dtype=dtype)
+    end = max(S - 2, 0)
+    nxt[end:S] = emit[T - 1, end:]
+
+    for t in range(T - 1, -1, -1):
+        l, h = lo[t], hi[t]
+        if t < T - 1:
+            cur.fill(-np.inf)
+            total = cur[l:h]
+            _log_sum3(
+                nxt[l:h],
+                nxt[l + 1 : h + 1],
+                nxt[l + 2 : h + 2] + skip_penalty[l:h],
+                total,
+            )
+            total += emit[t, l:h]
+            nxt, cur = cur, nxt
+
+        # Posterior occupancy of each state at t, then summed per vocabulary entry.
+        # Occupancies sum to 1 at every frame, so each frame is normalized by its
+        # own total rather than by the loss, whose rounding error grows with T
+        occupancy = log_alpha[t, l:h] + nxt[l:h] - emit[t, l:h]
+        np.exp(occupancy - occupancy.max(), out=occupancy)
+        occupancy /= occupancy.sum()
+        grad[:, t] -= np.bincount(labels[l:h], weights=occupancy, minlength=V)
+
+    return loss, grad
+
+
+# ===== BATCHED LOG-SPACE FORWARD ALGORITHM =====
+def batch_extended_labels(targets, target_lengths, blank):
+    """
+    Build padded extended label sequences for a batch of targets.
+
+    Args:
+        targets: (B, U_max) integer target matrix, padding ignored
+        target_lengths: (B,) number of valid labels in each row
+        blank: Vocabulary index of the blank
+
+    Returns:
+        labels: (B, 2 * U_max + 1) extended labels, padding filled with blank
+        skip: (B, 2 * U_max + 1) skip masks (see skip_mask)
+    """
+    targets = np.asarray(targets)
+    target_lengths = np.asarray(target_lengths)
+    B, U = targets.shape
+    valid = np.arange(U) < target_lengths[:, None]
+
+    labels = np.full((B, 2 * U + 1), blank, dtype=np.intp)
+    labels[:, 1::2] = np.where(valid, targets, blank)
+
+    skip = np.zeros(labels.shape, dtype=bool)
+    skip[:, 2:] = labels[:, 2:] != labels[:, :-2]
+    return labels, skip
+
+
+def batch_min_frames(labels, skip, target_lengths):
+    """min_frames for every row of a padded batch."""
+    target_lengths = np.asarray(target_lengths)
+    s = np.arange(labels.shape[1])
+    repeat = ~skip & (s % 2 == 1) & (s >= 3) & (s < 2 * target_lengths[:, None] + 1)
+    return target_lengths + repeat.sum(axis=1)
+
+
+def batch_band(input_lengths, target_lengths, T):
+    """
+    Per-frame state range covering the feasible band of every row in a batch.
+
+    Returns:
+        lo, hi: Python lists of length T (see feasible_band)
+    """
+    S_max = 2 * int(np.max(target_lengths, initial=0)) + 1
+    t = np.arange(T)
+    hi = np.minimum(S_max, 2 * t + 2)
+    # The loosest lower bound in the batch (a row's own bound is S_b - 2(T_b - t))
+    S_b = 2 * np.asarray(target_lengths) + 1
+    slack = np.min(S_b - 2 * np.asarray(input_lengths), initial=S_max)
+    lo = np.maximum(0, slack + 2 * t)
+    return lo.tolist(), hi.tolist()
+
+
+@np.errstate(divide="ignore")
+def ctc_loss_batch(
+    log_probs, input_lengths, targets, target_lengths, blank, from_logits=False, dtype=np.float64
+):
+    """
+    CTC loss for a padded batch, with one recurrence step per frame for all utterances.
+
+    Utterances whose target needs more frames than they have are given an
+    infinite loss up front and left out of the recurrence.
+
+    Args:
+        log_probs: (B, vocab_size, T_max) log-probabilities, or logits if from_logits
+        input_lengths: (B,) number of valid frames per utterance
+        targets: (B, U_max) padded integer targets
+        target_lengths: (B,) number of valid labels per target
+        blank: Vocabulary index of the blank
+        from_logits: Apply log_softmax over the vocabulary axis first
+        dtype: Floating-point type of the recurrence and the losses (log_probs
+            are read in place and cast one column at a time)
+
+    Returns:
+        losses: (B,) -log P(Y_b|X_b), each read at its own input and target length
+    """
+    if from_logits:
+        log_probs = log_softmax(np.asarray(log_probs, dtype=dtype), axis=1)
+    input_lengths = np.asarray(input_lengths)
+    target_lengths = np.asarray(target_lengths)
+    labels, skip = batch_extended_labels(targets, target_lengths, blank)
+
+    losses = np.full(len(labels), np.inf, dtype=dtype)
+    losses[(input_lengths == 0) & (target_lengths == 0)] = 0.0
+    active = (input_lengths > 0) & (
+        input_lengths >= batch_min_frames(labels, skip, target_lengths)
+    )
+    if not active.any():
+        return losses
+
+    # Only feasible rows take part; they are gathered from log_probs in place
+    rows = np.flatnonzero(active)
+    labels, skip = labels[rows], skip[rows]
+    input_lengths = input_lengths[rows]
+    target_lengths = target_lengths[rows]
+    B, S = labels.shape
+    T = int(input_lengths.max())
+    lo, hi = batch_band(input_lengths, target_lengths, T)
+
+    # Utterances are read off at their last frame: alpha[S_b-2] + alpha[S_b-1].
+    # The +2 accounts for the two -inf guard states in front of every row.
+    last_state = 2 * target_lengths + 2
+    ends_at = [[] for _ in range(T)]
+    for b in range(B):
+        ends_at[input_lengths[b] - 1].append(b)
+
+    prev = np.full((B, S + 2), -np.inf, dtype=dtype)
+    cur = np.full((B, S + 2), -np.inf, dtype=dtype)
+    skip_penalty = log_mask(skip, dtype)
+
+    prev[:, 2 + lo[0] : 2 + min(S, 2)] = log_probs[
+        rows[:, None], labels[:, lo[0] : 2], 0
+    ]
+
+    for t in range(T):
+        if t > 0:
+            l, h = lo[t], hi[t]
+            total = cur[:, 2 + l : 2 + h]
+            _log_sum3(
+                prev[:, 2 + l : 2 + h],
+                prev[:, 1 + l : 1 + h],
+                prev[:, l:h] + skip_penalty[:, l:h],
+                total,
+            )
+            total += log_probs[rows[:, None], labels[:, l:h], t]
+            prev, cur = cur, prev
+
+        done = np.asarray(ends_at[t], dtype=np.intp)
+        if len(done):
+            ends = prev[done, last_state[done]]
+            before = prev[done, last_state[done] - 1]
+            losses[rows[done]] = -np.logaddexp(ends, before)
+
+    return losses
@@ -0,0 +1,185 @@
+"""
+CTC Table Export - Write probability, alpha, beta and alignment matrices
+Rows are formatted in bulk: one printf-style format string per row is applied
+to all of its values at once (as np.savetxt does), instead of one format()
+call per cell, and lines are written a chunk at a time. Cells at or below a
+floor (alpha underflow, -inf outside the band) are written as fixed text.
+
+Formats:
+    latex   "label & v1 & ... & vT \\\\" rows for an array environment
+    csv     one header line, then "label,v1,...,vT" rows
+    npy     the matrix as .npy (float32 by default), copied in column chunks
+
+Usage (export the trellises of a sharded corpus, see ctc_io.py):
+    python ctc_export.py corpus/ trellises/ --format csv --matrices log_alpha alignment
+"""
+
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+
+from ctc_align import viterbi_align
+from ctc_engine import backward_log, compile_labels, forward_log, log_softmax
+from ctc_io import ShardedPosteriors
+
+MATRICES = ("log_probs", "log_alpha", "log_beta", "alignment")
+EXTENSIONS = {"latex": ".tex", "csv": ".csv", "npy": ".npy"}
+
+
+# ===== TEXT TABLES =====
+def format_rows(
+    matrix, fmt, prefixes=None, sep=" & ", end=" \\\\\n", floor=None, floor_text="0"
+):
+    """
+    Yield one formatted line per matrix row.
+
+    Args:
+        matrix: (rows, columns) array (memory maps are read row by row)
+        fmt: printf-style format of one value, e.g. "%.4f"
+        prefixes: Optional text written before each row
+        sep: Text between values
+        end: Text after each row
+        floor: Values <= floor (and NaN) are written as floor_text
+        floor_text: Replacement for values at or below the floor
+    """
+    sep = sep.replace("%", "%%")
+    full = sep.join([fmt] * matrix.shape[1])
+    floor_piece = floor_text.replace("%", "%%")
+    for r in range(matrix.shape[0]):
+        row = np.asarray(matrix[r])
+        row_format = full
+        if floor is not None:
+            keep = row > floor
+            if not keep.all():
+                row_format = sep.join(np.where(keep, fmt, floor_piece).tolist())
+                row = row[keep]
+        line = row_format % tuple(row.tolist())
+        yield (prefixes[r] if prefixes is not None else "") + line + end
+
+
+def write_table(f, matrix, fmt, chunk_rows=256, **kwargs):
+    """Write format_rows(matrix, fmt, **kwargs) to f, chunk_rows lines per write."""
+    rows = format_rows(matrix, fmt, **kwargs)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        f.write("".join(chunk))
+
+
+def write_latex(f, matrix, fmt="%.4f", prefixes=None, floor=None, floor_text="0"):
+    """Write the rows of a LaTeX array: "<prefix>v1 & ... & vT \\\\"."""
+    write_table(f, matrix, fmt, prefixes=prefixes, floor=floor, floor_text=floor_text)
+
+
+def write_csv(f, matrix, fmt="%.6g", header=None, prefixes=None):
+    """Write matrix as CSV, with an optional header line (list of column names)."""
+    if header is not None:
+        f.write(",".join(header) + "\n")
+    write_table(f, matrix, fmt, prefixes=prefixes, sep=",", end="\n")
+
+
+# ===== BINARY =====
+def write_binary(path, matrix, dtype=np.float32, chunk_columns=1 << 16):
+    """
+    Save matrix as .npy, copying chunk_columns columns at a time.
+
+    float32 halves the size of a float64 trellis; the log-domain values keep
+    about 7 significant digits. Read back with np.load(path, mmap_mode="r").
+    """
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=matrix.shape)
+    for c0 in range(0, matrix.shape[1], chunk_columns):
+        out[:, c0 : c0 + chunk_columns] = matrix[:, c0 : c0 + chunk_columns]
+    out.flush()
+    del out
+
+
+# ===== UTTERANCES =====
+def alignment_matrix(states, S):
+    """(S, T) uint8 matrix with a 1 at (states[t], t), e.g. from Alignment.states."""
+    states = np.asarray(states)
+    matrix = np.zeros((S, len(states)), dtype=np.uint8)
+    matrix[states, np.arange(len(states))] = 1
+    return matrix
+
+
+def utterance_matrices(log_probs, labels, names=MATRICES):
+    """Compute the requested matrices of one utterance; returns {name: (matrix, row labels)}."""
+    matrices = {}
+    if "log_probs" in names:
+        matrices["log_probs"] = (log_probs, np.arange(log_probs.shape[0]))
+    if "log_alpha" in names:
+        matrices["log_alpha"] = (forward_log(log_probs, labels), labels)
+    if "log_beta" in names:
+        matrices["log_beta"] = (backward_log(log_probs, labels), labels)
+    if "alignment" in names:
+        states = viterbi_align(log_probs, labels).states
+        matrices["alignment"] = (alignment_matrix(states, len(labels)), labels)
+    return matrices
+
+
+def export_matrix(path, matrix, row_labels, fmt):
+    """Write one matrix in format fmt ("latex", "csv" or "npy") with a label column."""
+    if fmt == "npy":
+        write_binary(path, matrix, dtype=np.uint8 if matrix.dtype == np.uint8 else np.float32)
+        return
+    value_format = "%d" if matrix.dtype == np.uint8 else None
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "latex":
+            prefixes = [f"{label} & " for label in row_labels.tolist()]
+            write_latex(
+                f, matrix, value_format or "%.4f", prefixes, floor=-np.inf, floor_text="-\\infty"
+            )
+        else:
+            prefixes = [f"{label}," for label in row_labels.tolist()]
+            header = ["label"] + [f"t{t + 1}" for t in range(matrix.shape[1])]
+            write_csv(f, matrix, value_format or "%.6g", header, prefixes)
+
+
+# ===== COMMAND LINE =====
+def main():
+    parser = argparse.ArgumentParser(description="Export CTC matrices of a sharded corpus.")
+    parser.add_argument("corpus", help="Sharded corpus directory (index.jsonl with targets)")
+    parser.add_argument("output", help="Output directory")
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default="csv")
+    parser.add_argument("--matrices", nargs="+", choices=MATRICES, default=list(MATRICES))
+    parser.add_argument(
+        "--input",
+        dest="input_kind",
+        choices=["log_probs", "probs", "logits"],
+        help="What the shards hold (default: input_kind from the index, else probs)",
+    )
+    parser.add_argument("--blank", type=int, default=-1, help="Index of the blank (default: last)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    corpus = ShardedPosteriors(args.corpus)
+    input_kind = args.input_kind or corpus.input_kind or "probs"
+    start = time.perf_counter()
+    written = 0
+    for utt in corpus:
+        log_probs = utt.posteriors
+        if input_kind == "probs":
+            with np.errstate(divide="ignore"):
+                log_probs = np.log(log_probs)
+        elif input_kind == "logits":
+            log_probs = log_softmax(log_probs, axis=0)
+        labels = compile_labels(utt.targets, args.blank % log_probs.shape[0]).labels
+
+        matrices = utterance_matrices(log_probs, labels, args.matrices)
+        for name, (matrix, row_labels) in matrices.items():
+            path = os.path.join(args.output, f"{utt.id}.{name}{EXTENSIONS[args.format]}")
+            export_matrix(path, matrix, row_labels, args.format)
+            written += os.path.getsize(path)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(corpus)} utterances, {written / 1e6:.1f} MB in {elapsed:.2f} s "
+        f"({written / 1e6 / max(elapsed, 1e-9):.1f} MB/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
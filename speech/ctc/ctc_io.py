@@ -0,0 +1,194 @@
+"""
+CTC Posterior I/O - Zero-copy access to stored model output
+Posteriors are opened as memory maps and utterances are handed out as array
+views, so the engines read straight from the page cache and frames that are
+never scored are never read from disk.
+
+Supported storage:
+    .npy        one (vocab_size, T) matrix, memory-mapped
+    .npz        several named matrices; members stored uncompressed
+                (np.savez) are memory-mapped, compressed ones are read
+    sharded     a directory of (frames, vocab_size) .npy shards plus
+                index.jsonl records {"id", "shard", "offset", "frames",
+                "input_kind", ...} (the layout written by ctc_synth.write_corpus;
+                input_kind is "probs", "log_probs" or "logits")
+"""
+
+import functools
+import json
+import os
+import zipfile
+from collections import namedtuple
+
+import numpy as np
+
+INDEX_NAME = "index.jsonl"
+
+Utterance = namedtuple("Utterance", ["id", "posteriors", "targets"])
+Utterance.__doc__ = """
+One stored utterance.
+
+id: Utterance id from the index
+posteriors: (vocab_size, T) view into its shard (no copy)
+targets: Target vocabulary indices from the index, or None
+"""
+
+
+# ===== SINGLE FILES =====
+def _npz_member_offset(f, info):
+    """Byte offset of a stored zip member's data (after its local file header)."""
+    f.seek(info.header_offset + 26)
+    name_length, extra_length = np.frombuffer(f.read(4), dtype="<u2")
+    return info.header_offset + 30 + int(name_length) + int(extra_length)
+
+
+def load_npz(path):
+    """
+    Open every array of an .npz archive.
+
+    Members written by np.savez are stored uncompressed inside the zip and
+    come back as read-only np.memmap views; members of np.savez_compressed
+    have to be inflated and are returned as ordinary arrays.
+
+    Returns:
+        arrays: Dict mapping member names (without .npy) to arrays
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[: -len(".npy")] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            f.seek(_npz_member_offset(f, info))
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_posteriors(path):
+    """
+    Memory-map a .npy matrix, or every matrix of an .npz archive.
+
+    Returns:
+        posteriors: Read-only array for .npy, dict of arrays for .npz
+    """
+    if path.endswith(".npz"):
+        return load_npz(path)
+    return np.load(path, mmap_mode="r")
+
+
+# ===== SHARDED CORPORA =====
+@functools.lru_cache(maxsize=64)
+def _map_shard(path, inode, mtime_ns, size):
+    return np.load(path, mmap_mode="r")
+
+
+def _open_shard(path):
+    """
+    Memory map of a shard; recently used shards stay mapped.
+
+    The cache is keyed by the file's inode, modification time and size as
+    well as its path, so a shard rewritten in place (e.g. a corpus
+    regenerated into the same directory) is mapped afresh.
+    """
+    stat = os.stat(path)
+    return _map_shard(path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ShardedPosteriors:
+    """
+    Read-only view of a sharded posterior corpus.
+
+    Shards are memory-mapped on first use and stay mapped; every utterance is
+    a transposed slice of its shard, i.e. a (vocab_size, T) view that can be
+    passed directly to forward_log, greedy_decode, viterbi_align, ...
+    input_kind says what the shards hold ("probs", "log_probs" or "logits"),
+    or is None for an index that does not record it.
+
+    Usage:
+        corpus = ShardedPosteriors("corpus/")
+        for utt in corpus:
+            loss = ctc_loss_log(forward_log(np.log(utt.posteriors), labels))
+    """
+
+    def __init__(self, directory, index_name=INDEX_NAME):
+        self.directory = directory
+        with open(os.path.join(directory, index_name), encoding="utf-8") as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+        self._positions = {record["id"]: i for i, record in enumerate(self.records)}
+        kinds = {record.get("input_kind") for record in self.records}
+        if len(kinds) > 1:
+            raise ValueError(f"{index_name} mixes posterior kinds: {sorted(map(str, kinds))}")
+        self.input_kind = kinds.pop() if kinds else None
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for record in self.records:
+            yield self._utterance(record)
+
+    def __getitem__(self, key):
+        """Utterance by position (int) or by id (str)."""
+        if isinstance(key, str):
+            key = self._positions[key]
+        return self._utterance(self.records[key])
+
+    def __contains__(self, utterance_id):
+        return utterance_id in self._positions
+
+    def shard(self, name):
+        """The (frames, vocab_size) memory map of one shard."""
+        return _open_shard(os.path.join(self.directory, name))
+
+    def view(self, record):
+        """(vocab_size, T) zero-copy view of one index record."""
+        start = record["offset"]
+        return self.shard(record["shard"])[start : start + record["frames"]].T
+
+    def _utterance(self, record):
+        return Utterance(record["id"], self.view(record), record.get("targets"))
+
+
+def read_slice(path, offset, frames):
+    """(vocab_size, frames) view of rows offset .. offset + frames of a frame-major .npy shard."""
+    return _open_shard(path)[offset : offset + frames].T
+
+
+# ===== BATCHING =====
+def pad_batch(posteriors, fill=0.0, dtype=None):
+    """
+    Copy utterance views into one padded batch for the batched engines.
+
+    This is the one place where frames are copied: ctc_loss_batch and
+    viterbi_align_batch need a (B, vocab_size, T_max) array.
+
+    Args:
+        posteriors: Sequence of (vocab_size, T_b) arrays
+        fill: Value of padded frames (ignored by the engines)
+        dtype: Output dtype (default: that of the first utterance)
+
+    Returns:
+        batch: (B, vocab_size, T_max) array
+        lengths: (B,) frames per utterance
+    """
+    lengths = np.array([p.shape[1] for p in posteriors], dtype=np.intp)
+    V = posteriors[0].shape[0]
+    batch = np.full(
+        (len(posteriors), V, int(lengths.max())), fill, dtype=dtype or posteriors[0].dtype
+    )
+    for b, p in enumerate(posteriors):
+        batch[b, :, : lengths[b]] = p
+    return batch, lengths
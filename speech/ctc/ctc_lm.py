@@ -0,0 +1,159 @@
+"""
+CTC Language Model - ARPA n-gram model for shallow fusion
+Section 8.1 of ctc.md: CTC outputs are conditionally independent, so language
+knowledge has to come from an external model. ShallowFusion adds a weighted
+n-gram score (and an insertion bonus) to every prefix in prefix_beam_search.
+"""
+
+import functools
+import math
+
+LOG10 = math.log(10.0)
+
+# ARPA files use -99 as log10(0)
+ARPA_LOG_ZERO = -99.0
+
+
+# ===== N-GRAM MODEL =====
+class NGramLM:
+    """
+    Back-off n-gram model loaded from an ARPA file.
+
+    States are tuples of at most order-1 tokens, trimmed to the longest
+    history that actually occurs in the model, so equivalent histories share
+    one state (and one cache entry). Scores are natural logs.
+    """
+
+    def __init__(self, log_probs, backoffs, order, cache_size=65536):
+        """
+        Args:
+            log_probs: Dict mapping n-gram tuples to log10 probabilities
+            backoffs: Dict mapping n-gram tuples to log10 back-off weights
+            order: Highest n-gram order
+            cache_size: Maximum number of (state, token) scores kept in the LRU cache
+        """
+        self.log_probs = log_probs
+        self.backoffs = backoffs
+        self.order = order
+        # Histories worth remembering: every n-gram that some longer n-gram extends
+        self.contexts = {ngram[:-1] for ngram in log_probs if len(ngram) > 1}
+        self.contexts.update(backoffs)
+        unk = log_probs.get(("<unk>",), ARPA_LOG_ZERO)
+        self.unk_log_prob = unk * LOG10
+        # Bounded memo of (state, token) -> (log_prob, next_state)
+        self.score = functools.lru_cache(maxsize=cache_size)(self._score)
+
+    @classmethod
+    def from_arpa(cls, path, cache_size=65536):
+        """Load a model from an ARPA-format text file."""
+        log_probs = {}
+        backoffs = {}
+        order = 0
+        n = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line == "\\data\\" or line.startswith("ngram "):
+                    continue
+                if line == "\\end\\":
+                    break
+                if line.startswith("\\") and line.endswith("-grams:"):
+                    n = int(line[1 : line.index("-")])
+                    order = max(order, n)
+                    continue
+                fields = line.split()
+                ngram = tuple(fields[1 : 1 + n])
+                log_probs[ngram] = float(fields[0])
+                if len(fields) > 1 + n:
+                    backoffs[ngram] = float(fields[1 + n])
+        return cls(log_probs, backoffs, order, cache_size=cache_size)
+
+    def start(self):
+        """State at the beginning of a sentence."""
+        return self._trim(("<s>",))
+
+    def _trim(self, history):
+        history = history[-(self.order - 1) :] if self.order > 1 else ()
+        while history and history not in self.contexts:
+            history = history[1:]
+        return history
+
+    def _score(self, state, token):
+        """Uncached log P(token | state) and the state after token."""
+        log_prob = 0.0
+        history = state
+        while True:
+            ngram = history + (token,)
+            if ngram in self.log_probs:
+                log_prob += self.log_probs[ngram] * LOG10
+                break
+            if not history:
+                log_prob += self.unk_log_prob
+                break
+            log_prob += self.backoffs.get(history, 0.0) * LOG10
+            history = history[1:]
+        return log_prob, self._trim(state + (token,))
+
+
+# ===== SHALLOW FUSION =====
+class ShallowFusion:
+    """
+    Language model scoring for prefix beam search.
+
+    A hypothesis is ranked by
+        log P_ctc + weight * log P_lm + insertion_bonus * (number of LM tokens)
+
+    With word_delimiter=None every CTC label is an LM token (character LM).
+    Otherwise labels are spelled into words, and a word is scored when the
+    delimiter label (usually the space) follows it, or at the end.
+
+    Per-prefix LM information is a tuple (state, lm_log_prob, n_tokens, word),
+    where word holds the labels of the unfinished word in word mode.
+    """
+
+    def __init__(self, lm, symbols, weight=0.5, insertion_bonus=0.0, word_delimiter=None):
+        """
+        Args:
+            lm: NGramLM (or any object with start() and score(state, token))
+            symbols: LM token for each vocabulary index (e.g. "<space>" for " ")
+            weight: LM weight
+            insertion_bonus: Score added per LM token, offsets the LM's short-output bias
+            word_delimiter: Vocabulary index that ends a word, or None for a character LM
+        """
+        self.lm = lm
+        self.symbols = symbols
+        self.weight = weight
+        self.insertion_bonus = insertion_bonus
+        self.word_delimiter = word_delimiter
+
+    def initial(self):
+        return (self.lm.start(), 0.0, 0, ())
+
+    def extend(self, info, label):
+        """LM information for the prefix extended by one CTC label."""
+        state, lm_log_prob, n_tokens, word = info
+        if self.word_delimiter is None:
+            token = self.symbols[label]
+        elif label != self.word_delimiter:
+            return (state, lm_log_prob, n_tokens, word + (label,))
+        elif not word:
+            return info
+        else:
+            token = "".join(self.symbols[i] for i in word)
+        log_prob, state = self.lm.score(state, token)
+        return (state, lm_log_prob + log_prob, n_tokens + 1, ())
+
+    def score(self, info):
+        """Fusion score of a prefix that may still be extended."""
+        _, lm_log_prob, n_tokens, _ = info
+        return self.weight * lm_log_prob + self.insertion_bonus * n_tokens
+
+    def final_score(self, info):
+        """Fusion score of a complete hypothesis (flushes the last word, adds </s>)."""
+        state, lm_log_prob, n_tokens, word = info
+        if word:
+            log_prob, state = self.lm.score(state, "".join(self.symbols[i] for i in word))
+            lm_log_prob += log_prob
+            n_tokens += 1
+        lm_log_prob += self.lm.score(state, "</s>")[0]
+        return self.weight * lm_log_prob + self.insertion_bonus * n_tokens
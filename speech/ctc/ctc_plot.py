@@ -0,0 +1,301 @@
+"""
+CTC Plots - Figures for ctc.md
+matplotlib and seaborn are imported here and nowhere else, so the numeric
+modules stay fast to import; ctc_calculations.main() loads this module
+only when it draws the figures.
+
+The annotated seaborn heatmaps draw one text artist per cell and only suit
+the worked example. plot_trellis renders trellises of any size: log scale,
+max-pooled down to a bounded raster, numbers only on small grids, and an
+optional Viterbi path overlay.
+
+Usage (render a synthetic trellis and report the time):
+    python ctc_plot.py --frames 1500 --tokens 150
+"""
+
+import argparse
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+
+from ctc_decode import greedy_decode
+
+ANNOTATE_MAX_CELLS = 400  # above this many cells, values are not written into the plot
+MAX_RASTER = (600, 1600)  # (rows, columns) drawn at most; larger grids are pooled
+
+
+def _display(symbol):
+    """How a vocabulary symbol is drawn: ␣ for space."""
+    return "␣" if symbol == " " else symbol
+
+
+def _save(fig, path):
+    fig.tight_layout()
+    fig.savefig(path, dpi=150, bbox_inches="tight", facecolor="white")
+    print(f"Saved: {path}")
+
+
+# ===== PROBABILITY MATRIX =====
+def plot_probability_matrix(probs, vocab, path="ctc_probability_matrix.png"):
+    """Annotated heatmap of P(character | timestep) (plot_trellis, log scale, when large)."""
+    V, T = probs.shape
+    if V * T > ANNOTATE_MAX_CELLS:
+        plot_trellis(
+            probs,
+            path,
+            row_labels=[_display(c) for c in vocab],
+            title="RNN Output Probabilities log P(character | timestep)",
+            log_domain=False,
+            row_name="Character",
+        )
+        return
+    fig, ax = plt.subplots(figsize=(14, 6))
+    sns.heatmap(
+        probs,
+        annot=True,
+        fmt=".3f",
+        cmap="Blues",
+        xticklabels=[f"t={i + 1}" for i in range(T)],
+        yticklabels=[_display(c) for c in vocab],
+        ax=ax,
+        cbar_kws={"label": "Probability"},
+    )
+    ax.set_xlabel("Timestep", fontsize=12)
+    ax.set_ylabel("Character", fontsize=12)
+    ax.set_title(
+        "RNN Output Probabilities P(character | timestep)", fontsize=14, fontweight="bold"
+    )
+    _save(fig, path)
+
+
+# ===== ALPHA TRELLIS =====
+def plot_alpha_trellis(alpha, Z, path="ctc_alpha_trellis.png", log_alpha=None):
+    """
+    Annotated heatmap of the forward variables alpha(s, t) (plot_trellis when large).
+
+    Linear alpha underflows to 0 after a few hundred frames, so large
+    trellises should be passed as log_alpha (from forward_log); alpha may
+    then be None.
+
+    Args:
+        alpha: (S, T) forward variables, or None if log_alpha is given
+        Z: Extended label sequence (one symbol per row)
+        path: Output image path
+        log_alpha: Optional (S, T) log forward variables
+    """
+    S, T = (alpha if log_alpha is None else log_alpha).shape
+    if S * T > ANNOTATE_MAX_CELLS:
+        if log_alpha is None:
+            plot_trellis(alpha, path, row_labels=[_display(z) for z in Z], log_domain=False)
+        else:
+            plot_trellis(log_alpha, path, row_labels=[_display(z) for z in Z])
+        return
+    if alpha is None:
+        alpha = np.exp(log_alpha)
+    fig, ax = plt.subplots(figsize=(14, 10))
+    state_labels = [f"s={i + 1}: {_display(Z[i])}" for i in range(S)]
+    sns.heatmap(
+        alpha,
+        annot=True,
+        fmt=".4f",
+        cmap="Greens",
+        xticklabels=[f"t={i + 1}" for i in range(T)],
+        yticklabels=state_labels,
+        ax=ax,
+        cbar_kws={"label": "α value"},
+    )
+    ax.set_xlabel("Timestep", fontsize=12)
+    ax.set_ylabel("State (s: character)", fontsize=12)
+    ax.set_title("Forward Algorithm α(s,t) Values", fontsize=14, fontweight="bold")
+    _save(fig, path)
+
+
+# ===== GREEDY DECODING =====
+def plot_greedy_decoding(probs, vocab, blank, path="ctc_greedy_decoding.png"):
+    """Most likely character per timestep and the collapsed output."""
+    T = probs.shape[1]
+    fig, ax = plt.subplots(figsize=(14, 6))
+    greedy_path = np.argmax(probs, axis=0)
+
+    ax.bar(range(T), [1] * T, color="lightblue", edgecolor="navy", linewidth=2)
+    for t in range(T):
+        ax.text(
+            t,
+            0.5,
+            _display(vocab[greedy_path[t]]),
+            ha="center",
+            va="center",
+            fontsize=16,
+            fontweight="bold",
+        )
+        ax.text(
+            t,
+            0.1,
+            f"p={probs[greedy_path[t], t]:.3f}",
+            ha="center",
+            va="center",
+            fontsize=10,
+        )
+
+    ax.set_xlim(-0.5, T - 0.5)
+    ax.set_ylim(0, 1)
+    ax.set_xticks(range(T))
+    ax.set_xticklabels([f"t={i + 1}" for i in range(T)])
+    ax.set_yticks([])
+    ax.set_xlabel("Timestep", fontsize=12)
+    ax.set_title(
+        "Greedy Decoding: Most Likely Character at Each Timestep",
+        fontsize=14,
+        fontweight="bold",
+    )
+
+    collapsed = [vocab[i] for i in greedy_decode(probs, blank=blank)]
+    ax.text(
+        T / 2,
+        -0.15,
+        f'Collapsed Output: "{"".join(collapsed)}"',
+        ha="center",
+        fontsize=14,
+        fontweight="bold",
+        transform=ax.get_xaxis_transform(),
+    )
+    _save(fig, path)
+
+
+# ===== LARGE TRELLISES =====
+def pool_max(matrix, max_shape=MAX_RASTER, chunk_columns=1 << 14):
+    """
+    Shrink a matrix to at most max_shape by taking the max over blocks.
+
+    Columns are pooled a chunk at a time, so a memory-mapped trellis larger
+    than RAM can be pooled too. NaN cells are ignored.
+
+    Returns:
+        pooled: (ceil(R / fr), ceil(C / fc)) array
+        factors: (fr, fc) block size along rows and columns
+    """
+    R, C = matrix.shape
+    fr = -(-R // max_shape[0])
+    fc = -(-C // max_shape[1])
+    if fr == 1 and fc == 1:
+        return np.asarray(matrix), (1, 1)
+    row_starts = np.arange(0, R, fr)
+    chunk_columns = max(fc, chunk_columns // fc * fc)
+    pooled = np.empty((len(row_starts), -(-C // fc)))
+    for c0 in range(0, C, chunk_columns):
+        block = np.fmax.reduceat(matrix[:, c0 : c0 + chunk_columns], row_starts, axis=0)
+        column_starts = np.arange(0, block.shape[1], fc)
+        pooled[:, c0 // fc : c0 // fc + len(column_starts)] = np.fmax.reduceat(
+            block, column_starts, axis=1
+        )
+    return pooled, (fr, fc)
+
+
+def plot_trellis(
+    log_values,
+    path,
+    states=None,
+    row_labels=None,
+    title="Forward Algorithm log α(s,t)",
+    max_shape=MAX_RASTER,
+    annotate_max_cells=ANNOTATE_MAX_CELLS,
+    log_domain=True,
+    row_name="State",
+):
+    """
+    Raster plot of a log-domain trellis (or probability matrix) of any size.
+
+    Work is bounded by max_shape: larger grids are max-pooled before drawing
+    with one imshow call, and numbers are only written when the (pooled)
+    grid has at most annotate_max_cells cells.
+
+    Args:
+        log_values: (rows, T) natural-log values; -inf cells are left blank
+        path: Output image path
+        states: Optional (T,) state per frame, e.g. Alignment.states, drawn as a path
+        row_labels: Optional label per row (used while there are at most 60 rows)
+        title: Figure title
+        max_shape: (rows, columns) drawn at most
+        annotate_max_cells: Largest grid that gets per-cell numbers
+        log_domain: False if log_values holds probabilities; their logs are
+            taken after pooling, so only the pooled raster is ever converted
+        row_name: Axis label of the rows
+    """
+    # Pool first (max commutes with the monotone log10), then rescale
+    pooled, (fr, fc) = pool_max(log_values, max_shape)
+    if not log_domain:
+        with np.errstate(divide="ignore"):
+            pooled = np.log(pooled)
+    pooled = np.where(np.isneginf(pooled), np.nan, pooled / np.log(10))
+    R, C = pooled.shape
+
+    fig, ax = plt.subplots(figsize=(min(4 + 0.6 * C, 16), min(3 + 0.4 * R, 10)))
+    image = ax.imshow(
+        pooled, aspect="auto", interpolation="nearest", cmap="viridis", origin="upper"
+    )
+    label = "log10 value" + (" (block max)" if fr * fc > 1 else "")
+    fig.colorbar(image, ax=ax, label=label)
+
+    if R * C <= annotate_max_cells:
+        for (r, c), value in np.ndenumerate(pooled):
+            if np.isfinite(value):
+                ax.text(
+                    c, r, f"{value:.1f}", ha="center", va="center", fontsize=7, color="white"
+                )
+
+    if states is not None:
+        frames = np.arange(len(states))
+        rows = (np.asarray(states) + 0.5) / fr - 0.5
+        ax.plot((frames + 0.5) / fc - 0.5, rows, color="red", linewidth=1)
+
+    if row_labels is not None and R <= 60 and fr == 1:
+        ax.set_yticks(range(R))
+        ax.set_yticklabels(row_labels)
+    ax.set_xlabel("Timestep" + (f" (blocks of {fc})" if fc > 1 else ""), fontsize=12)
+    ax.set_ylabel(row_name + (f" (blocks of {fr})" if fr > 1 else ""), fontsize=12)
+    ax.set_title(title, fontsize=14, fontweight="bold")
+    _save(fig, path)
+    plt.close(fig)
+
+
+def plot_all(probs, alpha, Z, vocab, blank, log_alpha=None):
+    """Write the three figures used in ctc.md to the current directory."""
+    plt.style.use("seaborn-v0_8-whitegrid")
+    plot_probability_matrix(probs, vocab)
+    plot_alpha_trellis(alpha, Z, log_alpha=log_alpha)
+    plot_greedy_decoding(probs, vocab, blank)
+    plt.close("all")
+
+
+def main():
+    from ctc_align import viterbi_align
+    from ctc_engine import forward_log
+    from ctc_synth import sample_alignment, synthesize_frames
+
+    parser = argparse.ArgumentParser(description="Render a large synthetic trellis.")
+    parser.add_argument("--frames", type=int, default=1500)
+    parser.add_argument("--tokens", type=int, default=150)
+    parser.add_argument("--vocab-size", type=int, default=30)
+    parser.add_argument("-o", "--output", default="ctc_trellis_large.png")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    V, blank = args.vocab_size, args.vocab_size - 1
+    targets = rng.integers(0, blank, size=args.tokens)
+    path = sample_alignment(targets, args.frames, blank, rng)
+    log_probs = np.log(synthesize_frames(path, rng.uniform(0.5, 0.8, args.frames), V, rng))
+    labels = np.full(2 * args.tokens + 1, blank)
+    labels[1::2] = targets
+
+    log_alpha = forward_log(log_probs, labels)
+    alignment = viterbi_align(log_probs, labels)
+    start = time.perf_counter()
+    plot_trellis(log_alpha, args.output, states=alignment.states)
+    seconds = time.perf_counter() - start
+    print(f"{log_alpha.shape[0]}x{log_alpha.shape[1]} trellis rendered in {seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
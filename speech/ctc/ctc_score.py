@@ -0,0 +1,273 @@
+"""
+CTC Corpus Scoring - Score posterior files against their transcripts
+Each utterance is a (vocab_size, T) .npy matrix plus a transcript. Workers
+in a process pool open the matrices with np.load(mmap_mode="r"), so only
+file paths cross process boundaries and the OS page cache shares the data;
+no array is ever pickled. Every result (loss, greedy decode, timing) is
+written as one JSON line as soon as it is ready.
+
+Usage (from this directory):
+    python -m ctc_score posteriors/ --workers 8 -o scores.jsonl
+    python -m ctc_score manifest.jsonl --vocab "abc ε" --input log_probs
+
+A directory is scanned for <id>.npy files with the transcript in <id>.txt,
+unless it holds a sharded corpus (index.jsonl, see ctc_io.py), whose
+utterances are scored against the "targets" of their index records.
+Posteriors are taken to be probabilities (as in ctc_export), unless --input
+or the index's "input_kind" says otherwise; matrices that are not
+distributions of that kind fail with an error record instead of a loss.
+A manifest has one JSON object per line: {"id": ..., "path": ..., "text": ...}
+(paths relative to the manifest's directory). --vocab may name a file with one
+unit per line, e.g. BPE pieces; text is split into the longest units first.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from ctc_decode import greedy_decode
+from ctc_engine import ctc_loss_log, forward_log, log_softmax
+from ctc_io import INDEX_NAME, ShardedPosteriors, read_slice
+from ctc_vocab import BLANK, Vocabulary, compile_target
+
+DEFAULT_VOCAB = "na group" + BLANK  # the worked example: 8 characters + blank
+INPUT_KINDS = ("probs", "log_probs", "logits")
+DISTRIBUTION_TOLERANCE = 1e-3  # on column sums (probs) and column logsumexps (log_probs)
+
+
+# ===== INPUT =====
+def read_manifest(path):
+    """Yield (id, posterior path, transcript) from a JSON-lines manifest."""
+    root = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry["id"], os.path.join(root, entry["path"]), entry["text"]
+
+
+def scan_directory(path):
+    """Yield (id, posterior path, transcript) for every <id>.npy with an <id>.txt."""
+    for name in sorted(os.listdir(path)):
+        stem, ext = os.path.splitext(name)
+        transcript = os.path.join(path, stem + ".txt")
+        if ext == ".npy" and os.path.exists(transcript):
+            with open(transcript, encoding="utf-8") as f:
+                yield stem, os.path.join(path, name), f.read().rstrip("\n")
+
+
+def read_sharded(corpus):
+    """Yield (id, (shard path, offset, frames), targets) for a ShardedPosteriors corpus."""
+    for record in corpus.records:
+        path = os.path.join(corpus.directory, record["shard"])
+        yield record["id"], (path, record["offset"], record["frames"]), record["targets"]
+
+
+# ===== SCORING =====
+class Scorer:
+    """
+    Scores one utterance at a time; one instance lives in every worker.
+
+    Args:
+        vocab: Sequence of symbols, one per posterior row (characters or BPE units)
+        blank: Index of the blank in vocab
+        input_kind: "probs", "log_probs" or "logits"
+    """
+
+    def __init__(self, vocab, blank, input_kind="probs"):
+        self.vocab = Vocabulary(vocab, blank)
+        self.blank = self.vocab.blank
+        self.input_kind = input_kind
+
+    def log_probs(self, posteriors):
+        """
+        Log-probabilities of a stored matrix.
+
+        Probabilities must be non-negative with columns summing to 1, and
+        log-probabilities non-positive with columns whose logsumexp is 0;
+        anything else (e.g. probabilities scored as log-probabilities) raises
+        a ValueError rather than producing a meaningless loss.
+        """
+        if self.input_kind == "logits":
+            return log_softmax(posteriors, axis=0)
+        if self.input_kind == "probs":
+            deviation = np.abs(posteriors.sum(axis=0) - 1.0).max(initial=0.0)
+            if posteriors.min(initial=0.0) < 0.0 or deviation > DISTRIBUTION_TOLERANCE:
+                raise ValueError(f"not probabilities (column sums off by {deviation:.3g})")
+            with np.errstate(divide="ignore"):
+                return np.log(posteriors)
+        deviation = np.abs(np.logaddexp.reduce(posteriors, axis=0)).max(initial=0.0)
+        if max(posteriors.max(initial=0.0), deviation) > DISTRIBUTION_TOLERANCE:
+            raise ValueError(f"not log-probabilities (column logsumexps off by {deviation:.3g})")
+        return posteriors
+
+    def score(self, utterance_id, source, transcript):
+        """
+        Return the result record of one utterance (JSON-serializable).
+
+        Args:
+            source: .npy path, or (shard path, offset, frames) of a sharded corpus
+            transcript: Text in vocab symbols, or a list of vocabulary indices
+        """
+        start = time.perf_counter()
+        record = {"id": utterance_id}
+        try:
+            if isinstance(source, tuple):
+                posteriors = read_slice(*source)
+            else:
+                posteriors = np.load(source, mmap_mode="r")
+            if posteriors.shape[0] != len(self.vocab):
+                raise ValueError(f"{posteriors.shape[0]} posterior rows for {len(self.vocab)} symbols")
+            log_probs = self.log_probs(posteriors)
+            record["frames"] = log_probs.shape[1]
+
+            tokens = greedy_decode(log_probs, self.blank)
+            record["decode"] = self.vocab.decode(tokens)
+
+            target = compile_target(transcript, self.vocab)
+            loss = ctc_loss_log(forward_log(log_probs, target.labels, target.skip))
+            record["loss"] = float(loss) if np.isfinite(loss) else None
+        except (KeyError, OSError, ValueError) as e:
+            # Unknown symbol, unreadable file, wrong vocabulary size or a
+            # target too long for the input
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["seconds"] = time.perf_counter() - start
+        return record
+
+
+_worker_scorer = None
+
+
+def _init_worker(vocab, blank, input_kind):
+    global _worker_scorer
+    _worker_scorer = Scorer(vocab, blank, input_kind)
+
+
+def _score_in_worker(task):
+    return _worker_scorer.score(*task)
+
+
+def score_corpus(tasks, scorer, workers=1, chunksize=4):
+    """
+    Score (id, source, transcript) tasks, yielding records as they finish.
+
+    With workers > 1 records arrive in completion order, not input order.
+    """
+    if workers <= 1:
+        for task in tasks:
+            yield scorer.score(*task)
+        return
+    with multiprocessing.Pool(
+        workers,
+        initializer=_init_worker,
+        initargs=(scorer.vocab.symbols, scorer.blank, scorer.input_kind),
+    ) as pool:
+        yield from pool.imap_unordered(_score_in_worker, tasks, chunksize=chunksize)
+
+
+# ===== COMMAND LINE =====
+def physical_cores():
+    """
+    Number of physical cores this process may run on.
+
+    Scoring is bound by floating-point throughput, and two hyperthreads of
+    one core share its floating-point units, so one worker per core is the
+    default. Cores are read from the Linux sysfs topology; elsewhere, all
+    logical CPUs are counted.
+    """
+    try:
+        cpus = os.sched_getaffinity(0)
+    except AttributeError:  # not Linux
+        return os.cpu_count() or 1
+    cores = set()
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(os.path.join(topology, "physical_package_id"), encoding="ascii") as f:
+                package = f.read().strip()
+            with open(os.path.join(topology, "core_id"), encoding="ascii") as f:
+                core = f.read().strip()
+        except OSError:
+            return len(cpus)
+        cores.add((package, core))
+    return len(cores) or 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m ctc_score", description="Score CTC posteriors against transcripts."
+    )
+    parser.add_argument(
+        "source",
+        help="Directory of <id>.npy/<id>.txt pairs, sharded corpus directory, or JSONL manifest",
+    )
+    parser.add_argument("-o", "--output", help="JSON-lines output file (default stdout)")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=physical_cores(),
+        help="Worker processes (default: one per physical core)",
+    )
+    parser.add_argument(
+        "--vocab",
+        default=DEFAULT_VOCAB,
+        help="Symbols, one character per row, or a file with one unit (e.g. BPE piece) per line",
+    )
+    parser.add_argument("--blank", type=int, default=-1, help="Index of the blank (default: last)")
+    parser.add_argument(
+        "--input",
+        dest="input_kind",
+        choices=INPUT_KINDS,
+        help="What the matrices hold (default: input_kind from a sharded index, else probs)",
+    )
+    parser.add_argument("--chunksize", type=int, default=4, help="Utterances per worker task")
+    args = parser.parse_args(argv)
+
+    input_kind = args.input_kind
+    if os.path.exists(os.path.join(args.source, INDEX_NAME)):
+        corpus = ShardedPosteriors(args.source)
+        tasks = list(read_sharded(corpus))
+        input_kind = input_kind or corpus.input_kind
+    elif os.path.isdir(args.source):
+        tasks = list(scan_directory(args.source))
+    else:
+        tasks = list(read_manifest(args.source))
+    vocab = args.vocab
+    if os.path.isfile(vocab):
+        with open(vocab, encoding="utf-8") as f:
+            vocab = [line.rstrip("\n") for line in f]
+    scorer = Scorer(vocab, args.blank, input_kind or "probs")
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    start = time.perf_counter()
+    frames = failed = 0
+    try:
+        for record in score_corpus(tasks, scorer, args.workers, args.chunksize):
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            frames += record.get("frames", 0)
+            failed += "error" in record
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head): stop quietly. stdout is
+        # pointed at devnull so the interpreter's final flush does not fail again.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{len(tasks)} utterances ({failed} failed), {frames} frames in {elapsed:.2f} s "
+        f"({frames / max(elapsed, 1e-9):.0f} frames/s, {args.workers} workers)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+CTC Streaming - Online forward scoring over incoming frame chunks
+Keeps only the current log alpha column of one target, so memory is O(S)
+however long the stream runs. After every chunk the scorer can report the
+log-likelihood of the complete target so far and the furthest-progressing state.
+The column is kept in the dtype asked for (float64 by default).
+"""
+
+import numpy as np
+
+from ctc_engine import _log_sum3, log_mask, log_softmax, skip_mask
+
+
+class StreamingScorer:
+    """
+    Incremental CTC forward pass for one target.
+
+    Usage:
+        scorer = StreamingScorer(labels)
+        for chunk in chunks:            # each (vocab_size, n) log-probabilities
+            scorer.push(chunk)
+            scorer.log_likelihood()     # log P(Y | frames so far)
+    """
+
+    def __init__(self, labels, skip=None, dtype=np.float64):
+        """
+        Args:
+            labels: (S,) integer label array of the extended sequence
+            skip: Optional precomputed skip_mask(labels)
+            dtype: Floating-point type of the alpha column
+        """
+        self.labels = np.asarray(labels)
+        self.dtype = np.dtype(dtype)
+        if skip is None:
+            skip = skip_mask(self.labels)
+        self.skip_penalty = log_mask(skip, self.dtype)
+        self.reset()
+
+    def reset(self):
+        """Forget all frames pushed so far."""
+        S = len(self.labels)
+        # Current column with two -inf guard states in front (as in forward_log)
+        self._column = np.full(S + 2, -np.inf, dtype=self.dtype)
+        self._spare = np.full(S + 2, -np.inf, dtype=self.dtype)
+        self.frames = 0
+
+    @np.errstate(divide="ignore")
+    def push(self, log_probs, from_logits=False):
+        """
+        Advance the forward pass over a chunk of frames.
+
+        Args:
+            log_probs: (vocab_size, n) log-probabilities, or logits if from_logits
+            from_logits: Apply log_softmax over the vocabulary axis first
+
+        Returns:
+            self, so calls can be chained
+        """
+        log_probs = np.asarray(log_probs, dtype=self.dtype)
+        if from_logits:
+            log_probs = log_softmax(log_probs, axis=0)
+        S = len(self.labels)
+        emit = np.ascontiguousarray(log_probs[self.labels].T)
+
+        for frame in emit:
+            if self.frames == 0:
+                self._column[2 : 2 + min(S, 2)] = frame[:2]
+            else:
+                # States beyond 2t + 1 are still unreachable and stay -inf
+                h = min(S, 2 * self.frames + 2)
+                prev, total = self._column, self._spare[2 : 2 + h]
+                _log_sum3(prev[2 : 2 + h], prev[1 : 1 + h], prev[:h] + self.skip_penalty[:h], total)
+                total += frame[:h]
+                self._column, self._spare = self._spare, self._column
+            self.frames += 1
+        return self
+
+    @property
+    def log_alpha(self):
+        """(S,) log alpha at the latest frame."""
+        return self._column[2:]
+
+    def log_likelihood(self):
+        """log P(Y | frames so far): alpha of the last label or the trailing blank."""
+        if self.frames == 0:
+            return 0.0 if len(self.labels) == 1 else -np.inf
+        return float(np.logaddexp.reduce(self._column[-2:]))
+
+    def best_state(self):
+        """
+        Most probable state at the latest frame.
+
+        Returns:
+            state: Index into the extended sequence (tokens matched = (state + 1) // 2)
+            log_alpha: Its log forward probability
+        """
+        state = int(np.argmax(self.log_alpha))
+        return state, float(self.log_alpha[state])
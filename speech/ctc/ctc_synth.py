@@ -0,0 +1,216 @@
+"""
+CTC Synthetic Posteriors - Benchmark corpora from the generate_probs model
+Every frame has one target symbol with a peak probability; the remaining mass
+is spread over the other symbols by a Dirichlet(1, ..., 1) draw. Frames are
+generated in batches (one dirichlet(size=n) call plus an array scatter) and
+streamed into memory-mapped .npy shards, so corpora larger than RAM can be
+written with a fixed amount of memory.
+
+Corpus layout (read back with ctc_io.py):
+    shard-00000.npy, shard-00001.npy, ...   (frames, vocab_size) arrays
+    index.jsonl                              {"id", "shard", "offset", "frames",
+                                              "input_kind", "targets"}
+
+Usage:
+    python ctc_synth.py corpus/ --utterances 10000 --tokens 40 --vocab-size 30
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+from ctc_engine import min_frames, skip_mask
+from ctc_io import INDEX_NAME
+
+SHARD_PATTERN = "shard-{:05d}.npy"
+
+
+# ===== FRAME MODEL =====
+def synthesize_frames(targets, peaks, vocab_size, rng):
+    """
+    Posterior columns with a peaked target and Dirichlet noise elsewhere.
+
+    Column t gets probability peaks[t] on targets[t]; the other vocab_size - 1
+    rows (in vocabulary order) share 1 - peaks[t] by a Dirichlet draw, and
+    each column is renormalized. Draws one dirichlet(size=n) batch, so with
+    np.random.RandomState(42) this reproduces the column-by-column loop of
+    the original generate_probs exactly.
+
+    Args:
+        targets: (n,) vocabulary index of the peak in each frame
+        peaks: (n,) peak probabilities
+        vocab_size: Number of classes V
+        rng: np.random.RandomState or np.random.Generator
+
+    Returns:
+        probs: (V, n) probability matrix, each column sums to 1
+    """
+    targets = np.asarray(targets)
+    peaks = np.asarray(peaks, dtype=float)
+    n = len(targets)
+    frames = np.arange(n)
+
+    noise = rng.dirichlet(np.ones(vocab_size - 1), size=n)
+    noise *= (1.0 - peaks)[:, None]
+    # Row of the j-th non-target class in each frame: j, or j + 1 past the target
+    others = np.arange(vocab_size - 1) + (np.arange(vocab_size - 1) >= targets[:, None])
+
+    probs = np.empty((vocab_size, n))
+    probs[others, frames[:, None]] = noise
+    probs[targets, frames] = peaks
+    probs /= probs.sum(axis=0, keepdims=True)
+    return probs
+
+
+def sample_alignment(targets, T, blank, rng):
+    """
+    Random frame-level path for a target: its extended sequence with random durations.
+
+    Every label gets at least one frame, blanks between repeated labels too;
+    the remaining frames are spread uniformly over all states.
+
+    Returns:
+        path: (T,) vocabulary index emitted at each frame
+
+    Raises:
+        ValueError: If the target needs more than T frames
+    """
+    labels = np.full(2 * len(targets) + 1, blank)
+    labels[1::2] = targets
+    skip = skip_mask(labels)
+    minimum = np.zeros(len(labels), dtype=np.intp)
+    minimum[1::2] = 1
+    minimum[2:-1:2] = ~skip[3::2]
+    spare = T - int(minimum.sum())
+    if spare < 0:
+        raise ValueError(f"target of {len(targets)} labels needs {minimum.sum()} frames, got {T}")
+    durations = minimum + rng.multinomial(spare, np.full(len(labels), 1.0 / len(labels)))
+    return np.repeat(labels, durations)
+
+
+# ===== CORPUS WRITER =====
+def write_corpus(
+    directory,
+    utterances,
+    vocab_size,
+    blank,
+    frames_per_token=4.0,
+    peak_range=(0.5, 0.8),
+    seed=0,
+    shard_frames=1 << 22,
+    chunk_bytes=64 << 20,
+    dtype=np.float32,
+):
+    """
+    Write synthetic posteriors for a list of targets as memory-mapped shards.
+
+    Shard sizes are planned from the utterance lengths first; each shard is
+    then filled chunk by chunk through np.lib.format.open_memmap, so memory
+    use is bounded by chunk_bytes (plus one index per frame of the current
+    shard) regardless of corpus size. An utterance never straddles two shards.
+
+    Args:
+        directory: Output directory (created if missing)
+        utterances: Sequence of (id, targets) pairs, targets being vocabulary indices
+        vocab_size: Number of classes V
+        blank: Vocabulary index of the blank
+        frames_per_token: Utterance length T = max(min_frames, round(U * frames_per_token))
+        peak_range: Peak probabilities are drawn uniformly from this range
+        seed: Seed of the np.random.default_rng generator
+        shard_frames: Target number of frames per shard
+        chunk_bytes: Working memory per generated chunk (float64 columns)
+        dtype: Stored dtype
+
+    Returns:
+        index: List of index records, as written to index.jsonl
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    chunk_frames = max(1, chunk_bytes // (8 * vocab_size))
+
+    # Plan: utterance lengths and shard assignment
+    index = []
+    shards = [[]]
+    shard_size = 0
+    for utterance_id, targets in utterances:
+        targets = [int(c) for c in targets]
+        labels = np.full(2 * len(targets) + 1, blank)
+        labels[1::2] = targets
+        T = max(min_frames(labels), round(len(targets) * frames_per_token), 1)
+        if shard_size and shard_size + T > shard_frames:
+            shards.append([])
+            shard_size = 0
+        record = {
+            "id": utterance_id,
+            "shard": SHARD_PATTERN.format(len(shards) - 1),
+            "offset": shard_size,
+            "frames": T,
+            "input_kind": "probs",
+            "targets": targets,
+        }
+        index.append(record)
+        shards[-1].append(record)
+        shard_size += T
+
+    # Fill every shard through a memory map, one chunk at a time. Utterances
+    # are contiguous within a shard, so short ones share a generated chunk.
+    for shard, records in enumerate(shards):
+        frame_targets = np.concatenate(
+            [[]]
+            + [sample_alignment(r["targets"], r["frames"], blank, rng) for r in records]
+        ).astype(np.intp)
+        size = len(frame_targets)
+
+        path = os.path.join(directory, SHARD_PATTERN.format(shard))
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(size, vocab_size))
+        for lo in range(0, size, chunk_frames):
+            hi = min(lo + chunk_frames, size)
+            peaks = rng.uniform(*peak_range, size=hi - lo)
+            out[lo:hi] = synthesize_frames(frame_targets[lo:hi], peaks, vocab_size, rng).T
+        out.flush()
+        del out
+
+    with open(os.path.join(directory, INDEX_NAME), "w", encoding="utf-8") as f:
+        for record in index:
+            f.write(json.dumps(record) + "\n")
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic CTC posterior corpus.")
+    parser.add_argument("directory")
+    parser.add_argument("--utterances", type=int, default=1000)
+    parser.add_argument("--tokens", type=int, default=40, help="Target length per utterance")
+    parser.add_argument("--vocab-size", type=int, default=30, help="Classes including the blank")
+    parser.add_argument("--blank", type=int, default=-1, help="Blank index (default: last)")
+    parser.add_argument("--frames-per-token", type=float, default=4.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-frames", type=int, default=1 << 22)
+    parser.add_argument("--dtype", choices=["float32", "float64"], default="float32")
+    args = parser.parse_args()
+
+    blank = args.blank % args.vocab_size
+    symbols = np.delete(np.arange(args.vocab_size), blank)
+    rng = np.random.default_rng(args.seed + 1)
+    utterances = [
+        (f"utt{i:07d}", rng.choice(symbols, size=args.tokens).tolist())
+        for i in range(args.utterances)
+    ]
+    index = write_corpus(
+        args.directory,
+        utterances,
+        args.vocab_size,
+        blank,
+        frames_per_token=args.frames_per_token,
+        seed=args.seed,
+        shard_frames=args.shard_frames,
+        dtype=np.dtype(args.dtype),
+    )
+    frames = sum(record["frames"] for record in index)
+    print(f"Wrote {len(index)} utterances, {frames} frames to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+CTC Vocabulary - Integer tokenizer for transcripts
+Text is turned into compact integer arrays once, at the edge; the engines
+only ever see vocabulary indices. The blank is one symbol, BLANK, at a
+configurable index (first or last by convention). Units may be single
+characters or multi-character pieces such as BPE units, which are matched
+longest first.
+
+Encoding and decoding work in bulk: a vocabulary of single characters maps
+a whole batch through one code-point table lookup, and decoding a batch
+joins all of its rows in one pass. Ids are int16 while the vocabulary fits
+(32,767 symbols) and int32 beyond.
+
+compile_target prepares a transcript for the recurrences and keeps recent
+ones in an LRU cache keyed by (transcript, vocabulary): read-speech prompts
+recur.
+
+Usage:
+    vocab = Vocabulary.from_units(list("na group"))            # blank last
+    targets, lengths = vocab.encode_batch(["na group", "group"])
+    texts = vocab.decode_batch(targets, lengths)
+"""
+
+import functools
+import re
+
+import numpy as np
+
+from ctc_engine import compile_labels
+
+BLANK = "ε"
+TARGET_CACHE_SIZE = 4096  # compiled transcripts kept by compile_target
+
+
+class Vocabulary:
+    """
+    Symbols of the posterior rows, with the blank at index blank.
+
+    Vocabularies are immutable and hashable, so they can key caches.
+
+    Args:
+        symbols: One symbol per posterior row (a string is split into characters)
+        blank: Index of the blank symbol (negative counts from the end)
+    """
+
+    def __init__(self, symbols, blank=-1):
+        self.symbols = tuple(symbols)
+        self.blank = blank % len(self.symbols)
+        self.dtype = np.int16 if len(self.symbols) <= np.iinfo(np.int16).max else np.int32
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols) if i != self.blank}
+        if len(self.index) != len(self.symbols) - 1:
+            raise ValueError("vocabulary symbols must be unique")
+        self._key = (self.symbols, self.blank)
+
+        units = [symbol for i, symbol in enumerate(self.symbols) if i != self.blank]
+        if all(len(unit) == 1 for unit in units):
+            # Code point -> id table (-1 for unknown, including everything past the end)
+            codes = [ord(unit) for unit in units]
+            self._table = np.full(max(codes, default=0) + 2, -1, dtype=np.int32)
+            self._table[codes] = [self.index[unit] for unit in units]
+            self._code_of = np.array(
+                [0 if i == self.blank else ord(symbol) for i, symbol in enumerate(self.symbols)],
+                dtype=np.uint32,
+            )
+            self._pattern = None
+        else:
+            # Longest unit first: the regex engine tries alternatives in order
+            units.sort(key=len, reverse=True)
+            alternatives = "|".join(re.escape(unit) for unit in units)
+            self._pattern = re.compile(f"({alternatives})|(.)", re.DOTALL)
+            self._pieces = np.array(self.symbols, dtype=object)
+
+    @classmethod
+    def from_units(cls, units, blank_first=False):
+        """Vocabulary of units plus BLANK, at index 0 or after the last unit."""
+        units = tuple(units)
+        if blank_first:
+            return cls((BLANK,) + units, blank=0)
+        return cls(units + (BLANK,), blank=-1)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __eq__(self, other):
+        return isinstance(other, Vocabulary) and self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __repr__(self):
+        return f"Vocabulary({len(self.symbols)} symbols, blank={self.blank})"
+
+    # ===== ENCODING =====
+    def lookup(self, symbols):
+        """Indices of a sequence of whole symbols, the blank included (e.g. a frame schedule)."""
+        blank_symbol = self.symbols[self.blank]
+        ids = [self.blank if s == blank_symbol else self.index[s] for s in symbols]
+        return np.array(ids, dtype=self.dtype)
+
+    def encode(self, text):
+        """
+        Vocabulary indices of text, as a (U,) array of self.dtype.
+
+        Raises:
+            KeyError: If part of the text is not covered by the units
+        """
+        if self._pattern is None:
+            return self._encode_characters(text)
+        ids = []
+        for match in self._pattern.finditer(text):
+            if match.lastindex == 2:
+                raise KeyError(match.group(2))
+            ids.append(self.index[match.group(1)])
+        return np.array(ids, dtype=self.dtype)
+
+    def _encode_characters(self, text):
+        chars = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        ids = self._table[np.minimum(chars, len(self._table) - 1)]
+        if len(ids) and ids.min() < 0:
+            raise KeyError(text[int(np.argmax(ids < 0))])
+        return ids.astype(self.dtype)
+
+    def encode_batch(self, texts):
+        """
+        Encode texts into one padded matrix.
+
+        Returns:
+            targets: (B, U_max) array of self.dtype, padded with the blank
+            lengths: (B,) int32 number of units of each text
+        """
+        texts = list(texts)
+        if self._pattern is None:
+            # Characters map one to one: encode the concatenation once
+            flat = self._encode_characters("".join(texts))
+            lengths = np.fromiter(map(len, texts), dtype=np.int32, count=len(texts))
+        else:
+            encoded = [self.encode(text) for text in texts]
+            flat = np.concatenate(encoded) if encoded else np.zeros(0, dtype=self.dtype)
+            lengths = np.array([len(ids) for ids in encoded], dtype=np.int32)
+        targets = np.full((len(texts), int(lengths.max(initial=0))), self.blank, dtype=self.dtype)
+        targets[np.arange(targets.shape[1]) < lengths[:, None]] = flat
+        return targets, lengths
+
+    # ===== DECODING =====
+    def decode(self, ids):
+        """Text of a sequence of vocabulary indices (blanks are dropped)."""
+        return self.decode_batch(np.asarray(ids, dtype=np.intp)[None])[0]
+
+    def decode_batch(self, targets, lengths=None):
+        """
+        Texts of the rows of a padded id matrix (blanks are dropped).
+
+        Args:
+            targets: (B, U_max) vocabulary indices, e.g. from encode_batch
+            lengths: Optional (B,) number of valid ids per row (default: all)
+
+        Returns:
+            texts: List of B strings
+        """
+        targets = np.asarray(targets)
+        valid = targets != self.blank
+        if lengths is not None:
+            valid &= np.arange(targets.shape[1]) < np.asarray(lengths)[:, None]
+        ids = targets[valid]
+        ends = np.cumsum(np.count_nonzero(valid, axis=1)).tolist()
+        starts = [0] + ends[:-1]
+        if self._pattern is None:
+            # One character per id: decode everything at once, then cut
+            text = self._code_of[ids].tobytes().decode("utf-32-le")
+            return [text[a:b] for a, b in zip(starts, ends)]
+        pieces = self._pieces[ids].tolist()
+        return ["".join(pieces[a:b]) for a, b in zip(starts, ends)]
+
+
+# ===== COMPILED TARGETS =====
+@functools.lru_cache(maxsize=TARGET_CACHE_SIZE)
+def _compile_target(transcript, vocab):
+    if isinstance(transcript, str):
+        transcript = vocab.encode(transcript)
+    return compile_labels(transcript, vocab.blank)
+
+
+def compile_target(transcript, vocab):
+    """
+    CompiledTarget of a transcript, memoized by (transcript, vocabulary).
+
+    Args:
+        transcript: Text, or a sequence of vocabulary indices
+        vocab: Vocabulary
+
+    Returns:
+        CompiledTarget (shared with other callers: do not modify its arrays)
+
+    Raises:
+        KeyError: If the text is not covered by the vocabulary
+    """
+    if not isinstance(transcript, str):
+        transcript = tuple(int(i) for i in transcript)
+    return _compile_target(transcript, vocab)
+
+
+compile_target.cache_info = _compile_target.cache_info
+compile_target.cache_clear = _compile_target.cache_clear
@@ -3,8 +3,37 @@ CTC Verification - Manual Calculation Check
 Validates every calculation in ctc.md
 """
 
+import io
+import json
+import os
+import tempfile
+
 import numpy as np
 
+from ctc_align import viterbi_align
+from ctc_calculations import generate_probs
+from ctc_checkpoint import ctc_loss_and_grad_checkpointed, viterbi_align_checkpointed
+from ctc_decode import greedy_decode, prefix_beam_search
+from ctc_export import write_binary, write_csv, write_latex
+from ctc_engine import (
+    backward_log,
+    backward_vectorized,
+    ctc_loss_and_grad,
+    ctc_loss_batch,
+    ctc_loss_log,
+    ctc_probability,
+    extended_labels,
+    feasible_band,
+    forward_log,
+    forward_vectorized,
+    skip_mask,
+)
+from ctc_io import ShardedPosteriors, load_posteriors
+from ctc_score import Scorer, read_manifest, read_sharded, score_corpus
+from ctc_stream import StreamingScorer
+from ctc_synth import write_corpus
+from ctc_vocab import BLANK, Vocabulary, compile_target
+
 np.set_printoptions(precision=6, suppress=True)
 np.random.seed(42)
 
@@ -141,8 +170,10 @@ probs = np.array(
     ]
 )
 
-vocab = ["n", "a", " ", "g", "r", "o", "u", "p", "eps"]
-vocab_to_idx = {c: i for i, c in enumerate(vocab)}
+vocab = Vocabulary.from_units(["n", "a", " ", "g", "r", "o", "u", "p"])  # blank last
+names = ["n", "a", " ", "g", "r", "o", "u", "p", "eps"]  # ASCII, by vocabulary index
+name_to_idx = {name: i for i, name in enumerate(names)}
+blank = name_to_idx["eps"]
 T = 12
 
 # === VERIFY COLUMN SUMS ===
@@ -156,37 +187,35 @@ print()
 
 # === EXTENDED SEQUENCE Z ===
 target_Y = list("na group")
+# Built by hand: compile_target is checked against it further down
 Z = []
 for char in target_Y:
-    Z.append("eps")
-    if char == " ":
-        Z.append(" ")
-    else:
-        Z.append(char)
-Z.append("eps")
+    Z.append(blank)
+    Z.append(name_to_idx[char])
+Z.append(blank)
+Z = np.array(Z)
 S = len(Z)
 
 print("=== EXTENDED SEQUENCE Z ===")
 print(f"Y = {target_Y} ({len(target_Y)} chars)")
-print(f"Z = {Z} ({S} states)")
+print(f"Z = {[names[z] for z in Z]} ({S} states)")
 print()
 
 
 # === FORWARD ALGORITHM ===
-def forward_algorithm(probs, Z, vocab_to_idx):
+def forward_algorithm(probs, Z, blank):
     S = len(Z)
     T = probs.shape[1]
     alpha = np.zeros((S, T))
 
     # Initialization at t=0 (corresponds to t=1 in document)
-    alpha[0, 0] = probs[vocab_to_idx[Z[0]], 0]  # eps at t=1
-    alpha[1, 0] = probs[vocab_to_idx[Z[1]], 0]  # n at t=1
+    alpha[0, 0] = probs[Z[0], 0]  # eps at t=1
+    alpha[1, 0] = probs[Z[1], 0]  # n at t=1
 
     # Recurrence
     for t in range(1, T):
         for s in range(S):
-            z_s = Z[s]
-            z_s_idx = vocab_to_idx[z_s]
+            z_s_idx = Z[s]
 
             if s == 0:
                 # Only stay in same state
@@ -197,7 +226,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
                     z_s_idx, t
                 ]
             else:
-                if z_s == "eps" or (s >= 2 and Z[s] == Z[s - 2]):
+                if Z[s] == blank or Z[s] == Z[s - 2]:
                     # Case 1: Cannot skip (blank or repeated char)
                     alpha[s, t] = (alpha[s - 1, t - 1] + alpha[s, t - 1]) * probs[
                         z_s_idx, t
@@ -211,7 +240,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
     return alpha
 
 
-alpha = forward_algorithm(probs, Z, vocab_to_idx)
+alpha = forward_algorithm(probs, Z.tolist(), blank)
 
 # === VERIFY INITIALIZATION (t=1) ===
 print("=== INITIALIZATION VERIFICATION (t=1) ===")
@@ -281,18 +310,329 @@ print()
 # === GREEDY DECODING VERIFICATION ===
 print("=== GREEDY DECODING VERIFICATION ===")
 greedy_indices = np.argmax(probs, axis=0)
-greedy_chars = [vocab[i] for i in greedy_indices]
+greedy_chars = [names[i] for i in greedy_indices]
 print(f"Argmax at each timestep: {list(greedy_indices)}")
 print(f"Characters: {greedy_chars}")
 
 # Collapse
-collapsed = []
-prev = None
-for c in greedy_chars:
-    if c != "eps" and c != prev:
-        collapsed.append(c)
-    prev = c
-collapsed_str = "".join(collapsed)
+collapsed_str = vocab.decode(greedy_decode(probs, blank=vocab.blank))
 print(f"Collapsed output: '{collapsed_str}'")
 print(f"Expected: 'na group'")
 print(f"Match: {collapsed_str == 'na group'}")
+
+# === VECTORIZED ENGINE VERIFICATION ===
+print()
+print("=== VECTORIZED ENGINE VERIFICATION ===")
+alpha_vec = forward_vectorized(probs, Z, band=False)
+max_diff = np.abs(alpha_vec - alpha).max()
+print(f"Max |alpha_vectorized - alpha_loop| = {max_diff:.3e}")
+print(f"Match: {max_diff < 1e-12}")
+
+# The banded trellis skips cells that cannot reach the end; P(Y|X) is unchanged
+alpha_band = forward_vectorized(probs, Z)
+band_lo, band_hi = feasible_band(S, T)
+computed = (band_hi - band_lo).sum() / alpha_band.size
+print(f"Banded trellis: {computed:.0%} of cells computed, P(Y|X) = {ctc_probability(alpha_band):.10f}")
+print(f"Match: {abs(ctc_probability(alpha_band) - P_Y_given_X) < 1e-15}")
+
+# === LOG-SPACE ENGINE VERIFICATION ===
+print()
+print("=== LOG-SPACE ENGINE VERIFICATION ===")
+with np.errstate(divide="ignore"):
+    log_probs = np.log(probs)  # P(n|t=10) is exactly 0 in this matrix
+loss_log = ctc_loss_log(forward_log(log_probs, Z))
+print(f"CTC Loss (log-space) = {loss_log:.6f}")
+print(f"CTC Loss (linear)    = {-np.log(P_Y_given_X):.6f}")
+print(f"Match: {abs(loss_log + np.log(P_Y_given_X)) < 1e-10}")
+
+# === BATCHED ENGINE VERIFICATION ===
+print()
+print("=== BATCHED ENGINE VERIFICATION ===")
+# Batch of two: the full example, and "na" scored on the first 3 frames only
+target_ids, target_lengths = vocab.encode_batch(["na group", "na"])
+losses = ctc_loss_batch(
+    np.stack([log_probs, log_probs]),
+    input_lengths=[T, 3],
+    targets=target_ids,
+    target_lengths=target_lengths,
+    blank=vocab.blank,
+)
+loss_na = ctc_loss_log(forward_log(log_probs[:, :3], Z[:5]))
+print(f"Batch losses = {losses}")
+print(f"Match: {abs(losses[0] - loss_log) < 1e-10 and abs(losses[1] - loss_na) < 1e-10}")
+
+# === BACKWARD PASS AND GRADIENT VERIFICATION ===
+print()
+print("=== BACKWARD PASS AND GRADIENT VERIFICATION ===")
+labels = Z
+beta = backward_vectorized(probs, labels)
+emit = probs[labels]
+# P(n|t=10) is 0, so skip those cells rather than dividing 0 by 0
+per_t = np.divide(alpha * beta, emit, out=np.zeros_like(emit), where=emit > 0).sum(axis=0)
+print(f"sum_s alpha*beta/y at each t: {per_t}")
+print(f"  Match P(Y|X) at every t: {np.allclose(per_t, P_Y_given_X, rtol=1e-10)}")
+
+# Central finite differences of the loss with respect to every logit
+logits = np.log(np.clip(probs, 1e-6, None))
+loss, grad = ctc_loss_and_grad(logits, labels)
+h = 1e-6
+fd_grad = np.zeros_like(logits)
+for k in range(len(vocab)):
+    for t in range(T):
+        bump = np.zeros_like(logits)
+        bump[k, t] = h
+        loss_plus = ctc_loss_log(forward_log(logits + bump, labels, from_logits=True))
+        loss_minus = ctc_loss_log(forward_log(logits - bump, labels, from_logits=True))
+        fd_grad[k, t] = (loss_plus - loss_minus) / (2 * h)
+max_diff = np.abs(grad - fd_grad).max()
+print(f"Max |analytic - finite difference| = {max_diff:.3e}")
+print(f"  Match: {max_diff < 1e-6}")
+
+# === PREFIX BEAM SEARCH VERIFICATION ===
+print()
+print("=== PREFIX BEAM SEARCH VERIFICATION ===")
+hypotheses = prefix_beam_search(log_probs, blank=vocab.blank, beam_width=4, top_k=3)
+for labels_h, score in hypotheses:
+    print(f"  '{vocab.decode(labels_h)}': log P = {score:.4f}")
+best = vocab.decode(hypotheses[0][0])
+print(f"Best hypothesis: '{best}'")
+print(f"Match: {best == 'na group'}")
+
+# === VITERBI FORCED ALIGNMENT VERIFICATION ===
+print()
+print("=== VITERBI FORCED ALIGNMENT VERIFICATION ===")
+alignment = viterbi_align(log_probs, labels)
+for token, start, end, score in zip(*alignment[:4]):
+    print(f"  '{names[token]}': frames {start + 1}-{end + 1}, log P = {score:.4f}")
+path_score = log_probs[labels[alignment.states], np.arange(T)].sum()
+print(f"Best path log P = {alignment.log_prob:.6f} (sum over path = {path_score:.6f})")
+print(f"  Best path <= log P(Y|X): {alignment.log_prob <= -loss_log}")
+print(f"  Match: {abs(alignment.log_prob - path_score) < 1e-10}")
+
+# === STREAMING SCORER VERIFICATION ===
+print()
+print("=== STREAMING SCORER VERIFICATION ===")
+scorer = StreamingScorer(labels)
+for start in range(0, T, 5):
+    scorer.push(log_probs[:, start : start + 5])
+    state, _ = scorer.best_state()
+    print(
+        f"  after {scorer.frames:2d} frames: log P = {scorer.log_likelihood():.6f}, "
+        f"best state {state} ({(state + 1) // 2} tokens)"
+    )
+stream_diff = np.abs(scorer.log_alpha - forward_log(log_probs, labels, band=False)[:, -1]).max()
+print(f"Max |streamed - full log alpha| at t={T} = {stream_diff:.3e}")
+print(f"  Match: {stream_diff < 1e-10 and abs(scorer.log_likelihood() + loss_log) < 1e-10}")
+
+# === CHECKPOINTED FORWARD-BACKWARD VERIFICATION ===
+print()
+print("=== CHECKPOINTED FORWARD-BACKWARD VERIFICATION ===")
+checkpoint_ok = True
+for interval in (1, 3, 4, T):
+    loss_c, grad_c = ctc_loss_and_grad_checkpointed(logits, labels, interval=interval)
+    alignment_c = viterbi_align_checkpointed(log_probs, labels, interval=interval)
+    grad_diff = np.abs(grad_c - grad).max()
+    same_path = np.array_equal(alignment_c.states, alignment.states)
+    print(f"  interval {interval:2d}: max |grad diff| = {grad_diff:.3e}, same best path: {same_path}")
+    checkpoint_ok &= abs(loss_c - loss) < 1e-12 and grad_diff < 1e-12 and same_path
+print(f"  Match: {checkpoint_ok}")
+
+# === SYNTHETIC GENERATOR VERIFICATION ===
+print()
+print("=== SYNTHETIC GENERATOR VERIFICATION ===")
+# Column-by-column loop of the original generate_probs
+loop_rng = np.random.RandomState(42)
+schedule = vocab.lookup(["n", "n", "a", BLANK, " ", "g", "r", "o", BLANK, "u", "p", BLANK])
+peaks = [0.7, 0.5, 0.6, 0.5, 0.65, 0.7, 0.6, 0.55, 0.45, 0.6, 0.7, 0.5]
+loop_probs = np.zeros((len(vocab), T))
+for t, (char_idx, main_prob) in enumerate(zip(schedule, peaks)):
+    loop_probs[char_idx, t] = main_prob
+    noise = loop_rng.dirichlet(np.ones(len(vocab) - 1)) * (1.0 - main_prob)
+    loop_probs[np.arange(len(vocab)) != char_idx, t] = noise
+loop_probs = loop_probs / loop_probs.sum(axis=0, keepdims=True)
+generated = generate_probs()
+print(f"Batched generator == loop (bitwise): {np.array_equal(generated, loop_probs)}")
+print(f"Rounded to 3 decimals == matrix above: {np.array_equal(generated.round(3), probs)}")
+
+with tempfile.TemporaryDirectory() as corpus_dir:
+    synth_rng = np.random.default_rng(7)
+    utterances = [(f"u{i}", synth_rng.integers(0, 8, size=6).tolist()) for i in range(20)]
+    index = write_corpus(corpus_dir, utterances, vocab_size=9, blank=8, shard_frames=100)
+    decoded_ok = True
+    for record in index:
+        shard = np.load(os.path.join(corpus_dir, record["shard"]), mmap_mode="r")
+        frames = shard[record["offset"] : record["offset"] + record["frames"]].T
+        decoded_ok &= np.allclose(frames.sum(axis=0), 1.0, atol=1e-6)
+        decoded_ok &= greedy_decode(frames, blank=8).tolist() == record["targets"]
+    shards = len({record["shard"] for record in index})
+    print(f"Corpus: {len(index)} utterances in {shards} shards, greedy decode == targets: {decoded_ok}")
+print(f"  Match: {np.array_equal(generated, loop_probs) and decoded_ok}")
+
+# === POSTERIOR I/O VERIFICATION ===
+print()
+print("=== POSTERIOR I/O VERIFICATION ===")
+with tempfile.TemporaryDirectory() as io_dir:
+    np.savez(os.path.join(io_dir, "example.npz"), probs=probs, log_probs=log_probs)
+    stored = load_posteriors(os.path.join(io_dir, "example.npz"))
+    npz_ok = isinstance(stored["probs"], np.memmap) and np.array_equal(stored["probs"], probs)
+    loss_npz = ctc_loss_log(forward_log(stored["log_probs"], labels))
+    print(
+        f"  .npz member memory-mapped: {isinstance(stored['probs'], np.memmap)}, "
+        f"loss from file = {loss_npz:.6f}"
+    )
+    npz_ok &= loss_npz == loss_log
+
+    write_corpus(io_dir, utterances, vocab_size=9, blank=8, shard_frames=100)
+    corpus = ShardedPosteriors(io_dir)
+    views_ok = True
+    for record, utt in zip(corpus.records, corpus):
+        shard = corpus.shard(record["shard"])
+        views_ok &= np.shares_memory(utt.posteriors, shard)
+        views_ok &= np.array_equal(utt.posteriors, shard[record["offset"] :][: record["frames"]].T)
+    print(f"  {len(corpus)} sharded utterances, all zero-copy views: {views_ok}")
+
+    # Regenerated in place: the shard cache must not hand out the old mappings
+    write_corpus(io_dir, utterances, vocab_size=9, blank=8, shard_frames=1000, seed=1)
+    rewritten = ShardedPosteriors(io_dir)
+    fresh_ok = True
+    for record, utt in zip(rewritten.records, rewritten):
+        on_disk = np.load(os.path.join(io_dir, record["shard"]))
+        fresh_ok &= np.array_equal(utt.posteriors, on_disk[record["offset"] :][: record["frames"]].T)
+    print(f"  corpus rewritten in place, views show the new shards: {fresh_ok}")
+print(f"  Match: {npz_ok and views_ok and fresh_ok}")
+
+# === CORPUS SCORING VERIFICATION ===
+print()
+print("=== CORPUS SCORING VERIFICATION ===")
+# ctc_score on a manifest of .npy files and on a sharded corpus (in worker
+# processes), against forward_log on the same matrices
+
+
+def target_labels(ids):
+    extended = np.full(2 * len(ids) + 1, vocab.blank)
+    extended[1::2] = ids
+    return extended
+
+
+score_rng = np.random.default_rng(11)
+with tempfile.TemporaryDirectory() as score_dir:
+    manifest_path = os.path.join(score_dir, "manifest.jsonl")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for i, text in enumerate(["na group", "group", "an a", "pun"]):
+            matrix = score_rng.dirichlet(np.ones(len(vocab)), size=3 * len(text) + 2).T
+            np.save(os.path.join(score_dir, f"m{i}.npy"), matrix)
+            f.write(json.dumps({"id": f"m{i}", "path": f"m{i}.npy", "text": text}) + "\n")
+    manifest = list(read_manifest(manifest_path))
+    manifest_error = 0.0
+    for (_, path, text), record in zip(
+        manifest, score_corpus(manifest, Scorer(vocab.symbols, vocab.blank))
+    ):
+        labels_m = target_labels(vocab.encode(text))
+        expected = ctc_loss_log(forward_log(np.log(np.load(path)), labels_m))
+        manifest_error = max(manifest_error, abs(record["loss"] - expected))
+    as_log_probs = score_corpus(manifest, Scorer(vocab.symbols, vocab.blank, "log_probs"))
+    rejected = all(record["error"].startswith("ValueError") for record in as_log_probs)
+
+    corpus_dir = os.path.join(score_dir, "corpus")
+    write_corpus(corpus_dir, utterances, vocab_size=9, blank=8, shard_frames=100)
+    corpus = ShardedPosteriors(corpus_dir)
+    sharded_scorer = Scorer(vocab.symbols, vocab.blank, corpus.input_kind)
+    records = {r["id"]: r for r in score_corpus(read_sharded(corpus), sharded_scorer, workers=2)}
+    sharded_error = 0.0
+    for utt in corpus:
+        expected = ctc_loss_log(forward_log(np.log(utt.posteriors), target_labels(utt.targets)))
+        sharded_error = max(sharded_error, abs(records[utt.id]["loss"] - expected))
+print(f"  manifest: {len(manifest)} utterances, max |loss - forward_log| = {manifest_error:.2e}")
+print(f"  probabilities scored as log-probabilities rejected: {rejected}")
+print(
+    f"  sharded ({corpus.input_kind} from the index, 2 workers): {len(records)} utterances, "
+    f"max |loss - forward_log| = {sharded_error:.2e}"
+)
+print(f"  Match: {manifest_error < 1e-12 and sharded_error < 1e-12 and rejected}")
+
+# === TABLE EXPORT VERIFICATION ===
+print()
+print("=== TABLE EXPORT VERIFICATION ===")
+export_rng = np.random.default_rng(3)
+trellis = np.exp(forward_log(np.log(export_rng.dirichlet(np.ones(9), 300).T), labels))
+per_cell = "".join(
+    f"{s} & " + " & ".join(f"{v:.4f}" if v > 1e-10 else "0" for v in row) + " \\\\\n"
+    for s, row in enumerate(trellis)
+)
+latex_out = io.StringIO()
+write_latex(latex_out, trellis, "%.4f", [f"{s} & " for s in range(len(trellis))], floor=1e-10)
+latex_ok = latex_out.getvalue() == per_cell
+csv_out = io.StringIO()
+write_csv(csv_out, trellis, "%.17g")
+csv_ok = np.array_equal(np.loadtxt(io.StringIO(csv_out.getvalue()), delimiter=","), trellis)
+with tempfile.TemporaryDirectory() as export_dir:
+    alpha_path = os.path.join(export_dir, "alpha.npy")
+    write_binary(alpha_path, trellis, dtype=trellis.dtype, chunk_columns=7)
+    binary_ok = np.array_equal(np.load(alpha_path), trellis)
+print(f"  {trellis.shape} trellis, LaTeX == per-cell format: {latex_ok}")
+print(f"  CSV round trip: {csv_ok}, chunked .npy round trip: {binary_ok}")
+print(f"  Match: {latex_ok and csv_ok and binary_ok}")
+
+# === VOCABULARY AND COMPILED TARGET VERIFICATION ===
+print()
+print("=== VOCABULARY AND COMPILED TARGET VERIFICATION ===")
+Z_symbols = [BLANK] * (2 * len(target_Y) + 1)
+Z_symbols[1::2] = target_Y
+reference = extended_labels(Z_symbols, {symbol: i for i, symbol in enumerate(vocab.symbols)})
+compile_target.cache_clear()
+compiled = compile_target("na group", vocab)
+compiled_ok = np.array_equal(compiled.labels, reference) and np.array_equal(reference, Z)
+compiled_ok &= np.array_equal(compiled.skip, skip_mask(reference))
+compiled_ok &= compiled.min_frames == 8
+compiled_ok &= np.array_equal(compile_target(reference[1::2], vocab).labels, reference)
+cached_ok = compile_target("na group", Vocabulary(vocab.symbols)) is compiled
+loss_compiled = ctc_loss_log(forward_log(log_probs, compiled.labels, compiled.skip))
+print(f"  labels, skip mask and min_frames ({compiled.min_frames}) as in section 5: {compiled_ok}")
+print(f"  repeated prompt served from the cache: {cached_ok} ({compile_target.cache_info()})")
+print(f"  loss with the compiled target = {loss_compiled:.6f}")
+
+# Multi-character units, blank first: longest units win, decoding restores the text
+bpe = Vocabulary.from_units(["na", " ", "gr", "ou", "p", "n", "a", "g", "r", "o", "u"], blank_first=True)
+bpe_ids, bpe_lengths = bpe.encode_batch(["na group", "group", "an"])
+bpe_ok = bpe_ids[0, : bpe_lengths[0]].tolist() == [1, 2, 3, 4, 5]
+bpe_ok &= bpe.decode_batch(bpe_ids, bpe_lengths) == ["na group", "group", "an"]
+bpe_ok &= bpe_ids.dtype == np.int16 and bpe.blank == 0
+print(f"  BPE units {bpe_ids[0, : bpe_lengths[0]].tolist()}, {bpe_ids.dtype} ids, round trip: {bpe_ok}")
+print(f"  Match: {compiled_ok and cached_ok and bpe_ok and loss_compiled == loss_log}")
+
+# === FLOAT32 PRECISION VERIFICATION ===
+print()
+print("=== FLOAT32 PRECISION VERIFICATION ===")
+# Every engine again with dtype=np.float32; results must stay float32 and
+# stay close to the float64 values above (verify_precision.py does the same
+# on long synthetic corpora)
+log_probs32 = log_probs.astype(np.float32)
+loss32, grad32 = ctc_loss_and_grad(logits, labels, dtype=np.float32)
+alignment32 = viterbi_align(log_probs32, labels, dtype=np.float32)
+single = {
+    "forward_vectorized": -np.log(
+        ctc_probability(forward_vectorized(probs, labels, dtype=np.float32))
+    ),
+    "forward_log": ctc_loss_log(forward_log(log_probs32, labels, dtype=np.float32)),
+    "backward_log": -np.logaddexp.reduce(
+        backward_log(log_probs32, labels, dtype=np.float32)[:2, 0]
+    ),
+    "ctc_loss_batch": ctc_loss_batch(
+        log_probs32[None], [T], target_ids[:1], target_lengths[:1], vocab.blank, dtype=np.float32
+    )[0],
+    "ctc_loss_and_grad": loss32,
+    "viterbi_align": alignment32.scores.sum(),
+}
+double = {name: loss_log for name in single}
+double["ctc_loss_and_grad"] = loss
+double["viterbi_align"] = alignment.scores.sum()
+deviation = max(abs(float(single[name]) - double[name]) for name in single)
+dtypes_ok = all(np.asarray(value).dtype == np.float32 for value in single.values())
+dtypes_ok &= grad32.dtype == np.float32 and alignment32.scores.dtype == np.float32
+grad_deviation = np.abs(grad32 - grad).max()
+same_path = np.array_equal(alignment32.states, alignment.states)
+print(f"  float32 loss (forward_log) = {single['forward_log']:.6f}")
+print(f"  max |float32 - float64| over {len(single)} engines = {deviation:.2e} nats")
+print(f"  max |float32 - float64| gradient = {grad_deviation:.2e}, same best path: {same_path}")
+print(f"  every result float32: {dtypes_ok}")
+print(f"  Match: {dtypes_ok and deviation < 1e-5 and grad_deviation < 1e-5 and same_path}")
@@ -4,72 +4,65 @@ CTC Forward Algorithm - Save results to file
 
 import numpy as np
 
-np.random.seed(42)
+from ctc_export import write_latex
+from ctc_synth import synthesize_frames
+from ctc_vocab import BLANK, Vocabulary
 
 # ===== PARAMETERS =====
-target_Y = list("na group")
-vocab = ["n", "a", " ", "g", "r", "o", "u", "p", "blank"]
-vocab_to_idx = {c: i for i, c in enumerate(vocab)}
+target_Y = "na group"
+vocab = Vocabulary.from_units(["n", "a", " ", "g", "r", "o", "u", "p"])  # blank last
+names = ["n", "a", " ", "g", "r", "o", "u", "p", "blank"]  # by vocabulary index
+name_to_idx = {name: i for i, name in enumerate(names)}
+blank = name_to_idx["blank"]
 T = 12
 
-# Extended sequence Z
+# Extended sequence Z as vocabulary indices, built by hand rather than with
+# ctc_vocab.compile_target, which the engines use
 Z = []
 for char in target_Y:
-    Z.append("blank")
-    Z.append(char)
-Z.append("blank")
+    Z.append(blank)
+    Z.append(name_to_idx[char])
+Z.append(blank)
 S = len(Z)
 
 
 # ===== GENERATE PROBABILITY MATRIX =====
 def generate_probs():
-    probs = np.zeros((len(vocab), T))
     char_schedule = [
         (0, "n", 0.7),
         (1, "n", 0.5),
         (2, "a", 0.6),
-        (3, "blank", 0.5),
+        (3, BLANK, 0.5),
         (4, " ", 0.65),
         (5, "g", 0.7),
         (6, "r", 0.6),
         (7, "o", 0.55),
-        (8, "blank", 0.45),
+        (8, BLANK, 0.45),
         (9, "u", 0.6),
         (10, "p", 0.7),
-        (11, "blank", 0.5),
+        (11, BLANK, 0.5),
     ]
 
-    for t, char, main_prob in char_schedule:
-        char_idx = vocab_to_idx[char]
-        probs[char_idx, t] = main_prob
-        remaining = 1.0 - main_prob
-        noise = np.random.dirichlet(np.ones(len(vocab) - 1)) * remaining
-        noise_idx = 0
-        for i in range(len(vocab)):
-            if i != char_idx:
-                probs[i, t] = noise[noise_idx]
-                noise_idx += 1
-
-    probs = probs / probs.sum(axis=0, keepdims=True)
-    return probs
+    targets = vocab.lookup([char for _, char, _ in char_schedule])
+    peaks = [main_prob for _, _, main_prob in char_schedule]
+    return synthesize_frames(targets, peaks, len(vocab), np.random.RandomState(42))
 
 
 probs = generate_probs()
 
 
 # ===== FORWARD ALGORITHM =====
-def forward_algorithm(probs, Z, vocab_to_idx):
+def forward_algorithm(probs, Z, blank):
     S = len(Z)
     T = probs.shape[1]
     alpha = np.zeros((S, T))
 
-    alpha[0, 0] = probs[vocab_to_idx[Z[0]], 0]
-    alpha[1, 0] = probs[vocab_to_idx[Z[1]], 0]
+    alpha[0, 0] = probs[Z[0], 0]
+    alpha[1, 0] = probs[Z[1], 0]
 
     for t in range(1, T):
         for s in range(S):
-            z_s = Z[s]
-            z_s_idx = vocab_to_idx[z_s]
+            z_s_idx = Z[s]
 
             if s == 0:
                 alpha[s, t] = alpha[s, t - 1] * probs[z_s_idx, t]
@@ -78,7 +71,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
                     z_s_idx, t
                 ]
             else:
-                if z_s == "blank" or (s >= 2 and Z[s] == Z[s - 2]):
+                if Z[s] == blank or Z[s] == Z[s - 2]:
                     alpha[s, t] = (alpha[s - 1, t - 1] + alpha[s, t - 1]) * probs[
                         z_s_idx, t
                     ]
@@ -90,7 +83,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
     return alpha
 
 
-alpha = forward_algorithm(probs, Z, vocab_to_idx)
+alpha = forward_algorithm(probs, Z, blank)
 
 # Save to file
 with open("ctc_results.txt", "w") as f:
@@ -99,29 +92,15 @@ with open("ctc_results.txt", "w") as f:
 
     f.write("PROBABILITY MATRIX (LaTeX format):\n")
     vocab_display = ["n", "a", "space", "g", "r", "o", "u", "p", "eps"]
-    for i, char in enumerate(vocab_display):
-        vals = " & ".join(["{:.3f}".format(probs[i, t]) for t in range(T)])
-        f.write("{} & {} \\\\\n".format(char, vals))
+    write_latex(f, probs, "%.3f", prefixes=[f"{char} & " for char in vocab_display])
     f.write("\n")
 
     f.write("ALPHA TABLE (LaTeX format):\n")
-    Z_display = []
-    for z in Z:
-        if z == "blank":
-            Z_display.append("eps")
-        elif z == " ":
-            Z_display.append("sp")
-        else:
-            Z_display.append(z)
-
-    for s in range(S):
-        vals = " & ".join(
-            [
-                "{:.4f}".format(alpha[s, t]) if alpha[s, t] > 1e-10 else "0"
-                for t in range(T)
-            ]
-        )
-        f.write("{} & {} & {} \\\\\n".format(s + 1, Z_display[s], vals))
+    state_display = ["n", "a", "sp", "g", "r", "o", "u", "p", "eps"]  # ASCII, by vocabulary index
+    Z_display = [state_display[z] for z in Z]
+
+    prefixes = [f"{s + 1} & {Z_display[s]} & " for s in range(S)]
+    write_latex(f, alpha, "%.4f", prefixes=prefixes, floor=1e-10)
     f.write("\n")
 
     P_Y_given_X = alpha[S - 2, T - 1] + alpha[S - 1, T - 1]
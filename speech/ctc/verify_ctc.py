@@ -3,61 +3,58 @@ CTC Forward Algorithm - Verification Script
 Outputs exact values for the markdown tables
 """
 
+import sys
+
 import numpy as np
 
-np.random.seed(42)
+from ctc_decode import greedy_decode
+from ctc_export import write_latex
+from ctc_synth import synthesize_frames
+from ctc_vocab import BLANK, Vocabulary
 
 # ===== PARAMETERS =====
-target_Y = list("na group")
-vocab = ["n", "a", " ", "g", "r", "o", "u", "p", "blank"]
-vocab_to_idx = {c: i for i, c in enumerate(vocab)}
+target_Y = "na group"
+vocab = Vocabulary.from_units(["n", "a", " ", "g", "r", "o", "u", "p"])  # blank last
+names = ["n", "a", " ", "g", "r", "o", "u", "p", "blank"]  # ASCII, by vocabulary index
+name_to_idx = {name: i for i, name in enumerate(names)}
+blank = name_to_idx["blank"]
 T = 12
 
-# Extended sequence Z
+# Extended sequence Z as vocabulary indices, built by hand rather than with
+# ctc_vocab.compile_target, which the engines use and this script checks
 Z = []
 for char in target_Y:
-    Z.append("blank")
-    Z.append(char)
-Z.append("blank")
+    Z.append(blank)
+    Z.append(name_to_idx[char])
+Z.append(blank)
 S = len(Z)
 
 print("Target Y: na group")
-print("Extended Z:", Z)
+print("Extended Z:", [names[z] for z in Z])
 print("S = {} states, T = {} timesteps".format(S, T))
 print()
 
 
 # ===== GENERATE PROBABILITY MATRIX =====
 def generate_probs():
-    probs = np.zeros((len(vocab), T))
     char_schedule = [
         (0, "n", 0.7),
         (1, "n", 0.5),
         (2, "a", 0.6),
-        (3, "blank", 0.5),
+        (3, BLANK, 0.5),
         (4, " ", 0.65),
         (5, "g", 0.7),
         (6, "r", 0.6),
         (7, "o", 0.55),
-        (8, "blank", 0.45),
+        (8, BLANK, 0.45),
         (9, "u", 0.6),
         (10, "p", 0.7),
-        (11, "blank", 0.5),
+        (11, BLANK, 0.5),
     ]
 
-    for t, char, main_prob in char_schedule:
-        char_idx = vocab_to_idx[char]
-        probs[char_idx, t] = main_prob
-        remaining = 1.0 - main_prob
-        noise = np.random.dirichlet(np.ones(len(vocab) - 1)) * remaining
-        noise_idx = 0
-        for i in range(len(vocab)):
-            if i != char_idx:
-                probs[i, t] = noise[noise_idx]
-                noise_idx += 1
-
-    probs = probs / probs.sum(axis=0, keepdims=True)
-    return probs
+    targets = vocab.lookup([char for _, char, _ in char_schedule])
+    peaks = [main_prob for _, _, main_prob in char_schedule]
+    return synthesize_frames(targets, peaks, len(vocab), np.random.RandomState(42))
 
 
 probs = generate_probs()
@@ -74,18 +71,17 @@ print()
 
 
 # ===== FORWARD ALGORITHM =====
-def forward_algorithm(probs, Z, vocab_to_idx):
+def forward_algorithm(probs, Z, blank):
     S = len(Z)
     T = probs.shape[1]
     alpha = np.zeros((S, T))
 
-    alpha[0, 0] = probs[vocab_to_idx[Z[0]], 0]
-    alpha[1, 0] = probs[vocab_to_idx[Z[1]], 0]
+    alpha[0, 0] = probs[Z[0], 0]
+    alpha[1, 0] = probs[Z[1], 0]
 
     for t in range(1, T):
         for s in range(S):
-            z_s = Z[s]
-            z_s_idx = vocab_to_idx[z_s]
+            z_s_idx = Z[s]
 
             if s == 0:
                 alpha[s, t] = alpha[s, t - 1] * probs[z_s_idx, t]
@@ -94,7 +90,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
                     z_s_idx, t
                 ]
             else:
-                if z_s == "blank" or (s >= 2 and Z[s] == Z[s - 2]):
+                if Z[s] == blank or Z[s] == Z[s - 2]:
                     alpha[s, t] = (alpha[s - 1, t - 1] + alpha[s, t - 1]) * probs[
                         z_s_idx, t
                     ]
@@ -106,7 +102,7 @@ def forward_algorithm(probs, Z, vocab_to_idx):
     return alpha
 
 
-alpha = forward_algorithm(probs, Z, vocab_to_idx)
+alpha = forward_algorithm(probs, Z, blank)
 
 # Print full alpha table for LaTeX
 print("=" * 80)
@@ -114,20 +110,11 @@ print("FULL ALPHA TABLE (for LaTeX)")
 print("=" * 80)
 print()
 
-Z_display = []
-for z in Z:
-    if z == "blank":
-        Z_display.append("eps")
-    elif z == " ":
-        Z_display.append("sp")
-    else:
-        Z_display.append(z)
-
-for s in range(S):
-    vals = " & ".join(
-        ["{:.4f}".format(alpha[s, t]) if alpha[s, t] > 1e-10 else "0" for t in range(T)]
-    )
-    print("{} & {} & {} \\\\".format(s + 1, Z_display[s], vals))
+state_display = ["n", "a", "sp", "g", "r", "o", "u", "p", "eps"]  # ASCII, by vocabulary index
+Z_display = [state_display[z] for z in Z]
+
+prefixes = [f"{s + 1} & {Z_display[s]} & " for s in range(S)]
+write_latex(sys.stdout, alpha, "%.4f", prefixes=prefixes, floor=1e-10)
 
 # Final result
 P_Y_given_X = alpha[S - 2, T - 1] + alpha[S - 1, T - 1]
@@ -146,13 +133,8 @@ print("=" * 80)
 print("GREEDY DECODING")
 print("=" * 80)
 greedy_path = np.argmax(probs, axis=0)
-greedy_chars = [vocab[i] for i in greedy_path]
+greedy_chars = [names[i] for i in greedy_path]
 print("Argmax indices:", list(greedy_path))
 print("Argmax chars:", greedy_chars)
-collapsed = []
-prev = None
-for c in greedy_chars:
-    if c != "blank" and c != prev:
-        collapsed.append(c)
-    prev = c
-print("Collapsed: {}".format("".join(collapsed)))
+collapsed = vocab.decode(greedy_decode(probs, blank=vocab.blank))
+print("Collapsed: {}".format(collapsed))
@@ -0,0 +1,395 @@
+"""
+CTC Engine Verification - Every engine against brute-force alignment enumeration
+Random small cases (T <= 14) are scored by every implementation and compared
+with a reference that knows nothing about the trellis: it walks through all
+alignments frame by frame, collapses them as it goes and sums their
+probabilities. Alignment prefixes with the same collapsed output and last
+symbol have the same completions, so their sums are memoized; on the smallest
+cases the memoized reference is itself checked against a plain itertools.product
+enumeration of all V^T paths.
+
+kbest is checked on the same cases: it has to list every label sequence
+exactly once, ordered by its best alignment, with the right probabilities;
+rescore scores all of them at once through one prefix trie, and must give
+-inf exactly where enumeration does when some posteriors are zero. The keyword
+spotter's end scores are compared with the best enumerated alignment over
+every span of frames.
+
+Property tests cover repeated labels (the Z[s] == Z[s-2] branch, where alpha
+may not skip a blank), empty targets and lengths too short for the target.
+
+Usage:
+    python verify_engines.py [--cases 200] [--seed 0]
+"""
+
+import argparse
+import functools
+import itertools
+import math
+
+import numpy as np
+
+from ctc_align import viterbi_align, viterbi_align_batch
+from ctc_calculations import forward_algorithm
+from ctc_checkpoint import ctc_loss_and_grad_checkpointed, viterbi_align_checkpointed
+from ctc_decode import kbest, prefix_beam_search, rescore
+from ctc_engine import (
+    backward_log,
+    backward_vectorized,
+    ctc_loss_and_grad,
+    ctc_loss_batch,
+    ctc_loss_log,
+    ctc_probability,
+    forward_log,
+    forward_vectorized,
+    log_softmax,
+    min_frames,
+)
+from ctc_kws import KeywordSpotter
+from ctc_stream import StreamingScorer
+
+TOLERANCE = 1e-9  # on log-probabilities
+GRAD_TOLERANCE = 1e-6  # against central differences
+MAX_T = 14
+EXHAUSTIVE_PATHS = 50_000  # cases with at most V^T paths are also enumerated path by path
+
+
+# ===== REFERENCE =====
+def collapse(path, blank):
+    """The collapsing function B: merge repeats, then drop blanks."""
+    return tuple(v for v, _ in itertools.groupby(path) if v != blank)
+
+
+def all_alignments(target, V, T, blank):
+    """Lazily yield every length-T path over V symbols that collapses to target."""
+    target = tuple(target)
+    for path in itertools.product(range(V), repeat=T):
+        if collapse(path, blank) == target:
+            yield path
+
+
+def brute_force_probability(probs, target, blank):
+    """
+    P(target | X) summed over all alignments, frame by frame.
+
+    rest(t, n, last) is the total probability of all ways to fill frames
+    t..T-1 given that the frames so far collapsed to target[:n] and ended in
+    symbol last; every path that leaves the target prefix is dropped at once.
+    """
+    V, T = probs.shape
+    target = tuple(target)
+    U = len(target)
+
+    @functools.lru_cache(maxsize=None)
+    def rest(t, n, last):
+        if t == T:
+            return 1.0 if n == U else 0.0
+        total = 0.0
+        for v in range(V):
+            if v == blank or v == last:
+                emitted = n  # blank, or a repeat that merges with the last label
+            elif n < U and v == target[n]:
+                emitted = n + 1
+            else:
+                continue
+            total += probs[v, t] * rest(t + 1, emitted, v)
+        return total
+
+    return rest(0, 0, blank)
+
+
+def exhaustive(probs, target, blank):
+    """(P(target | X), best single alignment probability) from all V^T paths."""
+    V, T = probs.shape
+    total, best = 0.0, 0.0
+    for path in all_alignments(target, V, T, blank):
+        p = math.prod(probs[path, range(T)].tolist())
+        total += p
+        best = max(best, p)
+    return total, best
+
+
+def all_hypotheses(probs, blank):
+    """{labels: (P(labels | X), best alignment probability)} over all V^T paths."""
+    V, T = probs.shape
+    hypotheses = {}
+    for path in itertools.product(range(V), repeat=T):
+        labels = collapse(path, blank)
+        p = math.prod(probs[path, range(T)].tolist())
+        total, best = hypotheses.get(labels, (0.0, 0.0))
+        hypotheses[labels] = (total + p, max(best, p))
+    return hypotheses
+
+
+def log_error(value, reference):
+    """|value - reference| for log-probabilities, 0 when both are log 0."""
+    return 0.0 if value == reference == -np.inf else abs(value - reference)
+
+
+# ===== CASES =====
+def random_case(rng, repeats=False, empty=False):
+    """Random (probs, target, blank) with a target that fits into T <= MAX_T frames."""
+    V = int(rng.integers(2, 6))
+    blank = int(rng.integers(0, V))
+    symbols = [v for v in range(V) if v != blank]
+    if empty:
+        target = []
+    elif repeats:
+        v = int(rng.choice(symbols))
+        target = [v] * int(rng.integers(2, 4))
+        target += rng.choice(symbols, size=int(rng.integers(0, 3))).tolist()
+        rng.shuffle(target)
+    else:
+        target = rng.choice(symbols, size=int(rng.integers(1, 6))).tolist()
+    labels = extended(target, blank)
+    T = int(rng.integers(max(min_frames(labels), 1), MAX_T + 1))
+    probs = rng.dirichlet(np.full(V, 0.5), size=T).T
+    return probs, target, blank
+
+
+def extended(target, blank):
+    labels = np.full(2 * len(target) + 1, blank)
+    labels[1::2] = target
+    return labels
+
+
+# ===== ENGINES =====
+def engine_log_probs(probs, target, blank):
+    """log P(target | X) from every single-utterance engine, by name."""
+    labels = extended(target, blank)
+    log_probs = np.log(probs)
+    V, T = probs.shape
+    results = {}
+
+    with np.errstate(divide="ignore"):
+        alpha = forward_algorithm(probs, labels.tolist(), {v: v for v in range(V)})
+        results["loop"] = np.log(ctc_probability(alpha))
+        for band in (True, False):
+            alpha = forward_vectorized(probs, labels, band=band)
+            beta = backward_vectorized(probs, labels, band=band)
+            results[f"vectorized band={band}"] = np.log(ctc_probability(alpha))
+            # sum_s alpha * beta / y is P(Y|X) at every frame
+            t = int(T // 2)
+            occupancy = alpha[:, t] * beta[:, t] / probs[labels, t]
+            results[f"vectorized alpha*beta band={band}"] = np.log(occupancy.sum())
+
+            log_alpha = forward_log(log_probs, labels, band=band)
+            log_beta = backward_log(log_probs, labels, band=band)
+            results[f"log band={band}"] = -ctc_loss_log(log_alpha)
+            results[f"log beta band={band}"] = np.logaddexp.reduce(log_beta[:2, 0])
+
+    results["loss_and_grad"] = -ctc_loss_and_grad(log_probs, labels)[0]
+    results["checkpointed interval=3"] = -ctc_loss_and_grad_checkpointed(
+        log_probs, labels, interval=3
+    )[0]
+    results["batched"] = -ctc_loss_batch(log_probs[None], [T], [target], [len(target)], blank)[0]
+
+    results["trie rescoring"] = rescore(log_probs, [target[:-1], target, target * 2], blank)[1]
+
+    scorer = StreamingScorer(labels)
+    for start in range(0, T, 3):
+        scorer.push(log_probs[:, start : start + 3])
+    results["streaming"] = scorer.log_likelihood()
+    return results
+
+
+def check_gradient(probs, target, blank, step=1e-6):
+    """Largest error of ctc_loss_and_grad against central differences of the reference."""
+    logits = np.log(probs)
+    labels = extended(target, blank)
+    _, grad = ctc_loss_and_grad(logits, labels)
+    numeric = np.zeros_like(logits)
+    for index in np.ndindex(*logits.shape):
+        shifted = []
+        for sign in (1, -1):
+            x = logits.copy()
+            x[index] += sign * step
+            p = brute_force_probability(np.exp(log_softmax(x)), target, blank)
+            shifted.append(-np.log(p))
+        numeric[index] = (shifted[0] - shifted[1]) / (2 * step)
+    return float(np.abs(grad - numeric).max())
+
+
+def check_alignment(probs, target, blank, best):
+    """Errors of the Viterbi engines against the best enumerated alignment."""
+    labels = extended(target, blank)
+    log_probs = np.log(probs)
+    T = probs.shape[1]
+    errors = {
+        "viterbi": viterbi_align(log_probs, labels).log_prob,
+        "viterbi checkpointed": viterbi_align_checkpointed(
+            log_probs, labels, interval=3
+        ).log_prob,
+        "viterbi batched": viterbi_align_batch(
+            log_probs[None], [T], [target], [len(target)], blank
+        )[0].log_prob,
+    }
+    return {name: log_error(value, np.log(best)) for name, value in errors.items()}
+
+
+def check_beam(probs, target, blank):
+    """A complete beam must give every hypothesis its exact probability."""
+    V, T = probs.shape
+    hypotheses = prefix_beam_search(np.log(probs), blank, beam_width=V**T)
+    with np.errstate(divide="ignore"):
+        return max(
+            log_error(score, np.log(brute_force_probability(probs, labels, blank)))
+            for labels, score in hypotheses[:5]
+        )
+
+
+def check_kbest(probs, blank):
+    """kbest must list every label sequence once, by decreasing best alignment."""
+    reference = all_hypotheses(probs, blank)
+    found = list(kbest(np.log(probs), blank))
+    scores = [h.score for h in found]
+    if len(found) != len(reference) or {h.labels for h in found} != set(reference):
+        return np.inf
+    if any(a < b for a, b in zip(scores, scores[1:])):
+        return np.inf
+    with np.errstate(divide="ignore"):
+        return max(
+            max(log_error(h.log_prob, np.log(reference[h.labels][0])) for h in found),
+            max(log_error(h.score, np.log(reference[h.labels][1])) for h in found),
+        )
+
+
+def check_rescore(probs, blank):
+    """rescore of every label sequence at once against the enumerated sums."""
+    reference = all_hypotheses(probs, blank)
+    scores = rescore(np.log(probs), list(reference), blank)
+    return max(
+        log_error(score, np.log(total)) for score, (total, _) in zip(scores, reference.values())
+    )
+
+
+def check_kws(probs, target, blank):
+    """Spotter end scores against the best enumerated alignment of every span ending there."""
+    log_probs = np.log(probs)
+    keywords = [target, target[::-1]]
+    spotter = KeywordSpotter(keywords, blank, threshold=np.inf)
+    V, T = probs.shape
+    error = 0.0
+    for t1 in range(T):
+        spotter.push(log_probs[:, t1 : t1 + 1])
+        for keyword, score in zip(keywords, spotter.score[spotter.ends]):
+            best = -np.inf
+            for t0 in range(t1 + 1):
+                garbage = log_probs[:, t0 : t1 + 1].max(axis=0).sum()
+                for path in all_alignments(keyword, V, t1 + 1 - t0, blank):
+                    if path[0] == keyword[0] and path[-1] == keyword[-1]:
+                        value = sum(log_probs[s, t0 + t] for t, s in enumerate(path))
+                        best = max(best, value - garbage)
+            error = max(error, log_error(score, best))
+    return error
+
+
+# ===== PROPERTY TESTS =====
+def infeasible_rejected(rng):
+    """Targets longer than the input: 0 by enumeration, error or inf in the engines."""
+    probs, target, blank = random_case(rng, repeats=True)
+    labels = extended(target, blank)
+    T = min_frames(labels) - 1
+    probs = probs[:, :T]
+    if T == 0:
+        return True
+    ok = brute_force_probability(probs, target, blank) == 0.0
+    for engine in (
+        lambda: forward_log(np.log(probs), labels),
+        lambda: forward_vectorized(probs, labels),
+        lambda: ctc_loss_and_grad(np.log(probs), labels),
+        lambda: viterbi_align(np.log(probs), labels),
+    ):
+        try:
+            engine()
+            ok = False
+        except ValueError:
+            pass
+    ok &= np.isinf(ctc_loss_batch(np.log(probs)[None], [T], [target], [len(target)], blank)[0])
+    ok &= rescore(np.log(probs), [target], blank)[0] == -np.inf
+    # No frames at all: a ValueError too, even for the empty target
+    for engine in (forward_log, forward_vectorized, ctc_loss_and_grad):
+        try:
+            engine(probs[:, :0], extended([], blank))
+            ok = False
+        except ValueError:
+            pass
+    return ok
+
+
+def zero_posteriors_exact(rng):
+    """rescore with zero posteriors: -inf exactly where enumeration finds no alignment."""
+    probs, target, blank = random_case(rng, repeats=True)
+    V, T = probs.shape
+    probs[rng.random(size=(V, T)) < 0.3] = 0.0
+    candidates = [target, target[:-1], target[1:]]
+    with np.errstate(divide="ignore"):
+        scores = rescore(np.log(probs), candidates, blank)
+        reference = [np.log(brute_force_probability(probs, c, blank)) for c in candidates]
+    return all(log_error(s, r) < TOLERANCE for s, r in zip(scores, reference))
+
+
+def min_frames_exact(rng):
+    """min_frames is the shortest T with any alignment (repeats need a blank in between)."""
+    _, target, blank = random_case(rng, repeats=True)
+    V = max(target + [blank]) + 1
+    shortest = next(T for T in itertools.count(1) if next(all_alignments(target, V, T, blank), 0))
+    return shortest == min_frames(extended(target, blank))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check every CTC engine against enumeration.")
+    parser.add_argument("--cases", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    worst = {}
+    exhaustive_cases = 0
+    grad_error = 0.0
+    reference_ok = True
+    for i in range(args.cases):
+        kind = ("plain", "repeats", "empty")[i % 3]
+        probs, target, blank = random_case(rng, repeats=kind == "repeats", empty=kind == "empty")
+        V, T = probs.shape
+        reference = np.log(brute_force_probability(probs, target, blank))
+
+        results = engine_log_probs(probs, target, blank)
+        errors = {name: log_error(value, reference) for name, value in results.items()}
+        if V**T <= EXHAUSTIVE_PATHS:
+            exhaustive_cases += 1
+            total, best = exhaustive(probs, target, blank)
+            reference_ok &= abs(np.log(total) - reference) < TOLERANCE
+            errors.update(check_alignment(probs, target, blank, best))
+            errors["beam (complete)"] = check_beam(probs, target, blank)
+            errors["kbest (all hypotheses)"] = check_kbest(probs, blank)
+            errors["rescore (all hypotheses)"] = check_rescore(probs, blank)
+            if target:
+                errors["keyword spotting (all spans)"] = check_kws(probs, target, blank)
+            grad_error = max(grad_error, check_gradient(probs, target, blank))
+        for name, error in errors.items():
+            worst[name] = max(worst.get(name, 0.0), error)
+
+    print("=== ENGINES VS BRUTE-FORCE ENUMERATION ===")
+    print(f"{args.cases} cases (T <= {MAX_T}), {exhaustive_cases} also enumerated path by path")
+    print(f"  memoized enumeration == exhaustive enumeration: {reference_ok}")
+    for name, error in worst.items():
+        print(f"  {name:<32} max |error| = {error:.2e}")
+    print(f"  {'gradient (central differences)':<32} max |error| = {grad_error:.2e}")
+    engines_ok = all(error < TOLERANCE for error in worst.values())
+    engines_ok &= grad_error < GRAD_TOLERANCE
+
+    print()
+    print("=== PROPERTY TESTS ===")
+    infeasible_ok = all(infeasible_rejected(rng) for _ in range(50))
+    min_frames_ok = all(min_frames_exact(rng) for _ in range(50))
+    zeros_ok = all(zero_posteriors_exact(rng) for _ in range(50))
+    print(f"  infeasible lengths rejected (ValueError / inf loss): {infeasible_ok}")
+    print(f"  min_frames == shortest enumerated alignment: {min_frames_ok}")
+    print(f"  rescore with zero posteriors == enumeration: {zeros_ok}")
+    properties_ok = infeasible_ok and min_frames_ok and zeros_ok
+    print(f"  Match: {reference_ok and engines_ok and properties_ok}")
+
+
+if __name__ == "__main__":
+    main()
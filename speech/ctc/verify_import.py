@@ -0,0 +1,83 @@
+"""
+CTC Import Check - The numeric modules must import quickly and without side effects
+Each module is imported in a fresh interpreter, from an empty working directory.
+The import must print nothing, write no files, leave the global NumPy RNG
+alone, not pull in matplotlib/seaborn, and stay within a time budget on top of
+NumPy's own import time.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+MODULES = [
+    "ctc_calculations",
+    "ctc_engine",
+    "ctc_decode",
+    "ctc_lm",
+    "ctc_align",
+    "ctc_stream",
+    "ctc_checkpoint",
+    "ctc_score",
+    "ctc_synth",
+    "ctc_io",
+    "ctc_bench",
+    "ctc_export",
+    "ctc_kws",
+    "ctc_vocab",
+]
+BUDGET_SECONDS = 0.25  # import time beyond NumPy's
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import json, sys, time
+import numpy as np
+state = np.random.get_state()[1].copy()
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+report = {{
+    "seconds": seconds,
+    "plotting": sorted(m for m in ("matplotlib", "seaborn") if m in sys.modules),
+    "rng_untouched": bool((np.random.get_state()[1] == state).all()),
+}}
+sys.stderr.write(json.dumps(report))
+"""
+
+
+def probe(module, workdir):
+    """Import module in a fresh interpreter; returns (report, stdout, new files)."""
+    env = dict(os.environ, PYTHONPATH=HERE, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=workdir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stderr), result.stdout, os.listdir(workdir)
+
+
+all_ok = True
+print("=== IMPORT-TIME VERIFICATION ===")
+with tempfile.TemporaryDirectory() as workdir:
+    for module in MODULES:
+        report, stdout, files = probe(module, workdir)
+        ok = (
+            report["seconds"] < BUDGET_SECONDS
+            and not report["plotting"]
+            and report["rng_untouched"]
+            and not stdout
+            and not files
+        )
+        print(
+            f"  {module:<18} {1000 * report['seconds']:6.1f} ms, "
+            f"plotting: {report['plotting'] or 'none'}, RNG untouched: {report['rng_untouched']}, "
+            f"output: {len(stdout)} chars, files: {files or 'none'}"
+        )
+        all_ok &= ok
+print(f"Budget: {1000 * BUDGET_SECONDS:.0f} ms per module beyond NumPy")
+print(f"Match: {all_ok}")
@@ -0,0 +1,208 @@
+"""
+CTC Language Model Verification - n-gram scores and shallow fusion by hand
+A small trigram model is written out as an ARPA file and loaded with
+NGramLM.from_arpa. Every score is compared with a value worked out by hand
+from the file: direct hits, one and two levels of back-off, <unk>, and the
+state left behind for the next token. ShallowFusion is checked the same way,
+as a character LM and in word-delimiter mode, where the unfinished last word
+is flushed and </s> added only by final_score.
+
+Prefix beam search with fusion and a complete beam must give every
+hypothesis its exact CTC log-probability (rescore) plus its fusion score.
+Fused and unfused searches are timed on a longer synthetic input.
+
+Usage:
+    python verify_lm.py [--frames 2000] [--seed 0]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from ctc_decode import prefix_beam_search, rescore
+from ctc_engine import log_softmax
+from ctc_lm import LOG10, NGramLM, ShallowFusion
+
+TOLERANCE = 1e-12
+
+ARPA = """\\data\\
+ngram 1=6
+ngram 2=4
+ngram 3=1
+
+\\1-grams:
+-99\t<s>\t-0.5
+-1.0\t</s>
+-0.7\ta\t-0.3
+-0.9\tb\t-0.2
+-0.6\tab\t-0.4
+-1.5\t<unk>
+
+\\2-grams:
+-0.2\t<s> a\t-0.1
+-0.4\ta b
+-0.5\ta a
+-0.3\tb </s>
+
+\\3-grams:
+-0.05\t<s> a b
+
+\\end\\
+"""
+
+# (state, token) -> (log10 P(token | state), next state), worked out from ARPA
+EXPECTED_SCORES = {
+    (("<s>",), "a"): (-0.2, ("<s>", "a")),  # bigram hit; a trigram extends "<s> a"
+    (("<s>", "a"), "b"): (-0.05, ("b",)),  # trigram hit; "a b" is never extended
+    (("b",), "</s>"): (-0.3, ()),  # nothing follows </s>
+    (("<s>", "a"), "a"): (-0.1 - 0.5, ("a",)),  # back-off("<s> a") + P(a | a)
+    (("<s>", "a"), "</s>"): (-0.1 - 0.3 - 1.0, ()),  # two back-offs to the unigram
+    (("b",), "a"): (-0.2 - 0.7, ("a",)),
+    (("b",), "zzz"): (-0.2 - 1.5, ()),  # back-off("b") + <unk>; nothing extends "zzz"
+    (("<s>",), "ab"): (-0.5 - 0.6, ("ab",)),
+    (("ab",), "a"): (-0.4 - 0.7, ("a",)),
+    (("a",), "</s>"): (-0.3 - 1.0, ()),
+}
+SYMBOLS = ["a", "b", " ", "-"]  # "-" is the blank
+BLANK = 3
+SPACE = 2
+WEIGHT = 0.7
+BONUS = 0.25
+
+
+# ===== N-GRAM MODEL =====
+def load_model(directory):
+    path = os.path.join(directory, "tiny.arpa")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(ARPA)
+    return NGramLM.from_arpa(path)
+
+
+def check_model(lm):
+    """Largest error of NGramLM.score (natural log) against the hand-computed values."""
+    error = 0.0
+    for (state, token), (log10_prob, next_state) in EXPECTED_SCORES.items():
+        log_prob, state_after = lm.score(state, token)
+        if state_after != next_state:
+            return np.inf
+        error = max(error, abs(log_prob - log10_prob * LOG10))
+    return error
+
+
+# ===== SHALLOW FUSION =====
+def fusion_info(fusion, labels):
+    info = fusion.initial()
+    for label in labels:
+        info = fusion.extend(info, label)
+    return info
+
+
+def check_fusion(lm):
+    """(name, value, expected) for prefix and final scores in both fusion modes."""
+    characters = ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS)
+    words = ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS, word_delimiter=SPACE)
+    checks = []
+
+    # "ab" as characters: P(a | <s>) P(b | <s> a), then P(</s> | b)
+    info = fusion_info(characters, [0, 1])
+    checks.append(
+        ("characters, prefix", characters.score(info), WEIGHT * -0.25 * LOG10 + 2 * BONUS)
+    )
+    checks.append(
+        ("characters, final", characters.final_score(info), WEIGHT * -0.55 * LOG10 + 2 * BONUS)
+    )
+
+    # " ab  a" as words: leading and doubled spaces score nothing, "ab" is
+    # scored at its delimiter, "a" is still unfinished
+    info = fusion_info(words, [SPACE, 0, 1, SPACE, SPACE, 0])
+    checks.append(("words, prefix", words.score(info), WEIGHT * -1.1 * LOG10 + BONUS))
+    # final_score flushes "a" (-1.1) and adds </s> (-1.3), which is not a token
+    checks.append(("words, final", words.final_score(info), WEIGHT * -3.5 * LOG10 + 2 * BONUS))
+    # Nothing left to flush after a delimiter: P(ab | <s>) P(</s> | ab)
+    info = fusion_info(words, [0, 1, SPACE])
+    checks.append(
+        ("words, final after delimiter", words.final_score(info), WEIGHT * -2.5 * LOG10 + BONUS)
+    )
+    return checks
+
+
+def check_fused_search(lm, rng, T=6):
+    """With a complete beam, every fused score is the exact log P(labels | X) plus final_score."""
+    log_probs = log_softmax(rng.normal(size=(len(SYMBOLS), T)), axis=0)
+    error = 0.0
+    for fusion in (
+        ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS),
+        ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS, word_delimiter=SPACE),
+    ):
+        hypotheses = prefix_beam_search(
+            log_probs, BLANK, beam_width=len(SYMBOLS) ** T, fusion=fusion
+        )
+        labels = [list(h) for h, _ in hypotheses]
+        exact = rescore(log_probs, labels, BLANK)
+        for (label_tuple, score), log_prob in zip(hypotheses, exact):
+            expected = log_prob + fusion.final_score(fusion_info(fusion, label_tuple))
+            # Prefixes no alignment reaches score -inf in both
+            if score != expected:
+                error = max(error, abs(score - expected))
+    return error
+
+
+def time_search(lm, rng, T):
+    """Seconds for unfused, character-fused and word-fused prefix beam search."""
+    logits = rng.normal(size=(len(SYMBOLS), T)) * 3
+    log_probs = log_softmax(logits, axis=0)
+    seconds = {}
+    for name, fusion in (
+        ("unfused", None),
+        ("character LM", ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS)),
+        ("word LM", ShallowFusion(lm, SYMBOLS, WEIGHT, BONUS, word_delimiter=SPACE)),
+    ):
+        start = time.perf_counter()
+        prefix_beam_search(log_probs, BLANK, beam_width=8, fusion=fusion)
+        seconds[name] = time.perf_counter() - start
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the n-gram LM and shallow fusion.")
+    parser.add_argument("--frames", type=int, default=2000, help="Frames in the timing input")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        lm = load_model(directory)
+
+    print("=== N-GRAM SCORES VS HAND-COMPUTED VALUES ===")
+    counts = [sum(len(ngram) == n for ngram in lm.log_probs) for n in (1, 2, 3)]
+    loaded_ok = lm.order == 3 and counts == [6, 4, 1] and len(lm.backoffs) == 5
+    print(f"  order {lm.order}, n-grams {counts}, back-off weights {len(lm.backoffs)}: {loaded_ok}")
+    model_error = check_model(lm)
+    print(f"  {len(EXPECTED_SCORES)} scores and next states, max |error| = {model_error:.2e}")
+
+    print()
+    print("=== SHALLOW FUSION ===")
+    fusion_error = 0.0
+    for name, value, expected in check_fusion(lm):
+        fusion_error = max(fusion_error, abs(value - expected))
+        print(f"  {name:<30} {value:10.6f} (expected {expected:10.6f})")
+    search_error = check_fused_search(lm, rng)
+    print(f"  complete fused beam vs rescore + final_score: max |error| = {search_error:.2e}")
+
+    print()
+    print(f"=== FUSED VS UNFUSED BEAM SEARCH (T={args.frames}, beam 8) ===")
+    seconds = time_search(lm, rng, args.frames)
+    for name, value in seconds.items():
+        print(f"  {name:<14} {value:6.3f} s ({value / seconds['unfused']:.2f}x unfused)")
+    info = lm.score.cache_info()
+    print(f"  LM cache: {info.hits} hits, {info.misses} misses")
+
+    ok = loaded_ok and max(model_error, fusion_error, search_error) < TOLERANCE
+    print(f"  Match: {ok}")
+
+
+if __name__ == "__main__":
+    main()
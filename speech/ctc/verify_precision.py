@@ -0,0 +1,319 @@
+"""
+CTC Precision Verification - float32 scoring against float64
+Every engine with a dtype option is run twice on the same synthetic corpora,
+once in float64 and once in float32, and the float32 results are compared
+with the float64 ones: the loss of forward_log, backward_log, the gradient
+pass (dense and checkpointed), the batch and the streaming scorer, the
+Viterbi path score, the keyword spotter's detections, prefix beam search,
+kbest and rescore. The float32 run must stay float32 throughout (every
+returned array and score is checked), and the largest deviations are
+reported together with the speed of both runs. Calls shorter than
+TIMING_BUDGET seconds are timed as the best of TIMING_REPEATS, since single
+short calls vary by more than the difference being measured.
+
+Log-likelihoods grow with T, and so does the float32 rounding error in them,
+so deviations are measured relative to the float64 loss. The gradient error
+grows with the loss too (occupancies are differences of log-likelihoods of
+that size), so it is reported per nat of loss: a bound of 1e-7 means that an
+utterance with a loss of 10,000 gets gradients within 1e-3 of float64.
+kbest and rescore work on cumulative sums of every vocabulary row along the
+frames, improbable labels included; those sums are much larger than the loss,
+so their float32 results get a looser bound.
+
+Usage:
+    python verify_precision.py [--grid quick|full] [--seed 0]
+"""
+
+import argparse
+import itertools
+import time
+
+import numpy as np
+
+from ctc_align import viterbi_align_batch
+from ctc_checkpoint import ctc_loss_and_grad_checkpointed
+from ctc_decode import kbest, prefix_beam_search, rescore
+from ctc_engine import (
+    backward_log,
+    ctc_loss_and_grad,
+    ctc_loss_batch,
+    ctc_loss_log,
+    forward_log,
+    log_softmax,
+)
+from ctc_kws import spot_keywords
+from ctc_stream import StreamingScorer
+from ctc_synth import sample_alignment, synthesize_frames
+
+GRIDS = {
+    # (T, U, V, B) corpora; each is a batch of B utterances of T frames
+    "quick": [(1000, 20, 30, 16), (10000, 100, 30, 4), (1000, 20, 500, 8), (100000, 100, 30, 1)],
+    "full": [
+        (1000, 20, 30, 64),
+        (10000, 200, 30, 16),
+        (100000, 400, 30, 2),
+        (1000, 20, 500, 16),
+        (10000, 100, 500, 4),
+        (20000, 200, 500, 2),
+    ],
+}
+REL_TOLERANCE = 2e-5  # on losses and log-probabilities, relative to the float64 value
+DECODE_TOLERANCE = 5e-5  # the same for kbest and rescore (see below)
+GRAD_TOLERANCE = 1e-7  # on dL/dlogits, per nat of float64 loss
+PATH_AGREEMENT = 0.99  # fraction of frames where the float32 Viterbi path agrees
+DECODE_MAX_T = 1000  # beam search, kbest and rescore are run on the shorter corpora only
+N_BEST = 5
+STREAM_CHUNK = 1000  # frames per StreamingScorer.push
+KEYWORD_LENGTH = 8
+KEYWORD_THRESHOLD = -20.0  # the logit noise costs even the planted keyword a few nats
+TIMING_REPEATS = 3
+TIMING_BUDGET = 1.0  # seconds; longer calls are timed once
+
+
+# ===== CORPORA =====
+def synthetic_batch(T, U, V, B, rng):
+    """B utterances of T frames with random targets of U labels (blank last)."""
+    blank = V - 1
+    targets = rng.integers(0, blank, size=(B, U))
+    logits = np.empty((B, V, T))
+    for b in range(B):
+        path = sample_alignment(targets[b], T, blank, rng)
+        probs = synthesize_frames(path, rng.uniform(0.5, 0.8, size=T), V, rng)
+        # Logits rather than probabilities, so the gradient pass has an input
+        logits[b] = np.log(probs) + rng.normal(size=V)[:, None]
+    return logits, targets, blank
+
+
+def extended(target, blank):
+    labels = np.full(2 * len(target) + 1, blank)
+    labels[1::2] = target
+    return labels
+
+
+def tolerance(name):
+    if name.startswith("gradient"):
+        return GRAD_TOLERANCE
+    return DECODE_TOLERANCE if name in ("kbest", "rescore") else REL_TOLERANCE
+
+
+def stream_loss(log_probs, labels, dtype):
+    """Loss of a StreamingScorer fed STREAM_CHUNK frames at a time, and its column."""
+    scorer = StreamingScorer(labels, dtype=dtype)
+    for t0 in range(0, log_probs.shape[1], STREAM_CHUNK):
+        scorer.push(log_probs[:, t0 : t0 + STREAM_CHUNK])
+    return -scorer.log_likelihood(), scorer.log_alpha
+
+
+def relative(value, reference):
+    """|value - reference| / |reference|, 0 where both are equal (infinities included)."""
+    value, reference = np.asarray(value, dtype=np.float64), np.asarray(reference)
+    same = value == reference
+    error = np.abs(value - reference) / np.maximum(np.abs(reference), 1.0)
+    return float(np.where(same, 0.0, error).max(initial=0.0))
+
+
+# ===== ENGINES =====
+def run_engines(logits, targets, blank, dtype):
+    """Every engine on one batch in one dtype; returns (results, dtypes, seconds)."""
+    B, V, T = logits.shape
+    log_probs = log_softmax(logits.astype(dtype), axis=1)
+    results, dtypes, seconds = {}, {}, {}
+
+    def timed(name, run, dtype_of):
+        seconds[name] = np.inf
+        for _ in range(TIMING_REPEATS):
+            start = time.perf_counter()
+            results[name] = value = run()
+            seconds[name] = min(seconds[name], time.perf_counter() - start)
+            if seconds[name] > TIMING_BUDGET:
+                break
+        dtypes[name] = dtype_of(value)
+
+    labels = [extended(target, blank) for target in targets]
+    timed(
+        "forward_log",
+        lambda: [
+            ctc_loss_log(forward_log(lp, lab, dtype=dtype)) for lp, lab in zip(log_probs, labels)
+        ],
+        lambda losses: {np.asarray(loss).dtype for loss in losses},
+    )
+    timed(
+        "backward_log",
+        lambda: [
+            -np.logaddexp.reduce(backward_log(lp, lab, dtype=dtype)[:2, 0])
+            for lp, lab in zip(log_probs, labels)
+        ],
+        lambda losses: {np.asarray(loss).dtype for loss in losses},
+    )
+    timed(
+        "ctc_loss_and_grad",
+        lambda: [ctc_loss_and_grad(x, lab, dtype=dtype) for x, lab in zip(logits, labels)],
+        lambda pairs: {np.asarray(loss).dtype for loss, _ in pairs} | {g.dtype for _, g in pairs},
+    )
+    timed(
+        "checkpointed gradient",
+        lambda: [
+            ctc_loss_and_grad_checkpointed(x, lab, dtype=dtype) for x, lab in zip(logits, labels)
+        ],
+        lambda pairs: {np.asarray(loss).dtype for loss, _ in pairs} | {g.dtype for _, g in pairs},
+    )
+    timed(
+        "StreamingScorer",
+        lambda: [stream_loss(lp, lab, dtype) for lp, lab in zip(log_probs, labels)],
+        lambda pairs: {column.dtype for _, column in pairs},
+    )
+    timed(
+        "ctc_loss_batch",
+        lambda: ctc_loss_batch(
+            log_probs, [T] * B, targets, [targets.shape[1]] * B, blank, dtype=dtype
+        ),
+        lambda losses: {losses.dtype},
+    )
+    timed(
+        "viterbi_align_batch",
+        lambda: viterbi_align_batch(
+            log_probs, [T] * B, targets, [targets.shape[1]] * B, blank, dtype=dtype
+        ),
+        lambda alignments: {a.scores.dtype for a in alignments},
+    )
+    # The start of every target is a keyword; the first one occurs in utterance 0
+    timed(
+        "spot_keywords",
+        lambda: spot_keywords(
+            log_probs[0], list(targets[:, :KEYWORD_LENGTH]), blank, KEYWORD_THRESHOLD, dtype=dtype
+        ),
+        lambda detections: {np.asarray(d.score).dtype for d in detections},
+    )
+    if T <= DECODE_MAX_T:
+        timed(
+            "prefix_beam_search",
+            lambda: prefix_beam_search(log_probs[0], blank, dtype=dtype),
+            lambda hypotheses: {np.asarray(score).dtype for _, score in hypotheses},
+        )
+        timed(
+            "kbest",
+            lambda: list(itertools.islice(kbest(log_probs[0], blank, dtype), N_BEST)),
+            lambda hypotheses: {np.asarray(h.score).dtype for h in hypotheses}
+            | {np.asarray(h.log_prob).dtype for h in hypotheses},
+        )
+        timed(
+            "rescore",
+            lambda: rescore(log_probs[0], list(targets) + [t[:-1] for t in targets], blank, dtype),
+            lambda scores: {scores.dtype},
+        )
+    return results, dtypes, seconds
+
+
+def compare(single, double):
+    """Deviations of the float32 results from the float64 ones, per engine."""
+    deviations = {}
+    for name in ("forward_log", "backward_log", "ctc_loss_batch", "rescore"):
+        if name in double:
+            deviations[name] = relative(single[name], double[name])
+    for name, gradient in (
+        ("ctc_loss_and_grad", "gradient (per nat)"),
+        ("checkpointed gradient", "gradient (checkpointed)"),
+    ):
+        losses32 = [loss for loss, _ in single[name]]
+        losses64 = [loss for loss, _ in double[name]]
+        deviations[name] = relative(losses32, losses64)
+        deviations[gradient] = max(
+            float(np.abs(g32.astype(np.float64) - g64).max()) / max(loss, 1.0)
+            for (_, g32), (loss, g64) in zip(single[name], double[name])
+        )
+    deviations["StreamingScorer"] = relative(
+        [loss for loss, _ in single["StreamingScorer"]],
+        [loss for loss, _ in double["StreamingScorer"]],
+    )
+    # Detections must be the same occurrences; their scores are compared
+    detections32, detections64 = single["spot_keywords"], double["spot_keywords"]
+    same = [d[:3] for d in detections32] == [d[:3] for d in detections64]
+    deviations["spot_keywords"] = (
+        relative([d.score for d in detections32], [d.score for d in detections64])
+        if same
+        else np.inf
+    )
+    deviations["viterbi_align_batch"] = relative(
+        [a.log_prob for a in single["viterbi_align_batch"]],
+        [a.log_prob for a in double["viterbi_align_batch"]],
+    )
+    agreement = min(
+        float(np.mean(a32.states == a64.states))
+        for a32, a64 in zip(single["viterbi_align_batch"], double["viterbi_align_batch"])
+    )
+    if "prefix_beam_search" in double:
+        same = [h for h, _ in single["prefix_beam_search"]] == [
+            h for h, _ in double["prefix_beam_search"]
+        ]
+        deviations["prefix_beam_search"] = (
+            relative(
+                [score for _, score in single["prefix_beam_search"]],
+                [score for _, score in double["prefix_beam_search"]],
+            )
+            if same
+            else np.inf
+        )
+    if "kbest" in double:
+        deviations["kbest"] = relative(
+            [h.log_prob for h in single["kbest"]], [h.log_prob for h in double["kbest"]]
+        )
+    return deviations, agreement
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare float32 CTC scoring with float64.")
+    parser.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    worst, worst_agreement = {}, 1.0
+    speedups = {}
+    not_float32 = set()
+    print("=== FLOAT32 VS FLOAT64 ON SYNTHETIC CORPORA ===")
+    for T, U, V, B in GRIDS[args.grid]:
+        logits, targets, blank = synthetic_batch(T, U, V, B, rng)
+        double, _, seconds64 = run_engines(logits, targets, blank, np.float64)
+        single, dtypes, seconds32 = run_engines(logits, targets, blank, np.float32)
+        float32 = {np.dtype(np.float32)}
+        not_float32.update(name for name, found in dtypes.items() if found != float32)
+        deviations, agreement = compare(single, double)
+        worst_agreement = min(worst_agreement, agreement)
+
+        loss = float(np.mean(double["ctc_loss_batch"]))
+        print(f"T={T} U={U} V={V} B={B}, mean float64 loss {loss:.1f}")
+        for name, deviation in deviations.items():
+            worst[name] = max(worst.get(name, 0.0), deviation)
+            timing = ""
+            if name in seconds32:
+                speedup = seconds64[name] / seconds32[name]
+                speedups.setdefault(name, []).append(speedup)
+                timing = f", float32 {speedup:.2f}x as fast"
+            print(f"  {name:<24} max deviation {deviation:.2e}{timing}")
+        print(f"  {'viterbi path':<24} {agreement:.2%} of frames in the same state")
+
+    # Reported, not checked: the recurrences step through one frame at a time,
+    # and at these sizes the per-step NumPy call overhead costs as much as the
+    # arithmetic, so float32 saves memory more reliably than time
+    print()
+    print("=== FLOAT32 SPEED (float64 time / float32 time) ===")
+    for name, values in speedups.items():
+        print(f"  {name:<24} {min(values):.2f}x .. {max(values):.2f}x")
+
+    print()
+    print("=== MEASURED BOUNDS ===")
+    for name, deviation in worst.items():
+        print(f"  {name:<24} max deviation {deviation:.2e} (tolerance {tolerance(name):.0e})")
+    print(
+        f"  {'viterbi path':<24} min agreement {worst_agreement:.2%} "
+        f"(at least {PATH_AGREEMENT:.0%})"
+    )
+    print(f"  every float32 result stays float32: {not not_float32}")
+    if not_float32:
+        print(f"  not float32: {', '.join(sorted(not_float32))}")
+    bounds_ok = all(deviation < tolerance(name) for name, deviation in worst.items())
+    print(f"  Match: {bounds_ok and not not_float32 and worst_agreement >= PATH_AGREEMENT}")
+
+
+if __name__ == "__main__":
+    main()